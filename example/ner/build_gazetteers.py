@@ -4,7 +4,8 @@ from pathlib import Path
 
 import requests
 
-from webstruct.gazetteers.geonames import read_geonames_zipped, to_dawg
+from webstruct.gazetteers.build import build_gazetteers, contact_targets
+from webstruct.utils import TextNormalizer
 
 
 FILES = [
@@ -28,61 +29,24 @@ def download_geonames():
         path.write_bytes(requests.get(url).content)
 
 
-def _compile_cities(path: Path, lowercase: bool=False):
-    out_path = path.with_suffix('.dafsa')
-    # if out_path.exists():
-    #     return
-    print("reading {}".format(path))
-    df = read_geonames_zipped(str(path))
-    if lowercase:
-        df = _to_lower(df)
-    print("compiling {}".format(out_path))
-    dawg = to_dawg(df)
-    dawg.save(str(out_path))
-
-
-def _to_lower(df):
-    return df.assign(
-        main_name=df.main_name.str.lower(),
-        asciiname=df.asciiname.str.lower(),
-        alternatenames=df.alternatenames.str.lower(),
-    )
-
-
-def _read_full():
-    path = DATA_ROOT / 'allCountries.zip'
-    print("reading {}".format(path))
-    return read_geonames_zipped(str(path))
-
-
-def _compile_adm(df):
-    codes = ['ADM1', 'ADM2', 'ADM3', 'ADM4']
-    out_paths = [DATA_ROOT / "{}.dafsa".format(code.lower()) for code in codes]
-    # if all(p.exists() for p in out_paths):
-    #     return
-    for code, out_path in zip(codes, out_paths):
-        # if out_path.exists():
-        #     continue
-        print("compiling {}".format(out_path))
-        df_adm = df[df.feature_code == code]
-        dawg = to_dawg(df_adm)
-        dawg.save(str(out_path))
-
-
-def compile_gazetteers_contacts(lowercase=False):
+def compile_gazetteers_contacts(normalization=None, n_jobs=-1):
     """ Compile geonames data downloaded by ``download_geonames``. """
-    for name in ['cities1000.zip', 'cities5000.zip', 'cities15000.zip']:
-        _compile_cities(DATA_ROOT / name, lowercase=lowercase)
-    df = _read_full()
-    if lowercase:
-        df = _to_lower(df)
-    _compile_adm(df)
+    targets = contact_targets(format='dawg', normalization=normalization)
+    build_gazetteers(targets, str(DATA_ROOT), n_jobs=n_jobs)
 
 
 if __name__ == '__main__':
     p = argparse.ArgumentParser()
-    p.add_argument('--lower', action="store_true")
+    p.add_argument('--casefold', action="store_true")
+    p.add_argument('--strip-diacritics', action="store_true")
+    p.add_argument('--collapse-punctuation', action="store_true")
+    p.add_argument('--jobs', '-j', type=int, default=-1)
     args = p.parse_args()
 
     download_geonames()
-    compile_gazetteers_contacts(args.lower)
\ No newline at end of file
+    normalization = TextNormalizer.from_spec({
+        'casefold': args.casefold,
+        'strip_diacritics': args.strip_diacritics,
+        'collapse_punctuation': args.collapse_punctuation,
+    })
+    compile_gazetteers_contacts(normalization, args.jobs)
\ No newline at end of file
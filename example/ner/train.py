@@ -76,17 +76,12 @@ GLOBAL_FEATURES = [
 ]
 
 
-class LowercaseDAWGGlobalFeature(features.DAWGGlobalFeature):
-    def __call__(self, doc):
-        token_strings = [tok.token.lower() for tok, feat in doc]
-        for start, end, matched_text in self.lm.find_ranges(token_strings):
-            self.process_range(doc, start, end, matched_text)
-
-
 def _gazetteer_feature(filename: str, name: str) -> features.DAWGGlobalFeature:
+    # Gazetteers built with normalization options (e.g.
+    # ``build_gazetteers.py --casefold``) store them in metadata,
+    # and document tokens are normalized in the same way.
     file_path = GAZETTEER_DATA / filename
     return features.DAWGGlobalFeature(str(file_path), name)
-    # return LowercaseDAWGGlobalFeature(str(file_path), name)
 
 
 class ContactsModel:
@@ -98,12 +93,14 @@ class ContactsModel:
 
     def get_crf_pipeline(self):
         GAZETTEER_FEATURES = [
-            features.LongestMatchGlobalFeature(load_countries(), 'COUNTRY'),
-            _gazetteer_feature('cities1000.dafsa', 'CITY-1000'),
-            _gazetteer_feature('cities5000.dafsa', 'CITY-5000'),
-            _gazetteer_feature('cities15000.dafsa', 'CITY-15000'),
-            _gazetteer_feature('adm1.dafsa', 'ADM1'),
-            # _gazetteer_feature('adm2.dafsa', 'ADM2'),
+            features.MultiGazetteerGlobalFeature([
+                features.LongestMatchGlobalFeature(load_countries(), 'COUNTRY'),
+                _gazetteer_feature('cities1000.dafsa', 'CITY-1000'),
+                _gazetteer_feature('cities5000.dafsa', 'CITY-5000'),
+                _gazetteer_feature('cities15000.dafsa', 'CITY-15000'),
+                _gazetteer_feature('adm1.dafsa', 'ADM1'),
+                # _gazetteer_feature('adm2.dafsa', 'ADM2'),
+            ]),
         ]
         pipe = webstruct.create_crfsuite_pipeline(
             token_features=TOKEN_FEATURES,
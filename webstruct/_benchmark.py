@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers shared by benchmarking scripts.
+"""
+from __future__ import absolute_import, print_function, division
+import os
+import gc
+import glob
+import time
+import multiprocessing
+
+import webstruct.webannotator
+from webstruct.loaders import WebAnnotatorLoader
+
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "..", "webstruct_data",
+                           "corpus")
+
+
+def corpus_paths(pattern="business_pages/wa/*.html"):
+    return sorted(glob.glob(os.path.join(CORPUS_PATH, pattern)))
+
+
+def iter_corpus_trees(pattern="business_pages/wa/*.html"):
+    """ Load annotated trees from the bundled corpus one by one """
+    paths = corpus_paths(pattern)
+    with open(paths[0], 'rb') as sample_reader:
+        colors = webstruct.webannotator.EntityColors.from_htmlbytes(sample_reader.read())
+        entities = [typ for typ in colors]
+
+    loader = WebAnnotatorLoader(known_entities=entities)
+    for path in paths:
+        yield loader.load(path)
+
+
+def load_corpus_trees(pattern="business_pages/wa/*.html"):
+    """ Load annotated trees from the bundled corpus """
+    return list(iter_corpus_trees(pattern))
+
+
+def measure(func, *args):
+    """
+    Run ``func(*args)`` in a forked process; return a
+    ``(seconds, peak_memory_bytes)`` tuple. Peak memory is the growth
+    of process resident set size over its size before the call;
+    it is None on systems without Linux-style ``/proc``.
+    RuntimeError is raised if the process dies (e.g. it is killed
+    because it is out of memory).
+    """
+    ctx = multiprocessing.get_context('fork')
+    reader, writer = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_measure_child, args=(writer, func, args))
+    proc.start()
+    writer.close()
+    try:
+        result = reader.recv()
+    except EOFError:
+        proc.join()
+        raise RuntimeError("process exited with code %s" % proc.exitcode)
+    proc.join()
+    return result
+
+
+def format_bytes(num):
+    if num is None:
+        return 'n/a'
+    return '%0.1fMB' % (num / 2**20)
+
+
+def _measure_child(writer, func, args):
+    gc.collect()
+    rss_before = _reset_peak_rss()
+    start = time.time()
+    func(*args)
+    elapsed = time.time() - start
+    peak = _read_status_kb('VmHWM')
+    if rss_before is None or peak is None:
+        writer.send((elapsed, None))
+    else:
+        writer.send((elapsed, (peak - rss_before) * 1024))
+
+
+def _reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except (IOError, OSError):
+        return None
+    return _read_status_kb('VmRSS')
+
+
+def _read_status_kb(field):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        pass
+    return None
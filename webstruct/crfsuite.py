@@ -8,9 +8,48 @@ CRFsuite_ backend for webstruct based on python-crfsuite_ and sklearn-crfsuite_.
 
 """
 from __future__ import absolute_import
+from itertools import tee
+
+from six.moves import collections_abc
+from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.pipeline import Pipeline
 
 from webstruct import HtmlFeatureExtractor
+from webstruct.feature_hashing import HashedFeatures
+from webstruct.feature_matrix import FeatureMatrix
+
+
+class CRFsuiteFeatureEncoder(BaseEstimator, TransformerMixin):
+    """
+    Pipeline step which converts compact features to data python-crfsuite
+    understands: a :class:`~.FeatureMatrix` or a list
+    of :class:`~.HashedFeatures` becomes a sequence
+    of ``pycrfsuite.ItemSequence`` instances which are created when they
+    are accessed, without feature dicts. Lists of feature dicts are
+    returned unchanged.
+    """
+    def fit(self, X, y=None):
+        return self
+
+    def transform(self, X):
+        if isinstance(X, FeatureMatrix):
+            return X.to_crfsuite()
+        if len(X) and isinstance(X[0], HashedFeatures):
+            return _HashedItemSequences(X)
+        return X
+
+
+class _HashedItemSequences(collections_abc.Sequence):
+    def __init__(self, X):
+        self.X = X
+
+    def __len__(self):
+        return len(self.X)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [doc.to_crfsuite() for doc in self.X[idx]]
+        return self.X[idx].to_crfsuite()
 
 
 class CRFsuitePipeline(Pipeline):
@@ -18,6 +57,8 @@ class CRFsuitePipeline(Pipeline):
     A pipeline for HTML tagging using CRFsuite. It combines
     a feature extractor and a CRF; they are available
     as :attr:`fe` and :attr:`crf` attributes for easier access.
+    Features are passed to the CRF through :class:`CRFsuiteFeatureEncoder`,
+    so hashed features and feature matrices are supported.
 
     In addition to that, this class adds support for X_dev/y_dev arguments
     for :meth:`fit` and :meth:`fit_transform` methods - they work as expected,
@@ -28,23 +69,29 @@ class CRFsuitePipeline(Pipeline):
         self.crf = crf
         super(CRFsuitePipeline, self).__init__([
             ('vec', self.fe),
+            ('crfsuite', CRFsuiteFeatureEncoder()),
             ('clf', self.crf),
         ])
 
     def fit(self, X, y=None, **fit_params):
         X_dev = fit_params.pop('X_dev', None)
         if X_dev is not None:
-            fit_params['clf__X_dev'] = self.fe.transform(X_dev)
+            fit_params['clf__X_dev'] = self._transform_dev(X_dev)
             fit_params['clf__y_dev'] = fit_params.pop('y_dev', None)
         return super(CRFsuitePipeline, self).fit(X, y, **fit_params)
 
     def fit_transform(self, X, y=None, **fit_params):
         X_dev = fit_params.pop('X_dev', None)
         if X_dev is not None:
-            fit_params['clf__X_dev'] = self.fe.transform(X_dev)
+            fit_params['clf__X_dev'] = self._transform_dev(X_dev)
             fit_params['clf__y_dev'] = fit_params.pop('y_dev', None)
         return super(CRFsuitePipeline, self).fit_transform(X, y, **fit_params)
 
+    def _transform_dev(self, X_dev):
+        for name, step in self.steps[:-1]:
+            X_dev = step.transform(X_dev)
+        return X_dev
+
 
 def create_crfsuite_pipeline(token_features=None,
                              global_features=None,
@@ -95,3 +142,40 @@ def create_crfsuite_pipeline(token_features=None,
     crf = CRF(**crf_kwargs)
 
     return CRFsuitePipeline(fe, crf)
+
+
+def iter_crfsuite_data(trees, html_tokenizer, feature_extractor):
+    """
+    Lazily convert HTML trees to CRFsuite data. Return ``(X, y)`` tuple of
+    iterators: ``X`` yields ``pycrfsuite.ItemSequence`` instances
+    and ``y`` yields lists of tags. Each tree is tokenized, and its features
+    are extracted and converted to an ItemSequence only when it is needed,
+    so when ``trees`` is an iterator (e.g. a result of
+    :func:`webstruct.loaders.load_trees`) memory usage is bounded
+    by a single document.
+
+    ``X`` and ``y`` must be consumed in lockstep, e.g. using ``zip``;
+    sklearn_crfsuite.CRF does it in its ``fit`` method, but it needs
+    ``len(X)`` when ``verbose`` is True, so use ``verbose=False``::
+
+        X, y = iter_crfsuite_data(
+            webstruct.load_trees("train/*.html", webstruct.WebAnnotatorLoader()),
+            html_tokenizer,
+            model.fe,
+        )
+        model.crf.fit(X, y)
+
+    Note that ``min_df`` option of ``feature_extractor`` is not applied.
+    """
+    from pycrfsuite import ItemSequence
+
+    def _iter_data():
+        for html_tokens, tags in html_tokenizer.iter_tokenize(trees):
+            features = feature_extractor.transform_single(html_tokens)
+            if isinstance(features, HashedFeatures):
+                yield features.to_crfsuite(), tags
+            else:
+                yield ItemSequence(features), tags
+
+    X_data, y_data = tee(_iter_data())
+    return (xseq for xseq, tags in X_data), (tags for xseq, tags in y_data)
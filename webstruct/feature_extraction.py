@@ -35,12 +35,35 @@ Usually, the approach is the following:
 
 """
 from __future__ import absolute_import, print_function
+import copy
+import functools
+import multiprocessing
 from itertools import chain
 from collections import Counter
-from six.moves import zip
+from six.moves import zip, collections_abc
+
+import numpy as np
 
 from sklearn.base import BaseEstimator, TransformerMixin
-from webstruct.utils import merge_dicts
+from webstruct.utils import (
+    merge_dicts,
+    LRUCache,
+    effective_n_jobs,
+    uses_fork,
+)
+from webstruct.html_tokenizer import detach_html_tokens
+from webstruct.features.global_features import fuse_patterns, DocumentTokens
+from webstruct.feature_hashing import (
+    FeatureHasher,
+    hashed_document_frequency,
+    prune_hashed_document,
+)
+from webstruct.features.utils import (
+    get_feature_scope,
+    apply_features,
+    TEXT_SCOPE,
+    BLOCK_SCOPE,
+)
 
 
 class HtmlFeatureExtractor(BaseEstimator, TransformerMixin):
@@ -74,6 +97,10 @@ class HtmlFeatureExtractor(BaseEstimator, TransformerMixin):
             >>> def current_token(html_token):
             ...     return {'tok': html_token.token}
 
+        A feature function can also have a batch implementation which
+        processes all tokens of a document at once, see
+        :func:`~webstruct.features.utils.batch_implementation`.
+
         :mod:`webstruct.features` module provides some predefined feature
         functions, e.g. :func:`parent_tag <webstruct.features.block_features.parent_tag>`
         which returns token's parent tag.
@@ -110,52 +137,282 @@ class HtmlFeatureExtractor(BaseEstimator, TransformerMixin):
 
         They should change feature dicts ``feature_dict`` inplace.
 
+        Consecutive :class:`~webstruct.features.global_features.Pattern`
+        global features are computed together, in a single pass
+        (see :class:`~webstruct.features.global_features.PatternSet`).
+
+        The list is a
+        :class:`~webstruct.features.global_features.DocumentTokens`
+        instance; gazetteer features use its cache to share normalized
+        token strings.
+
     min_df : integer or Mapping, optional
         Feature values that have a document frequency strictly
-        lower than the given threshold are removed.
+        lower than the given threshold are removed by :meth:`fit_transform`
+        and :meth:`iter_fit_transform`.
         If ``min_df`` is integer, its value is used as threshold.
-
-        TODO: if ``min_df`` is a dictionary, it should map feature names
-        to thresholds.
+        If ``min_df`` is a Mapping, it maps feature names to thresholds;
+        features with other names are not removed. A Mapping can't be used
+        with ``hashing``, as hashed features don't have names.
+
+    text_cache_size : integer, optional
+        Token feature functions marked with
+        :func:`~webstruct.features.utils.text_feature` depend only on
+        token text, so their merged results are cached per token text,
+        and shared by all documents. This is the maximum number of
+        token texts in this cache (least recently used are evicted);
+        0 disables caching.
+
+        Token feature functions marked with
+        :func:`~webstruct.features.utils.block_feature` are called once
+        per text block. Results of all token feature functions are
+        merged in order, whatever their scope.
+
+    sparse : boolean, optional
+        If True, False and None values returned by token feature functions
+        are dropped when results are merged, so feature dicts contain
+        only features which are present (a False or None value removes
+        a feature set by a previous function); e.g. built-in boolean
+        features are kept only when they are true. This changes features
+        seen by models and by :class:`~webstruct.features.Pattern`
+        (a missing feature is ``_NA_``, not ``False``), so models trained
+        with ``sparse=False`` must be retrained. Default is False.
+
+    hashing : integer, optional
+        If it is 32 or 64, each document is returned as
+        a :class:`~webstruct.feature_hashing.HashedFeatures` instance
+        (compact arrays of feature ids and weights) instead of a list
+        of feature dicts; feature ids are stable 32-bit or 64-bit hashes
+        of feature names and values (see :mod:`webstruct.feature_hashing`).
+        ``min_df`` is applied to feature ids.
+        :class:`~webstruct.crfsuite.CRFsuitePipeline` passes hashed
+        features to CRFsuite without creating feature dicts.
+        Default is None (return feature dicts).
+
+    n_jobs : integer, optional
+        Number of worker processes used by :meth:`transform` and
+        :meth:`fit_transform` (-1 means "use all CPUs"); default is 1.
+        Feature dicts are pickled by workers and unpickled in the main
+        process, which takes a noticeable share of the time needed
+        to extract them; with ``hashing`` workers send back compact
+        arrays instead, so this overhead is much smaller.
+        Workers share documents with the main process if the "fork"
+        start method of :mod:`multiprocessing` is used; otherwise documents
+        are sent to workers as
+        :class:`~webstruct.html_tokenizer.DetachedHtmlToken` lists,
+        so feature functions get detached tokens (without lxml elements).
+        Each worker gets a copy of the extractor once, when it starts;
+        gazetteer files are loaded once per worker. Document frequencies
+        for ``min_df`` are counted by workers for their chunks; they are
+        summed and rare features are removed in the main process.
+        :meth:`iter_transform` and :meth:`iter_fit_transform` always
+        use a single process.
 
     """
-    def __init__(self, token_features, global_features=None, min_df=1):
+    def __init__(self, token_features, global_features=None, min_df=1,
+                 text_cache_size=100000, sparse=False, hashing=None,
+                 n_jobs=1):
         self.token_features = token_features
         self.global_features = global_features or []
         self.min_df = min_df
+        self.text_cache_size = text_cache_size
+        self.sparse = sparse
+        self.hashing = hashing
+        self.n_jobs = n_jobs
+        self._text_cache = None
+        self._hasher = None
+        self._fused_global_features = None
 
     def fit(self, html_token_lists, y=None):
         self.fit_transform(html_token_lists)
         return self
 
     def fit_transform(self, html_token_lists, y=None, **fit_params):
+        n_jobs = effective_n_jobs(self.n_jobs)
+        if n_jobs != 1:
+            X, cnt = self._transform_parallel(html_token_lists, n_jobs,
+                                              count_df=self._prunes())
+            return self._pruned(X, cnt)
         X = [self.transform_single(html_tokens) for html_tokens in html_token_lists]
-        return self._pruned(X, low=self.min_df)
+        return self._pruned(X)
+
+    def iter_fit_transform(self, html_token_lists):
+        """
+        Streaming version of :meth:`fit_transform`: return an iterator
+        over documents with rare features removed, one document at a time.
+
+        ``html_token_lists`` is iterated twice, so it must be re-iterable
+        (e.g. a list, or an object which loads documents again each time
+        it is iterated): document frequencies of features are counted in the
+        first pass (when this method is called), and features are extracted
+        again in the second pass. Use it to get features of a large
+        corpus with ``min_df`` without holding all features in memory::
+
+            X = FeatureMatrix.from_dicts(fe.iter_fit_transform(html_token_lists))
+        """
+        if not self._prunes():
+            return self.iter_transform(html_token_lists)
+        prune = self._get_pruner(
+            self._document_frequency(self.iter_transform(html_token_lists)))
+        return (prune(doc) for doc in self.iter_transform(html_token_lists))
 
     def transform(self, html_token_lists):
-        return [self.transform_single(html_tokens) for html_tokens in html_token_lists]
+        n_jobs = effective_n_jobs(self.n_jobs)
+        if n_jobs != 1:
+            X, _ = self._transform_parallel(html_token_lists, n_jobs)
+            return X
+        return list(self.iter_transform(html_token_lists))
+
+    def iter_transform(self, html_token_lists):
+        """
+        Generator version of :meth:`transform`: yield a list of feature
+        dicts for each document, one document at a time.
+        Note that ``min_df`` is not applied here, as in :meth:`transform`.
+
+        Use :meth:`FeatureMatrix.from_dicts(fe.iter_transform(...))
+        <webstruct.feature_matrix.FeatureMatrix.from_dicts>`
+        to get compact features of a large corpus.
+        """
+        for html_tokens in html_token_lists:
+            yield self.transform_single(html_tokens)
 
     def transform_single(self, html_tokens):
         feature_func = _CombinedFeatures(*self.token_features)
-        token_data = list(zip(html_tokens, map(feature_func, html_tokens)))
+        text_cache = self._get_text_cache(feature_func)
+        feature_dicts = feature_func.transform(html_tokens, text_cache,
+                                               sparse=self.sparse)
+        token_data = DocumentTokens(zip(html_tokens, feature_dicts))
 
-        for feat in self.global_features:
+        for feat in self._get_global_features():
             feat(token_data)
 
-        return [featdict for tok, featdict in token_data]
-
-    def _pruned(self, X, low=None):
-        if low is None or low <= 1:
+        feature_dicts = [featdict for tok, featdict in token_data]
+        if self.hashing:
+            return self._get_hasher().transform_single(feature_dicts)
+        return feature_dicts
+
+    def _transform_parallel(self, html_token_lists, n_jobs, count_df=False):
+        # Workers get a single-process copy of the extractor in the pool
+        # initializer, so global features are unpickled (and gazetteers
+        # are loaded) once per worker, not for each task. Each task is
+        # a chunk of documents; a worker returns their features and,
+        # if needed, a Counter with their document frequencies.
+        #
+        # With the "fork" start method workers share documents with
+        # the current process and tasks are just index ranges; otherwise
+        # documents are detached and pickled.
+        docs = list(html_token_lists)
+        chunksize = max(1, min(16, len(docs) // (n_jobs * 4)))
+        ranges = [(i, i + chunksize) for i in range(0, len(docs), chunksize)]
+        if uses_fork():
+            shared_docs, func, tasks = docs, _transform_range, ranges
+        else:
+            shared_docs, func = None, _transform_docs
+            tasks = ([detach_html_tokens(html_tokens) for html_tokens in docs[i:j]]
+                     for i, j in ranges)
+
+        extractor = copy.copy(self)
+        extractor.n_jobs = 1
+        pool = multiprocessing.Pool(n_jobs, _init_feature_worker,
+                                    (extractor, count_df, shared_docs))
+        X, cnt = [], Counter() if count_df else None
+        try:
+            for chunk_X, chunk_cnt in pool.imap(func, tasks):
+                X.extend(chunk_X)
+                if count_df:
+                    cnt.update(chunk_cnt)
+        finally:
+            pool.terminate()
+            pool.join()
+        return X, cnt
+
+    def _get_hasher(self):
+        hasher = getattr(self, '_hasher', None)
+        if hasher is None or hasher.bits != self.hashing:
+            hasher = self._hasher = FeatureHasher(self.hashing)
+        return hasher
+
+    def _get_global_features(self):
+        # consecutive patterns are fused once; the result is rebuilt
+        # if global features are changed
+        key = tuple(self.global_features)
+        fused_key, fused = (getattr(self, '_fused_global_features', None) or
+                            (None, None))
+        if fused_key != key:
+            fused = fuse_patterns(key)
+            self._fused_global_features = (key, fused)
+        return fused
+
+    def _get_text_cache(self, feature_func):
+        if not self.text_cache_size or not feature_func.text_groups:
+            return None
+        # cache is invalidated if a set of feature functions is changed
+        key = (feature_func.text_cache_key, self.sparse)
+        cache_key, cache = getattr(self, '_text_cache', None) or (None, None)
+        if cache_key != key or cache.maxsize != self.text_cache_size:
+            cache = LRUCache(self.text_cache_size)
+            self._text_cache = (key, cache)
+        return cache
+
+    def __getstate__(self):
+        dct = self.__dict__.copy()
+        dct['_text_cache'] = None
+        dct['_fused_global_features'] = None
+        return dct
+
+    def __setstate__(self, state):
+        # extractors pickled by older versions don't have
+        # attributes for parameters added later
+        for name, value in [('text_cache_size', 100000), ('sparse', False),
+                            ('hashing', None), ('n_jobs', 1)]:
+            state.setdefault(name, value)
+        self.__dict__.update(state)
+
+    def _prunes(self):
+        """ Return True if ``min_df`` can remove features """
+        if isinstance(self.min_df, collections_abc.Mapping):
+            if self.hashing:
+                raise ValueError("min_df thresholds for feature names "
+                                 "can't be used with hashed features")
+            return any(low > 1 for low in self.min_df.values())
+        return self.min_df is not None and self.min_df > 1
+
+    def _pruned(self, X, cnt=None):
+        if not self._prunes():
             return X
-        cnt = self._document_frequency(X)
-        keep = {k for (k, v) in cnt.items() if v >= low}
+        if cnt is None:
+            cnt = self._document_frequency(X)
+        prune = self._get_pruner(cnt)
         del cnt
-        return [
-            [{k: v for k, v in fd.items() if (k, v) in keep} for fd in doc]
-            for doc in X
-        ]
+        # documents are replaced one by one to avoid having
+        # two copies of all features in memory
+        for idx, doc in enumerate(X):
+            X[idx] = prune(doc)
+        return X
+
+    def _get_pruner(self, cnt):
+        """
+        Return a function which removes features with document frequency
+        lower than ``min_df`` from a document, given a Counter with
+        document frequencies.
+        """
+        min_df = self.min_df
+        if isinstance(min_df, collections_abc.Mapping):
+            keep = {f for (f, df) in cnt.items() if df >= min_df.get(f[0], 1)}
+        else:
+            keep = {f for (f, df) in cnt.items() if df >= min_df}
+
+        if self.hashing:
+            keep = np.sort(np.fromiter(keep, dtype=np.uint64, count=len(keep)))
+            return functools.partial(prune_hashed_document, keep=keep)
+
+        def prune(doc):
+            return [{k: v for k, v in fd.items() if (k, v) in keep} for fd in doc]
+        return prune
 
     def _document_frequency(self, X):
+        if self.hashing:
+            return hashed_document_frequency(X)
         cnt = Counter()
         for doc in X:
             seen_features = set(chain.from_iterable(fd.items() for fd in doc))
@@ -163,6 +420,29 @@ class HtmlFeatureExtractor(BaseEstimator, TransformerMixin):
         return cnt
 
 
+_worker_extractor = None
+_worker_count_df = False
+_worker_docs = None
+
+
+def _init_feature_worker(extractor, count_df, docs):
+    global _worker_extractor, _worker_count_df, _worker_docs
+    _worker_extractor = extractor
+    _worker_count_df = count_df
+    _worker_docs = docs
+
+
+def _transform_range(task):
+    start, end = task
+    return _transform_docs(_worker_docs[start:end])
+
+
+def _transform_docs(docs):
+    X = [_worker_extractor.transform_single(html_tokens) for html_tokens in docs]
+    cnt = _worker_extractor._document_frequency(X) if _worker_count_df else None
+    return X, cnt
+
+
 class _CombinedFeatures(object):
     """
     Utility for combining several feature functions::
@@ -177,7 +457,182 @@ class _CombinedFeatures(object):
     """
     def __init__(self, *feature_funcs):
         self.feature_funcs = list(feature_funcs)
+        # consecutive functions of the same scope form a group;
+        # groups are applied in order
+        self.groups = []
+        for func in self.feature_funcs:
+            scope = get_feature_scope(func)
+            if scope not in (TEXT_SCOPE, BLOCK_SCOPE):
+                scope = None
+            if self.groups and self.groups[-1][0] == scope:
+                self.groups[-1][1].append(func)
+            else:
+                self.groups.append((scope, [func]))
+        self.text_groups = tuple(tuple(funcs) for scope, funcs in self.groups
+                                 if scope == TEXT_SCOPE)
+
+    @property
+    def text_cache_key(self):
+        """
+        A key which changes when cached results of text feature functions
+        may change (if ``sparse`` is the same).
+        """
+        return self.text_groups, self.groups[0][0] == TEXT_SCOPE
 
     def __call__(self, *args, **kwargs):
         features = [f(*args, **kwargs) for f in self.feature_funcs]
         return merge_dicts(*features)
+
+    def transform(self, html_tokens, text_cache=None, sparse=False):
+        """
+        Return a list of feature dicts for ``html_tokens``; results of
+        feature functions are merged in order. Merged results of
+        consecutive text feature functions are looked up in
+        ``text_cache`` (if it is not None) by token text; block feature
+        functions are called once for each text block. Batch
+        implementations of feature functions are used when available.
+        If ``sparse`` is True, False and None values are dropped
+        (see :func:`~.apply_features`).
+        """
+        text_features = self._text_features(html_tokens, text_cache, sparse)
+        text_idx = 0
+        blocks = None
+        feature_dicts = None
+        for group_idx, (scope, funcs) in enumerate(self.groups):
+            if scope is None:
+                feature_dicts = apply_features(funcs, html_tokens,
+                                               feature_dicts, sparse)
+                continue
+
+            if scope == TEXT_SCOPE:
+                results = [featdicts[text_idx] for featdicts in text_features]
+                text_idx += 1
+            else:
+                if blocks is None:
+                    blocks = _find_blocks(html_tokens)
+                results = _block_features(blocks, funcs, sparse,
+                                          first=group_idx == 0)
+            if feature_dicts is None:
+                # cached dicts are copied because global features change them
+                feature_dicts = [dict(featdict) for featdict in results]
+            else:
+                _update_dicts(feature_dicts, results)
+
+        if feature_dicts is None:
+            feature_dicts = [{} for _ in html_tokens]
+        return feature_dicts
+
+    def _text_features(self, html_tokens, text_cache, sparse=False):
+        """
+        Return a list with a tuple for each token; it contains merged
+        results of each group of text feature functions (see
+        :func:`_group_results`). Tuples may be shared with ``text_cache``.
+        """
+        if not self.text_groups:
+            return [()] * len(html_tokens)
+        if text_cache is None:
+            return self._apply_text_groups(html_tokens, sparse)
+
+        text_features = []
+        missing = {}  # token text -> indices of tokens with this text
+        for idx, html_token in enumerate(html_tokens):
+            featdicts = text_cache.get(html_token.token)
+            if featdicts is None:
+                missing.setdefault(html_token.token, []).append(idx)
+            text_features.append(featdicts)
+
+        if missing:
+            texts = list(missing)
+            first_tokens = [html_tokens[missing[text][0]] for text in texts]
+            results = self._apply_text_groups(first_tokens, sparse)
+            for text, featdicts in zip(texts, results):
+                text_cache[text] = featdicts
+                for idx in missing[text]:
+                    text_features[idx] = featdicts
+        return text_features
+
+    def _apply_text_groups(self, html_tokens, sparse):
+        first = self.groups[0][0] == TEXT_SCOPE
+        results = [
+            _group_results(funcs, html_tokens, sparse, first and idx == 0)
+            for idx, funcs in enumerate(self.text_groups)
+        ]
+        return list(zip(*results))
+
+
+def _find_blocks(html_tokens):
+    """
+    Return a list with a detached first token of each text block
+    of ``html_tokens`` and a list with sizes of these blocks.
+    """
+    first_tokens, block_sizes = [], []
+    last_key = None
+    for html_token in html_tokens:
+        key = _block_key(html_token)
+        if first_tokens and key == last_key:
+            block_sizes[-1] += 1
+        else:
+            first_tokens.append(html_token)
+            block_sizes.append(1)
+            last_key = key
+    return detach_html_tokens(first_tokens), block_sizes
+
+
+def _block_features(blocks, funcs, sparse=False, first=True):
+    """
+    Return a list with merged results of block feature functions
+    ``funcs`` for each token of ``blocks`` (see :func:`_find_blocks`
+    and :func:`_group_results`); tokens from the same block share results.
+    """
+    first_tokens, block_sizes = blocks
+    featdicts = _group_results(funcs, first_tokens, sparse, first)
+    block_features = []
+    for featdict, size in zip(featdicts, block_sizes):
+        block_features.extend([featdict] * size)
+    return block_features
+
+
+def _group_results(funcs, html_tokens, sparse, first):
+    """
+    Return merged results of a group of feature functions ``funcs``
+    for each token. Results of the ``first`` group are feature dicts;
+    results of other groups are ``(features, removed_keys)`` tuples
+    for :func:`_update_dicts`: with ``sparse=True`` False and None values
+    of later groups remove features set by earlier groups.
+    """
+    featdicts = apply_features(funcs, html_tokens, sparse=sparse and first)
+    if first:
+        return featdicts
+    if not sparse:
+        return [(featdict, ()) for featdict in featdicts]
+    results = []
+    for featdict in featdicts:
+        present = {key: value for key, value in featdict.items()
+                   if value is not None and value is not False}
+        removed = [key for key in featdict if key not in present]
+        results.append((present, removed))
+    return results
+
+
+def _update_dicts(feature_dicts, results):
+    """
+    Update each dict in ``feature_dicts`` with a corresponding
+    ``(features, removed_keys)`` tuple from ``results``.
+    """
+    for featdict, (features, removed_keys) in zip(feature_dicts, results):
+        featdict.update(features)
+        for key in removed_keys:
+            featdict.pop(key, None)
+
+
+def _block_key(html_token):
+    """
+    Return a key which is the same for consecutive tokens of a text block
+    (text or tail of an HTML element). Detached tokens don't have
+    elements, but tokens of a block share ``tokens`` list
+    (see :func:`~webstruct.html_tokenizer.detach_html_tokens`).
+    """
+    elem = getattr(html_token, 'elem', None)
+    if elem is None:
+        return id(html_token.tokens), html_token.is_tail
+    return elem, html_token.is_tail
@@ -0,0 +1,73 @@
+from __future__ import print_function, division
+import timeit
+import functools
+
+from webstruct.html_tokenizer import HtmlTokenizer
+from webstruct.feature_extraction import HtmlFeatureExtractor
+from webstruct.features import EXAMPLE_TOKEN_FEATURES, Pattern
+from webstruct.feature_matrix import FeatureMatrix
+from webstruct._benchmark import load_corpus_trees
+
+# global features from example/ner/train.py
+PATTERNS = [
+    Pattern((-1, 'lower')),
+    Pattern((-2, 'lower')),
+    Pattern((-2, 'lower'), (-1, 'lower')),
+    Pattern((+1, 'lower')),
+    Pattern((-1, 'suffix4')),
+    Pattern((+1, 'prefix4')),
+    Pattern((-1, 'shape')),
+    Pattern((-1, 'shape'), (-2, 'shape')),
+    Pattern((+1, 'shape')),
+]
+
+
+def main():
+    from sklearn_crfsuite import CRF
+
+    X, y = HtmlTokenizer().tokenize(load_corpus_trees(), copy=False)
+
+    fe = HtmlFeatureExtractor(EXAMPLE_TOKEN_FEATURES, text_cache_size=0)
+    print("transform, no text cache: %0.2fs" % timeit.timeit(
+        functools.partial(fe.transform, X), number=1))
+
+    for sparse in [False, True]:
+        fe.set_params(sparse=sparse)
+        X_features = fe.transform(X)
+        n_tokens = sum(len(doc) for doc in X_features)
+        n_features = sum(len(featdict) for doc in X_features for featdict in doc)
+        print("features per token, sparse=%s: %0.1f" % (sparse, n_features / n_tokens))
+        crf = CRF(algorithm='lbfgs', max_iterations=30)
+        print("CRF.fit (lbfgs, 30 iterations), sparse=%s: %0.1fs" % (
+            sparse,
+            timeit.timeit(functools.partial(crf.fit, X_features, y), number=1)))
+        del X_features
+
+    fe = HtmlFeatureExtractor(EXAMPLE_TOKEN_FEATURES)
+    print("transform, cold text cache: %0.2fs" % timeit.timeit(
+        functools.partial(fe.transform, X), number=1))
+    print("transform, warm text cache: %0.2fs" % timeit.timeit(
+        functools.partial(fe.transform, X), number=1))
+
+    fe = HtmlFeatureExtractor(EXAMPLE_TOKEN_FEATURES, PATTERNS)
+    fe.transform(X)
+    print("transform + %d patterns, warm text cache: %0.2fs" % (
+        len(PATTERNS),
+        timeit.timeit(functools.partial(fe.transform, X), number=1)))
+
+    for hashing in [None, 32]:
+        for n_jobs in [1, 2, 4, 8]:
+            fe.set_params(n_jobs=n_jobs, min_df=2, hashing=hashing)
+            elapsed = timeit.timeit(functools.partial(fe.fit_transform, X),
+                                    number=1)
+            print("fit_transform(min_df=2, hashing=%s), n_jobs=%d: "
+                  "%0.1f pages/sec" % (hashing, n_jobs, len(X) / elapsed))
+    fe.set_params(n_jobs=1, min_df=1, hashing=None)
+
+    X_matrix = FeatureMatrix.from_dicts(fe.iter_transform(X))
+    print("FeatureMatrix: %d distinct features, %0.1fMB of arrays" % (
+        len(X_matrix.pairs), X_matrix.nbytes / 2**20))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Compact representation of token features using the "hashing trick".
+
+Each ``(name, value)`` pair of a feature dict is mapped to a feature id
+with a stable hash function (the same in all processes and Python
+versions): string values are hashed as ``name:value`` with weight 1
+(like python-crfsuite does it), numbers and booleans are hashed as
+``name`` with the value as a weight. A document becomes
+a :class:`HashedFeatures` instance with CSR-like NumPy arrays instead
+of a list of dicts.
+
+Use ``HtmlFeatureExtractor(..., hashing=32)`` (or ``hashing=64``)
+to get hashed features.
+"""
+from __future__ import absolute_import
+import zlib
+import struct
+import hashlib
+from collections import Counter
+
+import six
+import numpy as np
+
+
+class HashedFeatures(object):
+    """
+    Hashed features of a document with ``len(indptr) - 1`` tokens:
+    feature ids of i-th token are ``indices[indptr[i]:indptr[i+1]]``,
+    their weights are ``data[indptr[i]:indptr[i+1]]``.
+
+    :meth:`to_crfsuite` converts a document to
+    a ``pycrfsuite.ItemSequence`` with ``'<hex feature id>'`` attributes;
+    :class:`~webstruct.crfsuite.CRFsuitePipeline` does it for each
+    document when it is needed. Iterating over :class:`HashedFeatures`
+    yields a dict ``{'<hex feature id>': weight}`` for each token.
+    """
+    __slots__ = ['indptr', 'indices', 'data']
+
+    def __init__(self, indptr, indices, data):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def __iter__(self):
+        indptr, indices, data = self.indptr, self.indices, self.data
+        for start, end in zip(indptr[:-1].tolist(), indptr[1:].tolist()):
+            yield {u'%x' % idx: weight for idx, weight in
+                   zip(indices[start:end].tolist(), data[start:end].tolist())}
+
+    def to_crfsuite(self):
+        """
+        Return ``pycrfsuite.ItemSequence`` with features of the document.
+        Tokens with all weights equal to 1 are passed to python-crfsuite
+        as lists of attribute names, without creating dicts.
+        """
+        from pycrfsuite import ItemSequence
+        names = [u'%x' % idx for idx in self.indices.tolist()]
+        data = self.data.tolist()
+        not_unit = np.zeros(len(self.data) + 1, dtype=np.int64)
+        np.cumsum(self.data != 1, out=not_unit[1:])
+        indptr = self.indptr.tolist()
+        is_list = (not_unit[indptr[1:]] == not_unit[indptr[:-1]]).tolist()
+
+        items = []
+        for start, end, as_list in zip(indptr[:-1], indptr[1:], is_list):
+            if as_list:
+                items.append(names[start:end])
+            else:
+                items.append(dict(zip(names[start:end], data[start:end])))
+        return ItemSequence(items)
+
+    def __getstate__(self):
+        return self.indptr, self.indices, self.data
+
+    def __setstate__(self, state):
+        self.indptr, self.indices, self.data = state
+
+    def __eq__(self, other):
+        return (isinstance(other, HashedFeatures) and
+                np.array_equal(self.indptr, other.indptr) and
+                np.array_equal(self.indices, other.indices) and
+                np.array_equal(self.data, other.data))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "<HashedFeatures: %d tokens, %d features>" % (
+            len(self), len(self.indices))
+
+
+def stable_hash(text, bits=32):
+    """
+    Return a hash of unicode ``text`` which doesn't depend on a process
+    or a Python version: CRC32 for ``bits=32``, first 8 bytes
+    of MD5 digest for ``bits=64``::
+
+        >>> stable_hash(u'lower:hello')
+        860380799
+        >>> stable_hash(u'lower:hello', bits=64)
+        1465323847077221111
+    """
+    data = text.encode('utf8')
+    if bits == 32:
+        return zlib.crc32(data) & 0xffffffff
+    if bits == 64:
+        return struct.unpack('<Q', hashlib.md5(data).digest()[:8])[0]
+    raise ValueError("Unsupported number of hash bits: %r" % bits)
+
+
+class FeatureHasher(object):
+    """
+    Convert lists of feature dicts to :class:`HashedFeatures`::
+
+        >>> hasher = FeatureHasher(bits=32)
+        >>> doc = hasher.transform_single([{'lower': 'hello', 'bias': 1},
+        ...                                {'lower': 'world', 'len': 0}])
+        >>> doc.indptr.tolist(), len(doc.indices)
+        ([0, 2, 3], 3)
+
+    Features with zero weights and None values are skipped.
+    Hashes of feature names and values are cached.
+    """
+    _MAX_CACHE_SIZE = 2000000
+
+    def __init__(self, bits=32):
+        if bits not in (32, 64):
+            raise ValueError("Unsupported number of hash bits: %r" % bits)
+        self.bits = bits
+        self._cache = {}  # (name, value) -> id of a feature with weight 1
+
+    @property
+    def dtype(self):
+        return np.uint32 if self.bits == 32 else np.uint64
+
+    def transform(self, X):
+        return [self.transform_single(feature_dicts) for feature_dicts in X]
+
+    def transform_single(self, feature_dicts):
+        if len(self._cache) >= self._MAX_CACHE_SIZE:
+            self._cache.clear()
+        get_id = self._cache.__getitem__
+        indptr = [0]
+        indices = []
+        weights = {}  # position -> weight, for weights other than 1
+        for featdict in feature_dicts:
+            start = len(indices)
+            try:
+                # fast path: all features are known and have weight 1
+                indices.extend(map(get_id, featdict.items()))
+            except KeyError:
+                del indices[start:]
+                self._hash_features(featdict, indices, weights)
+            indptr.append(len(indices))
+
+        data = np.ones(len(indices), dtype=np.float32)
+        for pos, weight in weights.items():
+            data[pos] = weight
+        return HashedFeatures(
+            np.array(indptr, dtype=np.int64),
+            np.array(indices, dtype=self.dtype),
+            data,
+        )
+
+    def _hash_features(self, featdict, indices, weights):
+        for key, value in featdict.items():
+            if value is None:
+                continue
+            if isinstance(value, six.string_types):
+                text, weight = u'%s:%s' % (key, value), 1.0
+            else:
+                text, weight = key, float(value)
+                if not weight:
+                    continue
+            idx = stable_hash(text, self.bits)
+            if weight == 1.0:
+                self._cache[key, value] = idx
+            else:
+                weights[len(indices)] = weight
+            indices.append(idx)
+
+    def __getstate__(self):
+        dct = self.__dict__.copy()
+        dct['_cache'] = {}
+        return dct
+
+
+def hashed_document_frequency(X):
+    """
+    Return a Counter with the number of documents each feature id
+    of :class:`HashedFeatures` documents ``X`` occurs in.
+    """
+    cnt = Counter()
+    for doc in X:
+        cnt.update(np.unique(doc.indices).tolist())
+    return cnt
+
+
+def prune_hashed(X, keep):
+    """
+    Return a list of :class:`HashedFeatures` documents ``X`` with only
+    feature ids from ``keep`` (a collection of ids).
+    """
+    keep = np.sort(np.fromiter(keep, dtype=np.uint64, count=len(keep)))
+    return [prune_hashed_document(doc, keep) for doc in X]
+
+
+def prune_hashed_document(doc, keep):
+    """
+    Return a copy of :class:`HashedFeatures` ``doc`` with only
+    feature ids from ``keep`` (a sorted NumPy array of ids).
+    """
+    # np.isin would sort the whole ``keep`` array for each document
+    if len(keep):
+        pos = np.searchsorted(keep, doc.indices)
+        mask = keep[np.minimum(pos, len(keep) - 1)] == doc.indices
+    else:
+        mask = np.zeros(len(doc.indices), dtype=bool)
+    kept_before = np.zeros(len(mask) + 1, dtype=doc.indptr.dtype)
+    np.cumsum(mask, out=kept_before[1:])
+    return HashedFeatures(kept_before[doc.indptr], doc.indices[mask],
+                          doc.data[mask])
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+:class:`FeatureMatrix` is a compact columnar storage for token features
+of many documents. Feature ``(name, value)`` pairs are interned:
+each distinct pair is stored once, and documents are stored as NumPy
+arrays of pair ids with token and document boundaries.
+
+It can be created from feature dicts one document at a time, so
+a full list of dicts is never held in memory::
+
+    fe = HtmlFeatureExtractor(token_features, global_features)
+    X = FeatureMatrix.from_dicts(fe.iter_transform(html_token_lists))
+
+Documents of a matrix can be used as sequences of read-only feature
+dicts (see :meth:`FeatureMatrix.__getitem__`); CRFsuite data
+(:meth:`FeatureMatrix.to_crfsuite`) and Wapiti lines
+(:class:`~webstruct.wapiti.WapitiFeatureEncoder`) are created
+from matrices without creating dicts.
+"""
+from __future__ import absolute_import
+from array import array
+
+import six
+from six.moves import collections_abc
+import numpy as np
+
+
+class FeatureMatrix(object):
+    """
+    Token features of several documents.
+
+    ``pairs`` is a list of distinct ``(name, value)`` pairs;
+    ``pair_ids`` is an array with pair ids for all tokens of all
+    documents; features of token ``i`` are
+    ``pair_ids[token_ptr[i]:token_ptr[i+1]]``, and tokens of
+    document ``j`` are ``doc_ptr[j]:doc_ptr[j+1]``::
+
+        >>> X = FeatureMatrix.from_dicts([
+        ...     [{'lower': 'hello', 'bias': 1}, {'lower': 'world', 'bias': 1}],
+        ...     [{'lower': 'hello'}],
+        ... ])
+        >>> len(X), X.n_tokens, len(X.pairs)
+        (2, 3, 3)
+        >>> X.names
+        ['lower', 'bias']
+        >>> X[1][0]['lower']
+        'hello'
+        >>> [dict(featdict) for featdict in X[0]] == [
+        ...     {'lower': 'hello', 'bias': 1}, {'lower': 'world', 'bias': 1}]
+        True
+    """
+    def __init__(self, pairs, pair_ids, token_ptr, doc_ptr):
+        self.pairs = pairs
+        self.pair_ids = pair_ids
+        self.token_ptr = token_ptr
+        self.doc_ptr = doc_ptr
+        self._names = None
+        self._pair_name_ids = None
+        self._formatted = {}
+        self._crfsuite_attributes = None
+
+    @classmethod
+    def from_dicts(cls, X):
+        """
+        Create a matrix from ``X`` - an iterable of documents,
+        each being a list of feature dicts. Documents are consumed
+        one by one.
+        """
+        vocabulary = _Vocabulary()
+        pair_ids = array('i')
+        token_ptr = array('l', [0])
+        doc_ptr = array('l', [0])
+        get_id = vocabulary.__getitem__
+        for feature_dicts in X:
+            for featdict in feature_dicts:
+                values = featdict.values()
+                keys = zip(featdict.keys(), map(type, values), values)
+                pair_ids.extend(map(get_id, keys))
+                token_ptr.append(len(pair_ids))
+            doc_ptr.append(len(token_ptr) - 1)
+        return cls(
+            vocabulary.pairs,
+            np.frombuffer(pair_ids, dtype=np.int32),
+            np.array(token_ptr, dtype=np.int64),
+            np.array(doc_ptr, dtype=np.int64),
+        )
+
+    @property
+    def n_tokens(self):
+        return len(self.token_ptr) - 1
+
+    @property
+    def nbytes(self):
+        """ Size of index arrays, in bytes """
+        return self.pair_ids.nbytes + self.token_ptr.nbytes + self.doc_ptr.nbytes
+
+    @property
+    def names(self):
+        """ A list of distinct feature names """
+        if self._names is None:
+            self._init_names()
+        return self._names
+
+    @property
+    def pair_name_ids(self):
+        """ An array with an index in :attr:`names` for each pair """
+        if self._pair_name_ids is None:
+            self._init_names()
+        return self._pair_name_ids
+
+    def _init_names(self):
+        name_ids = {}
+        for name, value in self.pairs:
+            name_ids.setdefault(name, len(name_ids))
+        self._names = sorted(name_ids, key=name_ids.get)
+        self._pair_name_ids = np.array(
+            [name_ids[name] for name, value in self.pairs], dtype=np.int32)
+
+    def __len__(self):
+        return len(self.doc_ptr) - 1
+
+    def __getitem__(self, idx):
+        """
+        Return a read-only sequence of feature dict views
+        for ``idx``-th document.
+        """
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("document index out of range")
+        return _DocumentView(self, self.doc_ptr[idx], self.doc_ptr[idx+1])
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def token_pair_ids(self, token_idx):
+        """ Return an array with pair ids of a token (global index) """
+        return self.pair_ids[self.token_ptr[token_idx]:self.token_ptr[token_idx+1]]
+
+    def to_columns(self, idx, names, format_value=None, missing=None):
+        """
+        Return a 2D object array with a row for each token of
+        ``idx``-th document and a column for each feature name from
+        ``names``; features a token doesn't have are ``missing``.
+        If ``format_value`` is not None, it is applied to feature values
+        (once for each distinct pair, results are cached).
+        """
+        start, end = self.doc_ptr[idx], self.doc_ptr[idx+1]
+        table = np.empty((end - start, len(names)), dtype=object)
+        table.fill(missing)
+
+        name_columns = np.full(len(self.names), -1, dtype=np.int64)
+        column_ids = {name: col for col, name in enumerate(names)}
+        for name_id, name in enumerate(self.names):
+            name_columns[name_id] = column_ids.get(name, -1)
+
+        token_ptr = self.token_ptr[start:end+1]
+        pair_ids = self.pair_ids[token_ptr[0]:token_ptr[-1]]
+        rows = np.repeat(np.arange(end - start), np.diff(token_ptr))
+        columns = name_columns[self.pair_name_ids[pair_ids]]
+        known = columns >= 0
+        table[rows[known], columns[known]] = self._get_values(format_value)[pair_ids[known]]
+        return table
+
+    def _get_values(self, format_value):
+        if format_value not in self._formatted:
+            values = np.empty(len(self.pairs), dtype=object)
+            if format_value is None:
+                values[:] = [value for name, value in self.pairs]
+            else:
+                values[:] = [format_value(value) for name, value in self.pairs]
+            self._formatted[format_value] = values
+        return self._formatted[format_value]
+
+    def to_crfsuite(self):
+        """
+        Return a sequence with a ``pycrfsuite.ItemSequence`` for each
+        document; they are created on demand. Attributes are the same
+        as python-crfsuite creates from feature dicts.
+        """
+        return _CRFsuiteSequences(self)
+
+    def crfsuite_items(self, idx):
+        """ Return ``pycrfsuite.ItemSequence`` for ``idx``-th document """
+        from pycrfsuite import ItemSequence
+        attributes, weights, unit = self._get_crfsuite_attributes()
+        start, end = self.doc_ptr[idx], self.doc_ptr[idx+1]
+        token_ptr = self.token_ptr[start:end+1]
+        pair_ids = self.pair_ids[token_ptr[0]:token_ptr[-1]]
+
+        # tokens with all weights equal to 1 are passed as lists
+        not_unit = np.zeros(len(pair_ids) + 1, dtype=np.int64)
+        np.cumsum(~unit[pair_ids], out=not_unit[1:])
+        token_ptr = (token_ptr - token_ptr[0]).tolist()
+        is_list = (not_unit[token_ptr[1:]] == not_unit[token_ptr[:-1]]).tolist()
+
+        pair_ids = pair_ids.tolist()
+        items = []
+        for begin, stop, as_list in zip(token_ptr[:-1], token_ptr[1:], is_list):
+            ids = pair_ids[begin:stop]
+            if as_list:
+                items.append([attributes[j] for j in ids])
+            else:
+                items.append({attributes[j]: weights[j] for j in ids})
+        return ItemSequence(items)
+
+    def _get_crfsuite_attributes(self):
+        if self._crfsuite_attributes is None:
+            attributes, weights = [], []
+            for name, value in self.pairs:
+                if isinstance(value, six.string_types):
+                    attributes.append(u'%s:%s' % (name, value))
+                    weights.append(1.0)
+                else:
+                    attributes.append(name)
+                    weights.append(float(value))
+            unit = np.array(weights) == 1.0
+            self._crfsuite_attributes = attributes, weights, unit
+        return self._crfsuite_attributes
+
+    def __getstate__(self):
+        dct = self.__dict__.copy()
+        dct['_formatted'] = {}
+        dct['_crfsuite_attributes'] = None
+        return dct
+
+
+class _Vocabulary(dict):
+    """
+    (name, value type, value) -> pair id mapping which adds unknown pairs.
+    Value type is a part of the key because equal values of different
+    types (e.g. ``1``, ``1.0`` and ``True``) are encoded differently.
+    """
+    def __init__(self):
+        super(_Vocabulary, self).__init__()
+        self.pairs = []
+
+    def __missing__(self, key):
+        name, value_type, value = key
+        idx = self[key] = len(self.pairs)
+        self.pairs.append((name, value))
+        return idx
+
+
+class _DocumentView(collections_abc.Sequence):
+    def __init__(self, matrix, start, end):
+        self.matrix = matrix
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("token index out of range")
+        return _TokenFeatures(self.matrix, self.start + idx)
+
+
+class _TokenFeatures(collections_abc.Mapping):
+    """ Read-only feature dict of a token """
+    def __init__(self, matrix, token_idx):
+        self.matrix = matrix
+        self.token_idx = token_idx
+
+    def _pairs(self):
+        pairs = self.matrix.pairs
+        return [pairs[j] for j in self.matrix.token_pair_ids(self.token_idx).tolist()]
+
+    def __getitem__(self, key):
+        for name, value in self._pairs():
+            if name == key:
+                return value
+        raise KeyError(key)
+
+    def __iter__(self):
+        return (name for name, value in self._pairs())
+
+    def __len__(self):
+        start = self.matrix.token_ptr[self.token_idx]
+        return int(self.matrix.token_ptr[self.token_idx + 1] - start)
+
+    def items(self):
+        return self._pairs()
+
+    def __repr__(self):
+        return repr(dict(self._pairs()))
+
+
+class _CRFsuiteSequences(collections_abc.Sequence):
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("document index out of range")
+        return self.matrix.crfsuite_items(idx)
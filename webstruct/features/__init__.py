@@ -6,8 +6,10 @@ from .token_features import *
 from .data_features import *
 from .global_features import (
     Pattern,
+    PatternSet,
     LongestMatchGlobalFeature,
     DAWGGlobalFeature,
+    MultiGazetteerGlobalFeature,
 )
 
 
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
+from .utils import block_feature, batch_implementation, BLOCK_SCOPE
 
 __all__ = ['parent_tag', 'InsideTag', 'borders', 'block_length']
 
@@ -24,34 +25,81 @@ def _inside_tag(elem, tagname):
     return any(e is not None for e in elem.iterancestors(tagname))
 
 
+@block_feature
 def parent_tag(html_token):
-    return {'parent_tag': html_token.parent.tag}
+    return {'parent_tag': html_token.parent_tag}
+
+
+@batch_implementation(parent_tag)
+def _parent_tag_batch(html_tokens):
+    return {'parent_tag': [tok.parent_tag for tok in html_tokens]}
 
 
 class InsideTag(object):
+    feature_scope = BLOCK_SCOPE
+
     def __init__(self, tagname):
         self.tagname = tagname
         self.key = 'inside_tag_' + tagname
 
     def __call__(self, html_token):
-        return {self.key: _inside_tag(html_token.elem, self.tagname)}
+        return {self.key: _token_inside_tag(html_token, self.tagname)}
+
+    def batch(self, html_tokens):
+        tagname = self.tagname
+        return {self.key: [_token_inside_tag(html_token, tagname)
+                           for html_token in html_tokens]}
+
+
+def _token_inside_tag(html_token, tagname):
+    ancestor_tags = getattr(html_token, 'ancestor_tags', None)
+    if ancestor_tags is None:
+        return _inside_tag(html_token.elem, tagname)
+    return tagname in ancestor_tags
 
 
 def borders(html_token):
     return {
-        'border_at_left': html_token.index == 0,
-        'border_at_right': html_token.index == len(html_token.tokens)-1,
+        'border_at_left': _border_at_left(html_token),
+        'border_at_right': _border_at_right(html_token),
+    }
+
+
+@batch_implementation(borders)
+def _borders_batch(html_tokens):
+    return {
+        'border_at_left': [_border_at_left(tok) for tok in html_tokens],
+        'border_at_right': [_border_at_right(tok) for tok in html_tokens],
     }
 
 
+def _border_at_left(html_token):
+    return html_token.index == 0
+
+
+def _border_at_right(html_token):
+    return html_token.index == len(html_token.tokens)-1
+
+
+@block_feature
 def block_length(html_token):
-    block_len = len(html_token.tokens)
+    return {'block_length': _block_length_bucket(len(html_token.tokens))}
+
+
+@batch_implementation(block_length)
+def _block_length_batch(html_tokens):
+    return {
+        'block_length': [_block_length_bucket(len(tok.tokens))
+                         for tok in html_tokens]
+    }
+
+
+def _block_length_bucket(block_len):
     if block_len == 1:
-        bl = '1'
+        return '1'
     elif 1 < block_len <= 10:
-        bl = 'short'
+        return 'short'
     elif 10 < block_len <= 20:
-        bl = 'medium'
+        return 'medium'
     else:
-        bl = 'large'
-    return {'block_length': bl}
+        return 'large'
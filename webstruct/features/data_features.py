@@ -3,6 +3,7 @@ from __future__ import absolute_import
 import re
 from webstruct.utils import flatten
 from .datetime_format import WEEKDAYS, MONTHS
+from .utils import text_feature, batch_implementation
 
 __all__ = ['looks_like_year', 'looks_like_month', 'looks_like_time', 'looks_like_weekday',
            'looks_like_email', 'looks_like_street_part', 'looks_like_range']
@@ -16,10 +17,10 @@ EMAIL_SRE = r"(?P<space>(\s|%20|\b)){username_re}@{domain_re}\.{zone_re}\b".form
 EMAIL_RE = re.compile(EMAIL_SRE, re.IGNORECASE)
 
 
-MONTHS_SRE = '|'.join(set(flatten(MONTHS))).replace('.', '\.')
+MONTHS_SRE = '|'.join(set(flatten(MONTHS))).replace('.', r'\.')
 MONTHS_RE = re.compile(r'^(' + MONTHS_SRE + ')$', re.IGNORECASE)
 
-WEEKDAYS_SRE = '|'.join(set(flatten(WEEKDAYS))).replace('.', '\.')
+WEEKDAYS_SRE = '|'.join(set(flatten(WEEKDAYS))).replace('.', r'\.')
 WEEKDAYS_RE = re.compile(r'^(' + WEEKDAYS_SRE + ')$', re.IGNORECASE)
 
 STREET_PART_TOKENS = set('''
@@ -46,56 +47,124 @@ NE SE SW NW
 northeast southeast southwest northwest
 '''.lower().split())
 
-TIME_RE = re.compile('\d{1,2}[\.:]\d{2}')
+TIME_RE = re.compile(r'\d{1,2}[\.:]\d{2}')
 
 RANGES = set('''t/m - van tot from to'''.lower().split())
 
 
+@text_feature
 def looks_like_email(html_token):
+    return {'looks_like_email': _looks_like_email(html_token.token)}
+
+
+@batch_implementation(looks_like_email)
+def _looks_like_email_batch(html_tokens):
     return {
-        'looks_like_email': EMAIL_RE.search(html_token.token) is not None,
+        'looks_like_email': [_looks_like_email(tok.token) for tok in html_tokens],
     }
 
 
+@text_feature
 def looks_like_street_part(html_token):
-    token = html_token.token.lower()
-    return {
-        'common_street_part': token in STREET_PART_TOKENS,
-        'common_address_part': token in COMMON_ADDRESS_PARTS,
-        'direction': token in DIRECTIONS,
-    }
+    return dict(zip(_STREET_PART_KEYS, _street_parts(html_token.token)))
 
 
+@batch_implementation(looks_like_street_part)
+def _looks_like_street_part_batch(html_tokens):
+    columns = zip(*[_street_parts(tok.token) for tok in html_tokens])
+    return {key: list(column) for key, column in zip(_STREET_PART_KEYS, columns)}
+
+
+@text_feature
 def looks_like_year(html_token):
-    token = html_token.token
+    return {'looks_like_year': _looks_like_year(html_token.token)}
+
+
+@batch_implementation(looks_like_year)
+def _looks_like_year_batch(html_tokens):
     return {
-        'looks_like_year': token.isdigit() and len(token) == 4 and token[:2] in ['19', '20'],
+        'looks_like_year': [_looks_like_year(tok.token) for tok in html_tokens],
     }
 
 
+@text_feature
 def looks_like_month(html_token):
-    token = html_token.token
+    return {'looks_like_month': _looks_like_month(html_token.token)}
+
+
+@batch_implementation(looks_like_month)
+def _looks_like_month_batch(html_tokens):
     return {
-        'looks_like_month': MONTHS_RE.match(token) is not None
+        'looks_like_month': [_looks_like_month(tok.token) for tok in html_tokens]
     }
 
 
+@text_feature
 def looks_like_time(html_token):
-    token = html_token.token
+    return {'looks_like_time': _looks_like_time(html_token.token)}
+
+
+@batch_implementation(looks_like_time)
+def _looks_like_time_batch(html_tokens):
     return {
-        'looks_like_time': TIME_RE.match(token) is not None
+        'looks_like_time': [_looks_like_time(tok.token) for tok in html_tokens]
     }
 
 
+@text_feature
 def looks_like_weekday(html_token):
-    token = html_token.token
+    return {'looks_like_weekday': _looks_like_weekday(html_token.token)}
+
+
+@batch_implementation(looks_like_weekday)
+def _looks_like_weekday_batch(html_tokens):
     return {
-        'looks_like_weekday': WEEKDAYS_RE.match(token) is not None
+        'looks_like_weekday': [_looks_like_weekday(tok.token)
+                               for tok in html_tokens]
     }
 
 
+@text_feature
 def looks_like_range(html_token):
-    token = html_token.token.lower()
+    return {'looks_like_range': _looks_like_range(html_token.token)}
+
+
+@batch_implementation(looks_like_range)
+def _looks_like_range_batch(html_tokens):
     return {
-        'looks_like_range': token in RANGES
+        'looks_like_range': [_looks_like_range(tok.token) for tok in html_tokens]
     }
+
+
+def _looks_like_email(token):
+    return EMAIL_RE.search(token) is not None
+
+
+_STREET_PART_KEYS = ('common_street_part', 'common_address_part', 'direction')
+
+
+def _street_parts(token):
+    token = token.lower()
+    return (token in STREET_PART_TOKENS,
+            token in COMMON_ADDRESS_PARTS,
+            token in DIRECTIONS)
+
+
+def _looks_like_year(token):
+    return token.isdigit() and len(token) == 4 and token[:2] in ['19', '20']
+
+
+def _looks_like_month(token):
+    return MONTHS_RE.match(token) is not None
+
+
+def _looks_like_time(token):
+    return TIME_RE.match(token) is not None
+
+
+def _looks_like_weekday(token):
+    return WEEKDAYS_RE.match(token) is not None
+
+
+def _looks_like_range(token):
+    return token.lower() in RANGES
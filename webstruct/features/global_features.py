@@ -1,11 +1,53 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
+import six
 
-from webstruct.utils import LongestMatch
+from webstruct.utils import LongestMatch, MultiLongestMatch, TextNormalizer
+from webstruct.gazetteers.metadata import read_gazetteer_metadata
+from webstruct.gazetteers.bloom import read_bloom_filter
+
+
+class DocumentTokens(list):
+    """
+    A list of ``(html_token, feature_dict)`` pairs which
+    :class:`~.HtmlFeatureExtractor` passes to global features.
+    It has a ``cache`` dict shared by all global features applied
+    to a document; :func:`get_token_strings` uses it to normalize
+    token strings once per document.
+    """
+    def __init__(self, *args):
+        super(DocumentTokens, self).__init__(*args)
+        self.cache = {}
+
+
+def get_token_strings(doc, normalizer=None):
+    """
+    Return a list of token strings of ``doc`` (a list of
+    ``(html_token, feature_dict)`` pairs), normalized with ``normalizer``
+    (a :class:`~.TextNormalizer` or None). If ``doc`` is
+    a :class:`DocumentTokens` instance the result is cached in it,
+    so global features with the same normalization share it.
+    """
+    cache = getattr(doc, 'cache', None)
+    if cache is not None and normalizer in cache:
+        return cache[normalizer]
+    if normalizer is None:
+        token_strings = [tok.token for tok, feat in doc]
+    else:
+        token_strings = [normalizer(tok.token) for tok, feat in doc]
+    if cache is not None:
+        cache[normalizer] = token_strings
+    return token_strings
+
+
+def _get_normalizer(normalization):
+    if normalization is None or isinstance(normalization, TextNormalizer):
+        return normalization
+    return TextNormalizer.from_spec(normalization)
 
 
 class LongestMatchGlobalFeature(object):
-    def __init__(self, lookup_data, featname):
+    def __init__(self, lookup_data, featname, normalization=None):
         """
         Create a global feature function that adds 3 types of features:
 
@@ -16,17 +58,43 @@ class LongestMatchGlobalFeature(object):
         3) featname - if current token belongs to an entity from the
            ``lookup_data``.
 
+        ``normalization`` is a :class:`~.TextNormalizer` (or a dict with
+        its options) applied to document tokens before matching::
+
+            >>> from webstruct.utils import TextNormalizer
+            >>> feature = LongestMatchGlobalFeature(
+            ...     {u'São Paulo'}, 'CITY',
+            ...     normalization=TextNormalizer(casefold=True,
+            ...                                  strip_diacritics=True))
+            >>> sorted(feature.lm.known)
+            ['sao paulo']
+
+        Keys of in-memory lexicons (sets, dicts) are normalized
+        in the same way; tries (``dawg``, ``marisa_trie``) must be built
+        with the same normalization (see :mod:`webstruct.gazetteers.build`).
         """
+        self.normalizer = _get_normalizer(normalization)
         if hasattr(lookup_data, 'find_ranges'):
             self.lm = lookup_data
         else:
+            if self.normalizer is not None and not hasattr(lookup_data, 'prefixes'):
+                lookup_data = {self.normalizer.normalize_key(key)
+                               for key in lookup_data}
             self.lm = LongestMatch(lookup_data)
+        self._init_featnames(featname)
+
+    def _init_featnames(self, featname):
         self.b_featname = 'B-' + featname
         self.i_featname = 'I-' + featname
         self.featname = featname
 
+    def __setstate__(self, state):
+        # features pickled by older versions don't have a normalizer
+        state.setdefault('normalizer', None)
+        self.__dict__.update(state)
+
     def __call__(self, doc):
-        token_strings = [tok.token for tok, feat in doc]
+        token_strings = get_token_strings(doc, self.normalizer)
         for start, end, matched_text in self.lm.find_ranges(token_strings):
             self.process_range(doc, start, end, matched_text)
 
@@ -39,65 +107,356 @@ class LongestMatchGlobalFeature(object):
             doc[idx][1][self.featname] = True
 
 
-class DAWGGlobalFeature(LongestMatchGlobalFeature):
+class _TrieFileGlobalFeature(LongestMatchGlobalFeature):
+    """
+    Base class for global features which match longest entities from
+    a lexicon stored in a trie file. Only gazetteer metadata (see
+    :mod:`webstruct.gazetteers.metadata`) is read at construction time;
+    the trie is loaded when it is used for the first time. Without
+    a metadata file maximum entity length is computed from trie keys.
+
+    If the gazetteer has a Bloom filter file (see
+    :mod:`webstruct.gazetteers.bloom`), it is loaded together with
+    the trie and used to skip trie lookups for positions which
+    can't start an entity.
+
+    Document tokens are normalized as the gazetteer keys were normalized
+    at build time (``normalization`` in the metadata build config);
+    pass ``normalization`` explicitly for files without metadata.
+
+    When pickled, only a file name is stored (not the trie), so the file
+    must be available where the feature is unpickled; it is opened again
+    on first use.
+    """
+    def __init__(self, filename, featname, normalization=None):
+        self.filename = filename
+        self.metadata = read_gazetteer_metadata(filename)
+        if normalization is None and self.metadata is not None:
+            normalization = self.metadata['build_config'].get('normalization')
+        self.normalizer = _get_normalizer(normalization)
+        self._data = None
+        self._lm = None
+        self._init_featnames(featname)
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self._load_data()
+        return self._data
+
+    @property
+    def lm(self):
+        if self._lm is None:
+            max_length = None
+            if self.metadata is not None:
+                max_length = self.metadata['max_length']
+            self._lm = LongestMatch(self.data, max_length=max_length,
+                                    prefilter=read_bloom_filter(self.filename))
+        return self._lm
+
+    def _load_data(self):
+        raise NotImplementedError()
+
+    def __getstate__(self):
+        dct = self.__dict__.copy()
+        dct['_data'] = None
+        dct['_lm'] = None
+        return dct
+
+    def __setstate__(self, state):
+        # features pickled by older versions have loaded 'data' and 'lm'
+        # attributes and don't have metadata
+        state['_data'] = state.pop('data', state.get('_data'))
+        state['_lm'] = state.pop('lm', state.get('_lm'))
+        state.setdefault('metadata', None)
+        state.setdefault('format', None)
+        super(_TrieFileGlobalFeature, self).__setstate__(state)
+
+
+class DAWGGlobalFeature(_TrieFileGlobalFeature):
     """
     Global feature that matches longest entities from a lexicon
     stored either in a ``dawg.CompletionDAWG`` (if ``format`` is None)
     or in a ``dawg.RecordDAWG`` (if ``format`` is not None).
+    The file is loaded on first use (``dawg`` doesn't support
+    memory-mapping, so each process has its own copy).
     """
-    def __init__(self, filename, featname, format=None):
+    def __init__(self, filename, featname, format=None, normalization=None):
+        self.format = format
+        super(DAWGGlobalFeature, self).__init__(filename, featname,
+                                                normalization)
+
+    def _load_data(self):
         import dawg
 
-        if format is None:
-            self.data = dawg.CompletionDAWG()
+        if self.format is None:
+            data = dawg.CompletionDAWG()
         else:
-            self.data = dawg.RecordDAWG(format)
-        self.data.load(filename)
+            data = dawg.RecordDAWG(self.format)
+        data.load(self.filename)
+        return data
 
-        self.filename = filename
-        super(DAWGGlobalFeature, self).__init__(self.data, featname)
+
+class MultiGazetteerGlobalFeature(object):
+    """
+    Global feature that matches longest entities from several lexicons
+    in a single pass over a document. It adds the same features as
+    separate :class:`LongestMatchGlobalFeature` instances would add.
+
+    ``gazetteers`` is a list of :class:`LongestMatchGlobalFeature`
+    instances (e.g. :class:`DAWGGlobalFeature` or
+    :class:`~.MarisaGeonamesGlobalFeature`) or ``(lookup_data, featname)``
+    tuples::
+
+        >>> from webstruct import HtmlTokenizer, HtmlFeatureExtractor
+        >>> from webstruct.loaders import HtmlLoader
+        >>> feature = MultiGazetteerGlobalFeature([
+        ...     ({'New York', 'York'}, 'CITY'),
+        ...     LongestMatchGlobalFeature({'New York state'}, 'STATE'),
+        ... ])
+        >>> tree = HtmlLoader().loadbytes(b"<p>New York state</p>")
+        >>> html_tokens, tags = HtmlTokenizer().tokenize_single(tree)
+        >>> fe = HtmlFeatureExtractor([], [feature])
+        >>> for featdict in fe.transform_single(html_tokens):
+        ...     print(sorted(featdict))
+        ['B-CITY', 'B-STATE', 'CITY', 'STATE']
+        ['CITY', 'I-CITY', 'I-STATE', 'STATE']
+        ['I-STATE', 'STATE']
+
+    Gazetteers with the same normalization (see
+    :class:`LongestMatchGlobalFeature`) are matched together; document
+    tokens are normalized once for each distinct normalization.
+
+    Gazetteer features with custom ``__call__`` or matchers can't be
+    combined; ValueError is raised for them.
+
+    Gazetteers are not loaded when the feature is created; tries
+    of gazetteer files are loaded when the feature is used for the first
+    time. When pickled, the feature stores ``gazetteers`` and not their
+    loaded data.
+    """
+    def __init__(self, gazetteers):
+        self.gazetteers = list(gazetteers)
+        for gazetteer in self.gazetteers:
+            if (isinstance(gazetteer, LongestMatchGlobalFeature) and
+                    not _is_combinable(gazetteer)):
+                raise ValueError("%r can't be combined with other "
+                                 "gazetteers" % gazetteer)
+        self._groups = None
+
+    @property
+    def groups(self):
+        """
+        A list of ``(normalizer, MultiLongestMatch, featnames)`` tuples,
+        one for each distinct normalization of gazetteers.
+        """
+        if self._groups is None:
+            self._groups = self._get_groups()
+        return self._groups
+
+    def _get_groups(self):
+        groups = {}  # normalizer -> (lexicons, featnames)
+        for gazetteer in self.gazetteers:
+            if isinstance(gazetteer, LongestMatchGlobalFeature):
+                lexicon = gazetteer.lm
+                featname = gazetteer.featname
+                normalizer = gazetteer.normalizer
+            else:
+                lexicon, featname = gazetteer
+                normalizer = None
+            lexicons, featnames = groups.setdefault(normalizer, ([], []))
+            lexicons.append(lexicon)
+            featnames.append(('B-' + featname, 'I-' + featname, featname))
+        return [
+            (normalizer, MultiLongestMatch(lexicons), featnames)
+            for normalizer, (lexicons, featnames) in groups.items()
+        ]
+
+    def __call__(self, doc):
+        for normalizer, mlm, featnames in self.groups:
+            token_strings = get_token_strings(doc, normalizer)
+            all_ranges = mlm.find_ranges(token_strings)
+            for (b_featname, i_featname, featname), ranges in zip(featnames,
+                                                                  all_ranges):
+                for start, end, matched_text in ranges:
+                    doc[start][1][b_featname] = True
+                    doc[start][1][featname] = True
+                    for idx in range(start+1, end):
+                        doc[idx][1][i_featname] = True
+                        doc[idx][1][featname] = True
+
+    def __getstate__(self):
+        return {'gazetteers': self.gazetteers}
+
+    def __setstate__(self, state):
+        self.gazetteers = state['gazetteers']
+        self._groups = None
+
+
+def _is_combinable(gazetteer):
+    """
+    Return True if LongestMatchGlobalFeature instance ``gazetteer``
+    doesn't customize matching. Tries of gazetteer files
+    are not loaded by this check.
+    """
+    cls = type(gazetteer)
+    for method in ['__call__', 'process_range']:
+        func = six.get_unbound_function(getattr(cls, method))
+        base_func = six.get_unbound_function(
+            getattr(LongestMatchGlobalFeature, method))
+        if func is not base_func:
+            return False
+    if isinstance(gazetteer, _TrieFileGlobalFeature):
+        # the trie is wrapped in LongestMatch unless ``lm`` is overridden
+        return cls.lm is _TrieFileGlobalFeature.lm
+    return type(gazetteer.lm) is LongestMatch
 
 
 class Pattern(object):
     """
     Global feature that combines local features.
+
+    :attr:`feature_name` is a name of the feature this pattern adds::
+
+        >>> Pattern((-2, 'lower'), (0, 'shape'), (1, 'lower')).feature_name
+        'lower[-2]/shape/lower[+1]'
     """
     def __init__(self, *lookups, **kwargs):
         self.separator = kwargs.get('separator', '/')
         self.out_value = kwargs.get('out_value', '?')
         self.missing_value = kwargs.get('missing_value', '_NA_')
         self.lookups = lookups
+        self.feature_name = self._get_feature_name()
         # TODO: add an option to use index values on HTML element level
 
-    def __call__(self, doc):
-        _add_pattern_features(
-            feature_dicts = [feat for html_token, feat in doc],
-            pattern = self.lookups,
-            out_value = self.out_value,
-            missing_value = self.missing_value,
-            separator = self.separator
+    def _get_feature_name(self):
+        return self.separator.join(
+            _lookup_key(offset, key) for offset, key in self.lookups
         )
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if 'feature_name' not in state:  # pickled by an older version
+            self.feature_name = self._get_feature_name()
 
-def _add_pattern_features(feature_dicts, pattern, out_value, missing_value, separator):
-    for pos, featdict in enumerate(feature_dicts):
-        keys = []
-        values = []
-        for offset, key in pattern:
-            if offset == 0:
-                keys.append(key)
-            elif offset < 0:
-                keys.append('%s[%s]' % (key, offset))
-            else:
-                keys.append('%s[+%s]' % (key, offset))
+    def __call__(self, doc):
+        _add_pattern_features([feat for html_token, feat in doc], [self])
 
-            index = pos + offset
-            if 0 <= index < len(feature_dicts):
-                values.append(feature_dicts[index].get(key, missing_value))
-            else:
-                values.append(out_value)
 
-        # FIXME: there should be a cleaner/faster way
-        if not all(v == out_value for v in values):
-            values = [str(v) if type(v) == bool else v for v in values]
-            featdict[separator.join(keys)] = separator.join(values)
+class PatternSet(object):
+    """
+    Global feature that computes features of several :class:`Pattern`
+    instances in a single pass over a document.
+
+    The result is the same as applying patterns one by one, except that
+    all patterns see feature dicts as they were before :class:`PatternSet`
+    is applied, i.e. a pattern can't use a feature added by another
+    pattern from the same set.
+
+    :class:`~.HtmlFeatureExtractor` combines consecutive :class:`Pattern`
+    global features automatically (see :func:`fuse_patterns`).
+    """
+    def __init__(self, *patterns):
+        self.patterns = patterns
+
+    def __call__(self, doc):
+        _add_pattern_features([feat for html_token, feat in doc],
+                              self.patterns)
+
+
+def fuse_patterns(global_features):
+    """
+    Return a list of global features where each run of consecutive
+    :class:`Pattern` instances is replaced with a :class:`PatternSet`.
+    A run is split when a pattern uses a feature added by a previous
+    pattern of the run::
+
+        >>> features = fuse_patterns([
+        ...     Pattern((-1, 'lower')),
+        ...     Pattern((1, 'lower')),
+        ...     Pattern((1, 'lower[-1]')),
+        ... ])
+        >>> [type(f).__name__ for f in features]
+        ['PatternSet', 'Pattern']
+    """
+    fused = []
+    run, run_names = [], set()
+
+    def flush():
+        if len(run) > 1:
+            fused.append(PatternSet(*run))
+        else:
+            fused.extend(run)
+
+    for feature in global_features:
+        if type(feature) is not Pattern:
+            flush()
+            run, run_names = [], set()
+            fused.append(feature)
+            continue
+
+        if any(key in run_names for offset, key in feature.lookups):
+            flush()
+            run, run_names = [], set()
+        run.append(feature)
+        run_names.add(feature.feature_name)
+    flush()
+    return fused
+
+
+def _lookup_key(offset, key):
+    if offset == 0:
+        return key
+    elif offset < 0:
+        return '%s[%s]' % (key, offset)
+    else:
+        return '%s[+%s]' % (key, offset)
+
+
+def _add_pattern_features(feature_dicts, patterns):
+    """
+    Add features of ``patterns`` to ``feature_dicts``.
+    Values are looked up in per-key columns which are padded with
+    ``out_value`` on both sides, so that pattern values for all positions
+    are obtained by zipping shifted column slices.
+    """
+    n = len(feature_dicts)
+    pad = max([abs(offset) for pattern in patterns
+               for offset, key in pattern.lookups] or [0])
+
+    # (key, missing_value, out_value) -> (raw values, string values)
+    columns = {}
+
+    def get_columns(key, missing_value, out_value):
+        col_key = (key, missing_value, out_value)
+        if col_key not in columns:
+            raw = [out_value] * pad
+            raw.extend([fd.get(key, missing_value) for fd in feature_dicts])
+            raw.extend([out_value] * pad)
+            strings = [str(v) if type(v) == bool else v for v in raw]
+            columns[col_key] = raw, strings
+        return columns[col_key]
+
+    for pattern in patterns:
+        name = pattern.feature_name
+        out_value = pattern.out_value
+        raw_slices, str_slices = [], []
+        for offset, key in pattern.lookups:
+            raw, strings = get_columns(key, pattern.missing_value, out_value)
+            start = pad + offset
+            raw_slices.append(raw[start:start+n])
+            str_slices.append(strings[start:start+n])
+
+        if len(raw_slices) == 1:
+            for featdict, raw_value, value in zip(feature_dicts, raw_slices[0],
+                                                  str_slices[0]):
+                if not raw_value == out_value:
+                    featdict[name] = value
+            continue
+
+        separator = pattern.separator
+        for featdict, raw_values, values in zip(feature_dicts,
+                                                zip(*raw_slices),
+                                                zip(*str_slices)):
+            if not all(v == out_value for v in raw_values):
+                featdict[name] = separator.join(values)
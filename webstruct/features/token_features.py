@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division
 import re
+from .utils import text_feature, batch_implementation, TEXT_SCOPE
 
 __all__ = [
     'bias',
@@ -17,56 +18,133 @@ __all__ = [
 ]
 
 
+@text_feature
 def bias(html_token):
     return {'bias': 1}
 
 
+@batch_implementation(bias)
+def _bias_batch(html_tokens):
+    return {'bias': [1] * len(html_tokens)}
+
+
+@text_feature
 def token_identity(html_token):
     return {'token': html_token.token}
 
 
+@batch_implementation(token_identity)
+def _token_identity_batch(html_tokens):
+    return {'token': [tok.token for tok in html_tokens]}
+
+
+@text_feature
 def token_lower(html_token):
     return {'lower': html_token.token.lower()}
 
 
+@batch_implementation(token_lower)
+def _token_lower_batch(html_tokens):
+    return {'lower': [tok.token.lower() for tok in html_tokens]}
+
+
+@text_feature
 def token_shape(html_token):
     token = html_token.token
     return {
         'shape': _shape(token),
-        'first_upper': token[0].isupper(),
+        'first_upper': _first_upper(token),
+    }
+
+
+@batch_implementation(token_shape)
+def _token_shape_batch(html_tokens):
+    tokens = [tok.token for tok in html_tokens]
+    return {
+        'shape': [_shape(token) for token in tokens],
+        'first_upper': [_first_upper(token) for token in tokens],
     }
 
 
+def _first_upper(token):
+    return token[0].isupper()
+
+
+@text_feature
 def token_endswith_dot(html_token):
-    token = html_token.token
-    return {'endswith_dot': token.endswith('.') and token != '.'}
+    return {'endswith_dot': _endswith_punct(html_token.token, '.')}
+
 
+@batch_implementation(token_endswith_dot)
+def _token_endswith_dot_batch(html_tokens):
+    return {
+        'endswith_dot': [_endswith_punct(tok.token, '.') for tok in html_tokens],
+    }
 
+
+@text_feature
 def token_endswith_colon(html_token):
-    token = html_token.token
-    return {'endswith_colon': token.endswith(':') and token != ':'}
+    return {'endswith_colon': _endswith_punct(html_token.token, ':')}
+
+
+@batch_implementation(token_endswith_colon)
+def _token_endswith_colon_batch(html_tokens):
+    return {
+        'endswith_colon': [_endswith_punct(tok.token, ':')
+                           for tok in html_tokens],
+    }
+
+
+def _endswith_punct(token, punct):
+    return token.endswith(punct) and token != punct
 
 
+@text_feature
 def token_has_copyright(html_token):
-    return {'has_copyright': u'©' in html_token.token}
+    return {'has_copyright': _has_copyright(html_token.token)}
 
 
-def number_pattern(html_token):
-    token = html_token.token
-    digit_ratio = sum(1 for ch in token if ch.isdigit()) / len(token)
+@batch_implementation(token_has_copyright)
+def _token_has_copyright_batch(html_tokens):
+    return {'has_copyright': [_has_copyright(tok.token) for tok in html_tokens]}
 
-    if digit_ratio >= 0.3:
-        num_pattern = re.sub('\d', 'X', token)
-        num_pattern2 = re.sub('[^X\W]', 'C', num_pattern)
-        return {
-            'num_pattern': num_pattern,
-            'num_pattern2': num_pattern2,
-        }
-    else:
+
+def _has_copyright(token):
+    return u'©' in token
+
+
+@text_feature
+def number_pattern(html_token):
+    patterns = _number_patterns(html_token.token)
+    if patterns is None:
         return {}
+    return {
+        'num_pattern': patterns[0],
+        'num_pattern2': patterns[1],
+    }
+
+
+@batch_implementation(number_pattern)
+def _number_pattern_batch(html_tokens):
+    patterns = [_number_patterns(tok.token) for tok in html_tokens]
+    return {
+        'num_pattern': [p and p[0] for p in patterns],
+        'num_pattern2': [p and p[1] for p in patterns],
+    }
+
+
+def _number_patterns(token):
+    digit_ratio = sum(1 for ch in token if ch.isdigit()) / len(token)
+    if digit_ratio < 0.3:
+        return None
+    num_pattern = _DIGIT_RE.sub('X', token)
+    num_pattern2 = _NON_X_WORD_RE.sub('C', num_pattern)
+    return num_pattern, num_pattern2
 
 
 class PrefixFeatures(object):
+    feature_scope = TEXT_SCOPE
+
     def __init__(self, lenghts=(2,3,4), featname="prefix", lower=True):
         self.lower = lower
         self.featname = featname
@@ -76,10 +154,17 @@ class PrefixFeatures(object):
 
     def __call__(self, html_token):
         token = html_token.token if not self.lower else html_token.token.lower()
-        return {key: token[:size] for key, size in self.sizes.items()}
+        return {key: _prefix(token, size) for key, size in self.sizes.items()}
+
+    def batch(self, html_tokens):
+        tokens = _token_texts(html_tokens, self.lower)
+        return {key: [_prefix(token, size) for token in tokens]
+                for key, size in self.sizes.items()}
 
 
 class SuffixFeatures(object):
+    feature_scope = TEXT_SCOPE
+
     def __init__(self, lenghts=(2,3,4), featname="suffix", lower=True):
         self.lower = lower
         self.sizes = dict(
@@ -88,34 +173,75 @@ class SuffixFeatures(object):
 
     def __call__(self, html_token):
         token = html_token.token if not self.lower else html_token.token.lower()
-        return {key: token[-size:] for key, size in self.sizes.items()}
+        return {key: _suffix(token, size) for key, size in self.sizes.items()}
+
+    def batch(self, html_tokens):
+        tokens = _token_texts(html_tokens, self.lower)
+        return {key: [_suffix(token, size) for token in tokens]
+                for key, size in self.sizes.items()}
 
 
+@text_feature
 def prefixes_and_suffixes(html_token):
     token = html_token.token.lower()
-    return {
-        'prefix2': token[:2],
-        'suffix2': token[-2:],
-        'prefix3': token[:3],
-        'suffix3': token[-3:],
-        'prefix4': token[:4],
-        'suffix4': token[-4:],
-    }
+    return {key: affix(token, size) for key, affix, size in _AFFIXES}
+
+
+@batch_implementation(prefixes_and_suffixes)
+def _prefixes_and_suffixes_batch(html_tokens):
+    tokens = _token_texts(html_tokens, lower=True)
+    return {key: [affix(token, size) for token in tokens]
+            for key, affix, size in _AFFIXES}
+
+
+def _prefix(token, size):
+    return token[:size]
+
+
+def _suffix(token, size):
+    return token[-size:]
+
+
+_AFFIXES = [
+    ('prefix2', _prefix, 2),
+    ('suffix2', _suffix, 2),
+    ('prefix3', _prefix, 3),
+    ('suffix3', _suffix, 3),
+    ('prefix4', _prefix, 4),
+    ('suffix4', _suffix, 4),
+]
+
+
+def _token_texts(html_tokens, lower):
+    if lower:
+        return [tok.token.lower() for tok in html_tokens]
+    return [tok.token for tok in html_tokens]
+
+
+_DIGIT_RE = re.compile(r'\d')
+_NON_X_WORD_RE = re.compile(r'[^X\W]')
+
+_NUMBER_RE = re.compile(r'[-+]?[0-9]+(\.[0-9]*)?|[0-9]*\.[0-9]+$')
+_PUNCT_RE = re.compile(r'\W+$')
+_UPCASE_RE = re.compile(r"[A-Z][a-z'`]+$")
+_CAPS_RE = re.compile(r"[A-Z][A-Z'`]+$")
+_DOWNCASE_RE = re.compile(r"[a-z]+$")
+_MIXEDCASE_RE = re.compile(r'\w+$')
 
 
 # stolen from NLTK source (nltk.tag.sequential.ClassifierBasedPOSTagger)
 def _shape(token):
-    if re.match('[-+]?[0-9]+(\.[0-9]*)?|[0-9]*\.[0-9]+$', token):
+    if _NUMBER_RE.match(token):
         return 'number'
-    elif re.match('\W+$', token):
+    elif _PUNCT_RE.match(token):
         return 'punct'
-    elif re.match("[A-Z][a-z'`]+$", token):
+    elif _UPCASE_RE.match(token):
         return 'upcase'
-    elif re.match("[A-Z][A-Z'`]+$", token):
+    elif _CAPS_RE.match(token):
         return 'caps'
-    elif re.match("[a-z]+$", token):
+    elif _DOWNCASE_RE.match(token):
         return 'downcase'
-    elif re.match('\w+$', token):
+    elif _MIXEDCASE_RE.match(token):
         return 'mixedcase'
     else:
         return 'other'
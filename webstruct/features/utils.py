@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Markers which tell :class:`~.HtmlFeatureExtractor` what information
+a token feature function depends on. Feature functions are still called
+with a single ``html_token`` argument, but the extractor can reuse their
+results:
+
+* results of :func:`text_feature` functions are cached per token text
+  (across documents);
+* :func:`block_feature` functions are called once per text block
+  (text or tail of an HTML element), and their results are shared by
+  all tokens of the block.
+
+Unmarked functions are called for each token.
+
+A feature function may also provide a batch implementation
+(see :func:`batch_implementation`) which processes a list of tokens
+in a single call; the extractor uses it instead of calling the
+function for each token.
+"""
+from __future__ import absolute_import
+
+TOKEN_SCOPE = 'token'
+TEXT_SCOPE = 'text'
+BLOCK_SCOPE = 'block'
+
+
+def text_feature(func):
+    """
+    Mark token feature function ``func`` as depending only on token text
+    (``html_token.token``)::
+
+        >>> @text_feature
+        ... def token_upper(html_token):
+        ...     return {'upper': html_token.token.upper()}
+        >>> get_feature_scope(token_upper)
+        'text'
+
+    For callable objects set ``feature_scope = TEXT_SCOPE``
+    class attribute instead.
+    """
+    func.feature_scope = TEXT_SCOPE
+    return func
+
+
+def block_feature(func):
+    """
+    Mark token feature function ``func`` as depending only on a text block
+    token belongs to, not on the token itself.
+
+    When called by :class:`~.HtmlFeatureExtractor`, block feature functions
+    get a :class:`~.DetachedHtmlToken` instance for the first token
+    of a block, so they should only use ``tokens``, ``is_tail``,
+    ``parent_tag`` and ``ancestor_tags`` attributes::
+
+        >>> @block_feature
+        ... def block_size(html_token):
+        ...     return {'block_size': len(html_token.tokens)}
+        >>> get_feature_scope(block_size)
+        'block'
+
+    For callable objects set ``feature_scope = BLOCK_SCOPE``
+    class attribute instead.
+    """
+    func.feature_scope = BLOCK_SCOPE
+    return func
+
+
+def get_feature_scope(func):
+    """ Return scope of a token feature function ``func``. """
+    return getattr(func, 'feature_scope', TOKEN_SCOPE)
+
+
+def batch_implementation(func):
+    """
+    Register decorated function as a batch implementation of
+    a token feature function ``func``.
+
+    Batch implementation accepts a list of ``html_tokens`` and returns
+    either a list with a feature dict for each token, or a dict which
+    maps feature names to lists ("columns") of feature values,
+    one value per token; None values in columns mean the feature is
+    absent for a token::
+
+        >>> def token_upper(html_token):
+        ...     return {'upper': html_token.token.upper()}
+        >>> @batch_implementation(token_upper)
+        ... def token_upper_batch(html_tokens):
+        ...     return {'upper': [tok.token.upper() for tok in html_tokens]}
+        >>> get_batch_func(token_upper) is token_upper_batch
+        True
+
+    Batch implementation must return the same features as calling
+    ``func`` for each token. For callable objects define a ``batch``
+    method instead.
+    """
+    def decorator(batch_func):
+        func.batch = batch_func
+        return batch_func
+    return decorator
+
+
+def get_batch_func(func):
+    """
+    Return batch implementation of a token feature function ``func``,
+    or None if it doesn't have one.
+    """
+    return getattr(func, 'batch', None)
+
+
+def apply_features(funcs, html_tokens, feature_dicts=None, sparse=False):
+    """
+    Apply token feature functions ``funcs`` to a list of ``html_tokens``
+    and update ``feature_dicts`` (a list with a dict for each token)
+    inplace with the results; functions are applied in order, using
+    their batch implementations if available. If ``feature_dicts``
+    is None a list of new dicts is created. Return ``feature_dicts``::
+
+        >>> from webstruct import HtmlLoader, HtmlTokenizer
+        >>> from webstruct.features import token_lower, token_shape
+        >>> tree = HtmlLoader().loadbytes(b"<p>Hello world</p>")
+        >>> html_tokens, tags = HtmlTokenizer().tokenize_single(tree)
+        >>> dicts = apply_features([token_lower, token_shape], html_tokens)
+        >>> [sorted(d.items()) for d in dicts]
+        [[('first_upper', True), ('lower', 'hello'), ('shape', 'upcase')],
+         [('first_upper', False), ('lower', 'world'), ('shape', 'downcase')]]
+
+    If ``sparse`` is True, False and None feature values are not stored:
+    they remove a feature from a dict instead.
+    """
+    if feature_dicts is None:
+        feature_dicts = [{} for _ in html_tokens]
+    for func in funcs:
+        batch_func = get_batch_func(func)
+        if batch_func is None:
+            results = (func(html_token) for html_token in html_tokens)
+        else:
+            results = batch_func(html_tokens)
+
+        if isinstance(results, dict):
+            for key, column in results.items():
+                for featdict, value in zip(feature_dicts, column):
+                    if value is None:
+                        continue
+                    if sparse and value is False:
+                        featdict.pop(key, None)
+                    else:
+                        featdict[key] = value
+        elif sparse:
+            for featdict, features in zip(feature_dicts, results):
+                for key, value in features.items():
+                    if value is None or value is False:
+                        featdict.pop(key, None)
+                    else:
+                        featdict[key] = value
+        else:
+            for featdict, features in zip(feature_dicts, results):
+                featdict.update(features)
+    return feature_dicts
@@ -0,0 +1,77 @@
+from __future__ import print_function
+import os
+import shutil
+import timeit
+import tempfile
+import functools
+
+from webstruct.html_tokenizer import HtmlTokenizer
+from webstruct.feature_extraction import HtmlFeatureExtractor
+from webstruct.gazetteers.geonames import to_marisa
+from webstruct.gazetteers.metadata import save_gazetteer
+from webstruct.gazetteers.bloom import write_bloom_filter, get_bloom_filename
+from webstruct.gazetteers.features import MarisaGeonamesGlobalFeature
+from webstruct.geonames_benchmark import random_geonames
+from webstruct.sequence_encoding import IobEncoder
+from webstruct._benchmark import load_corpus_trees
+
+# (name, number of rows) of GeoNames dumps;
+# synthetic data of the same size is used instead of real dumps
+LEXICONS = [('cities15000', 25000), ('cities1000', 140000)]
+
+
+def corpus_cities(X, y):
+    """ Return a list of CITY entities from the corpus """
+    cities = set()
+    for html_tokens, tags in zip(X, y):
+        tokens = [tok.token for tok in html_tokens]
+        for entity, tag in IobEncoder.iter_group(zip(tokens, tags)):
+            if tag == 'CITY':
+                cities.add(" ".join(entity))
+    return sorted(cities)
+
+
+def build_lexicon(filename, n_rows, extra_names, seed):
+    import pandas as pd
+    df = random_geonames(n_rows, seed=seed)
+    extra = random_geonames(len(extra_names), seed=seed)
+    extra['main_name'] = extra['asciiname'] = extra_names
+    extra['alternatenames'] = None
+    save_gazetteer(to_marisa(pd.concat([df, extra], ignore_index=True)),
+                   filename)
+
+
+def time_transform(X, filenames):
+    features = [MarisaGeonamesGlobalFeature(filename, 'G%d' % idx)
+                for idx, filename in enumerate(filenames)]
+    fe = HtmlFeatureExtractor([], features)
+    fe.transform(X)  # load tries
+    return min(timeit.repeat(functools.partial(fe.transform, X),
+                             number=1, repeat=3))
+
+
+def main():
+    X, y = HtmlTokenizer().tokenize(load_corpus_trees(), copy=False)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        filenames = []
+        for seed, (name, n_rows) in enumerate(LEXICONS):
+            filename = os.path.join(tmp_dir, name + '.marisa')
+            build_lexicon(filename, n_rows, corpus_cities(X, y), seed)
+            filenames.append(filename)
+
+        print("%d documents, %d tokens" % (len(X), sum(map(len, X))))
+        print("gazetteers, no Bloom filter: %0.2fs" % time_transform(X, filenames))
+        for filename in filenames:
+            keys = MarisaGeonamesGlobalFeature(filename, 'G').data.iterkeys()
+            write_bloom_filter(filename, keys)
+            print("%s Bloom filter: %d bytes" % (
+                os.path.basename(filename),
+                os.path.getsize(get_bloom_filename(filename))))
+        print("gazetteers, Bloom filter: %0.2fs" % time_transform(X, filenames))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
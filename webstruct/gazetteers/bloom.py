@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Gazetteer files can have a Bloom filter "sidecar" file next to them
+(``<filename>.bloom``) with first tokens and first token bigrams
+of all gazetteer keys. Gazetteer global features use it to skip
+token positions which can't start any key (or can only start
+single-token keys) without querying the trie; most tokens of a page
+are not in any gazetteer, and a filter check is much cheaper
+than a trie lookup.
+
+Like a trie, a filter stores normalized keys if a gazetteer is built
+with a normalization (see :mod:`webstruct.gazetteers.build`).
+"""
+from __future__ import absolute_import, division
+import os
+import io
+import math
+import zlib
+import struct
+
+from webstruct.utils import replacing_file
+from webstruct.gazetteers.metadata import file_sha1
+
+BLOOM_SUFFIX = '.bloom'
+
+_MAGIC = b'WSBLOOM\x02'
+# gazetteer file size, gazetteer file hex SHA1, n_bits, n_hashes
+_HEADER = struct.Struct('<Q40sQI')
+_SEED = 0x5bd1e995
+
+
+class BloomFilter(object):
+    """
+    A Bloom filter for unicode strings::
+
+        >>> bf = BloomFilter.from_items([u'New', u'New York'])
+        >>> u'New' in bf, u'New York' in bf, u'York' in bf
+        (True, True, False)
+
+    Membership checks may give false positives (with probability
+    about ``error_rate`` passed to :meth:`from_items`),
+    but never false negatives. Hashes are stable across processes
+    and Python versions, so filters can be saved to files.
+    """
+    def __init__(self, n_bits, n_hashes, bits=None):
+        self.n_bits = n_bits
+        self.n_hashes = n_hashes
+        if bits is None:
+            bits = bytearray((n_bits + 7) // 8)
+        self.bits = bits
+
+    @classmethod
+    def from_items(cls, items, error_rate=0.01):
+        """ Create a filter with all ``items`` """
+        items = set(items)
+        n_items = max(len(items), 1)
+        n_bits = int(math.ceil(-n_items * math.log(error_rate) / math.log(2) ** 2))
+        n_hashes = max(1, int(round(n_bits / n_items * math.log(2))))
+        bf = cls(n_bits, n_hashes)
+        for item in items:
+            bf.add(item)
+        return bf
+
+    def add(self, item):
+        bits, n_bits = self.bits, self.n_bits
+        h1, h2 = _hashes(item)
+        for i in range(self.n_hashes):
+            pos = (h1 + i * h2) % n_bits
+            bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item):
+        bits, n_bits = self.bits, self.n_bits
+        h1, h2 = _hashes(item)
+        for i in range(self.n_hashes):
+            pos = (h1 + i * h2) % n_bits
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
+def _hashes(item):
+    data = item.encode('utf8')
+    return zlib.crc32(data) & 0xffffffff, (zlib.crc32(data, _SEED) & 0xffffffff) | 1
+
+
+def prefix_filter_items(keys):
+    """
+    Iterate over first tokens and first token bigrams of
+    space-separated ``keys``::
+
+        >>> sorted(set(prefix_filter_items(['New York City', 'York'])))
+        ['New', 'New York', 'York']
+    """
+    for key in keys:
+        tokens = key.split(' ', 2)
+        yield tokens[0]
+        if len(tokens) > 1:
+            yield tokens[0] + ' ' + tokens[1]
+
+
+def get_bloom_filename(filename):
+    """ Return a name of the Bloom filter file for gazetteer ``filename`` """
+    return filename + BLOOM_SUFFIX
+
+
+def write_bloom_filter(filename, keys, error_rate=0.01):
+    """
+    Create a Bloom filter with first tokens and bigrams of ``keys``
+    of gazetteer file ``filename`` and save it next to the file.
+    Return the filter.
+    """
+    bf = BloomFilter.from_items(prefix_filter_items(keys), error_rate)
+    header = _HEADER.pack(os.path.getsize(filename),
+                          file_sha1(filename).encode('ascii'),
+                          bf.n_bits, bf.n_hashes)
+    with replacing_file(get_bloom_filename(filename)) as tmp_filename:
+        with io.open(tmp_filename, 'wb') as f:
+            f.write(_MAGIC)
+            f.write(header)
+            f.write(bytes(bf.bits))
+    return bf
+
+
+def read_bloom_filter(filename):
+    """
+    Return :class:`BloomFilter` for gazetteer file ``filename``,
+    or None if there is no filter file or it is outdated (gazetteer
+    file size or hash is different from the recorded one).
+    """
+    bloom_filename = get_bloom_filename(filename)
+    if not os.path.exists(bloom_filename):
+        return None
+    with io.open(bloom_filename, 'rb') as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            return None
+        file_size, sha1, n_bits, n_hashes = _HEADER.unpack(f.read(_HEADER.size))
+        if file_size != os.path.getsize(filename):
+            return None
+        if sha1 != file_sha1(filename).encode('ascii'):
+            return None
+        bits = bytearray(f.read())
+    return BloomFilter(n_bits, n_hashes, bits)
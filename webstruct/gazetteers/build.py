@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Build gazetteer files from GeoNames dumps::
+
+    python -m webstruct.gazetteers.build <data_dir> [--casefold] [--jobs N]
+
+Each output is described by a :class:`GazetteerTarget`. Targets store
+a fingerprint of their inputs and options in gazetteer metadata
+(see :mod:`webstruct.gazetteers.metadata`); outputs which are up to date
+are not rebuilt. Each GeoNames dump is parsed once for all targets which
+use it, and tries are built in parallel worker processes.
+
+Gazetteer keys can be normalized at build time (see
+:class:`~webstruct.utils.TextNormalizer`); normalization options are
+stored in metadata, and gazetteer global features apply the same
+normalization to document tokens.
+"""
+from __future__ import absolute_import, print_function
+import os
+import json
+import hashlib
+import argparse
+import multiprocessing
+
+from webstruct.utils import effective_n_jobs, TextNormalizer
+from webstruct.gazetteers.geonames import (
+    iter_geonames_zipped,
+    filter_geonames,
+    to_dawg,
+    to_marisa,
+)
+from webstruct.gazetteers.metadata import save_gazetteer, read_gazetteer_metadata
+from webstruct.gazetteers.bloom import (
+    write_bloom_filter,
+    read_bloom_filter,
+    get_bloom_filename,
+)
+
+# Version of the gazetteer build code. It is a part of the build
+# fingerprint, so increase it when a change of filtering, normalization
+# or file formats makes previously built gazetteers outdated.
+BUILD_VERSION = 1
+
+
+class GazetteerTarget(object):
+    """
+    Gazetteer file ``filename`` built from zipped GeoNames dump ``source``
+    (both are relative to a data directory). ``format`` is either 'dawg'
+    (``dawg.CompletionDAWG`` with names) or 'marisa'
+    (``marisa_trie.RecordTrie`` with names and GeoNames codes).
+    If ``normalization`` (a :class:`~webstruct.utils.TextNormalizer`
+    or a dict with its options) is not None, names are normalized.
+    If ``bloom_filter`` is True, a Bloom filter with first tokens and
+    bigrams of names is saved next to the gazetteer (see
+    :mod:`webstruct.gazetteers.bloom`). ``filters`` are passed
+    to :func:`~.filter_geonames`.
+    """
+    def __init__(self, filename, source, format='dawg', normalization=None,
+                 bloom_filter=False, **filters):
+        if format not in {'dawg', 'marisa'}:
+            raise ValueError("Unknown gazetteer format: %r" % format)
+        self.filename = filename
+        self.source = source
+        self.format = format
+        if normalization is not None and not isinstance(normalization,
+                                                        TextNormalizer):
+            normalization = TextNormalizer.from_spec(normalization)
+        self.normalizer = normalization
+        self.bloom_filter = bloom_filter
+        self.filters = {}
+        for key, value in filters.items():
+            if isinstance(value, (list, tuple, set)):
+                value = sorted(value)
+            if value is not None:
+                self.filters[key] = value
+
+    def get_build_config(self, data_dir):
+        """
+        Return a dict with target options, source file information
+        and a fingerprint of them.
+        """
+        stat = os.stat(os.path.join(data_dir, self.source))
+        config = {
+            'version': BUILD_VERSION,
+            'source': self.source,
+            'source_size': stat.st_size,
+            'source_mtime': int(stat.st_mtime),
+            'format': self.format,
+            'normalization': self.normalizer and self.normalizer.spec,
+            'bloom_filter': self.bloom_filter,
+            'filters': self.filters,
+        }
+        data = json.dumps(config, sort_keys=True).encode('utf8')
+        config['fingerprint'] = hashlib.sha1(data).hexdigest()
+        return config
+
+    def is_up_to_date(self, data_dir):
+        path = os.path.join(data_dir, self.filename)
+        if not os.path.exists(path):
+            return False
+        meta = read_gazetteer_metadata(path)
+        if meta is None:
+            return False
+        if self.bloom_filter and read_bloom_filter(path) is None:
+            return False
+        fingerprint = meta['build_config'].get('fingerprint')
+        return fingerprint == self.get_build_config(data_dir)['fingerprint']
+
+    def __repr__(self):
+        return "GazetteerTarget(%r, %r)" % (self.filename, self.source)
+
+
+def contact_targets(format='dawg', normalization=None, bloom_filter=False):
+    """
+    Targets for a contact extraction model: cities from cities1000,
+    cities5000 and cities15000 dumps, and ADM1-ADM4 administrative
+    divisions from allCountries dump.
+    """
+    ext = '.dafsa' if format == 'dawg' else '.marisa'
+    targets = [
+        GazetteerTarget('cities%s%s' % (size, ext), 'cities%s.zip' % size,
+                        format=format, normalization=normalization,
+                        bloom_filter=bloom_filter)
+        for size in [1000, 5000, 15000]
+    ]
+    targets += [
+        GazetteerTarget('adm%s%s' % (level, ext), 'allCountries.zip',
+                        format=format, normalization=normalization,
+                        bloom_filter=bloom_filter,
+                        feature_codes=['ADM%s' % level])
+        for level in [1, 2, 3, 4]
+    ]
+    return targets
+
+
+def build_gazetteers(targets, data_dir, n_jobs=1, force=False,
+                     chunksize=100000):
+    """
+    Build gazetteers for ``targets`` which are not up to date
+    (or all of them, if ``force`` is True). Return a list of built targets.
+    """
+    targets = [t for t in targets if force or not t.is_up_to_date(data_dir)]
+    n_jobs = effective_n_jobs(n_jobs)
+    pool = multiprocessing.Pool(n_jobs) if n_jobs > 1 else None
+    results = []
+    try:
+        for source, source_targets in _group_by_source(targets):
+            print("reading {}".format(source))
+            frames = _read_filtered(os.path.join(data_dir, source),
+                                    source_targets, chunksize)
+            for target, df in zip(source_targets, frames):
+                print("compiling {}".format(target.filename))
+                args = (target, df, data_dir, target.get_build_config(data_dir))
+                if pool is None:
+                    _build_target(*args)
+                else:
+                    results.append(pool.apply_async(_build_target, args))
+        for result in results:
+            result.get()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return targets
+
+
+def _group_by_source(targets):
+    groups = {}
+    for target in targets:
+        groups.setdefault(target.source, []).append(target)
+    return sorted(groups.items())
+
+
+def _read_filtered(path, targets, chunksize):
+    """
+    Parse GeoNames dump ``path`` once; return a list with a DataFrame
+    of rows matching filters for each target.
+    """
+    import pandas as pd
+
+    chunks = [[] for _ in targets]
+    for chunk in iter_geonames_zipped(path, chunksize=chunksize):
+        for target, target_chunks in zip(targets, chunks):
+            target_chunks.append(filter_geonames(chunk, **target.filters))
+    return [pd.concat(target_chunks, ignore_index=True)
+            for target_chunks in chunks]
+
+
+def _build_target(target, df, data_dir, build_config):
+    if target.format == 'dawg':
+        data = to_dawg(df, normalizer=target.normalizer)
+    else:
+        data = to_marisa(df, normalizer=target.normalizer)
+    filename = os.path.join(data_dir, target.filename)
+    save_gazetteer(data, filename, **build_config)
+    if target.bloom_filter:
+        write_bloom_filter(filename, data.iterkeys())
+    elif os.path.exists(get_bloom_filename(filename)):
+        os.remove(get_bloom_filename(filename))
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(
+        description="Build gazetteers for contact extraction "
+                    "from GeoNames dumps in DATA_DIR.")
+    p.add_argument('data_dir')
+    p.add_argument('--format', choices=['dawg', 'marisa'], default='dawg')
+    p.add_argument('--casefold', action='store_true',
+                   help="casefold names")
+    p.add_argument('--strip-diacritics', action='store_true',
+                   help="remove diacritics from names")
+    p.add_argument('--collapse-punctuation', action='store_true',
+                   help="remove punctuation from name tokens")
+    p.add_argument('--bloom-filter', action='store_true',
+                   help="save Bloom filters to speed up gazetteer lookups")
+    p.add_argument('--jobs', '-j', type=int, default=-1,
+                   help="number of worker processes (default: all CPUs)")
+    p.add_argument('--force', action='store_true',
+                   help="rebuild gazetteers which are up to date")
+    args = p.parse_args(argv)
+
+    normalization = TextNormalizer.from_spec({
+        'casefold': args.casefold,
+        'strip_diacritics': args.strip_diacritics,
+        'collapse_punctuation': args.collapse_punctuation,
+    })
+    targets = contact_targets(format=args.format, normalization=normalization,
+                              bloom_filter=args.bloom_filter)
+    built = build_gazetteers(targets, args.data_dir, n_jobs=args.jobs,
+                             force=args.force)
+    print("built {} of {} gazetteers".format(len(built), len(targets)))
+
+
+if __name__ == '__main__':
+    main()
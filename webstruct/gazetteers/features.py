@@ -1,22 +1,40 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 from webstruct.gazetteers.geonames import GAZETTEER_FORMAT
-from webstruct.features.global_features import LongestMatchGlobalFeature
+from webstruct.features.global_features import _TrieFileGlobalFeature
 
 
-class MarisaGeonamesGlobalFeature(LongestMatchGlobalFeature):
+class MarisaGeonamesGlobalFeature(_TrieFileGlobalFeature):
     """
     Global feature that matches longest entities from a lexicon
     extracted from geonames.org and stored in a MARISA Trie.
+    The trie is opened on first use.
+
+    By default the trie file is memory-mapped (``mmap=True``) instead of
+    being loaded, so processes which use the same gazetteer (e.g. workers
+    with unpickled copies of a model) share its pages through OS page
+    cache, and only the parts of the trie which are needed are read.
     """
-    def __init__(self, filename, featname, format=None):
+    def __init__(self, filename, featname, format=None, mmap=True,
+                 normalization=None):
+        self.format = format
+        self.mmap = mmap
+        super(MarisaGeonamesGlobalFeature, self).__init__(filename, featname,
+                                                          normalization)
+
+    def _load_data(self):
         import marisa_trie
 
-        self.filename = filename
-        self.data = marisa_trie.RecordTrie(format or GAZETTEER_FORMAT)
-        self.data.load(filename)
+        data = marisa_trie.RecordTrie(self.format or GAZETTEER_FORMAT)
+        if self.mmap:
+            data.mmap(self.filename)
+        else:
+            data.load(self.filename)
+        return data
 
-        super(MarisaGeonamesGlobalFeature, self).__init__(self.data, featname)
+    def __setstate__(self, state):
+        state.setdefault('mmap', True)
+        super(MarisaGeonamesGlobalFeature, self).__setstate__(state)
 
 
 # TODO: add features that'd allow to check entities for compatibility.
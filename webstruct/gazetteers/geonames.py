@@ -4,7 +4,6 @@ import os
 import csv
 import six
 import zipfile
-import numpy as np
 
 GAZETTEER_FORMAT = "2s 1s 5s 2s 3s"
 GAZETTEER_COLUMNS = ['country_code', 'feature_class', 'feature_code',
@@ -38,30 +37,43 @@ _GEONAMES_PANDAS_PARAMS = dict(
 )
 
 
-def to_marisa(df, columns=GAZETTEER_COLUMNS, format=GAZETTEER_FORMAT):
+def to_marisa(df, columns=GAZETTEER_COLUMNS, format=GAZETTEER_FORMAT,
+              normalizer=None):
     """
     Encode ``pandas.DataFrame`` with GeoNames data
     (loaded using :func:`read_geonames` and maybe filtered in some way)
-    to a ``marisa.RecordTrie``.
+    to a ``marisa.RecordTrie``. ``df`` can also be an iterator
+    of DataFrame chunks (see :func:`iter_geonames`). Use
+    :func:`webstruct.gazetteers.metadata.save_gazetteer` to save it
+    together with its metadata.
+
+    If ``normalizer`` (a :class:`~webstruct.utils.TextNormalizer`)
+    is passed, names are normalized with it.
     """
     import marisa_trie
-    return marisa_trie.RecordTrie(format, _iter_geonames_items(df, columns))
+    items = _iter_geonames_items(df, columns, normalizer)
+    return marisa_trie.RecordTrie(format, items)
 
 
-def to_dawg(df, columns=None, format=None):
+def to_dawg(df, columns=None, format=None, normalizer=None):
     """
     Encode ``pandas.DataFrame`` with GeoNames data
     (loaded using :func:`read_geonames` and maybe filtered in some way)
     to ``dawg.DAWG`` or ``dawg.RecordDAWG``. ``dawg.DAWG`` is created
-    if ``columns`` and ``format`` are both None.
+    if ``columns`` and ``format`` are both None. ``df`` can also be
+    an iterator of DataFrame chunks (see :func:`iter_geonames`).
+    Names are normalized with ``normalizer`` if it is not None.
     """
     import dawg
     if columns is None:
         assert format is None
-        df = _split_names_into_rows(df)
-        return dawg.CompletionDAWG(iter(df.name))
+        names = set()
+        for chunk in _iter_chunks(df):
+            names.update(_unique_names(chunk, normalizer))
+        return dawg.CompletionDAWG(names)
 
-    return dawg.RecordDAWG(format, _iter_geonames_items(df, columns))
+    return dawg.RecordDAWG(format,
+                           _iter_geonames_items(df, columns, normalizer))
 
 
 def read_geonames(filename):
@@ -76,63 +88,163 @@ def read_geonames(filename):
 
 def read_geonames_zipped(zip_filename, geonames_filename=None):
     """ Parse zipped geonames file. """
-    if geonames_filename is None:
-        root, filename = os.path.split(zip_filename)
-        geonames_filename = filename.replace('.zip', '.txt')
-
+    geonames_filename = _get_geonames_filename(zip_filename, geonames_filename)
     with zipfile.ZipFile(zip_filename, 'r') as zf:
         fp = zf.open(geonames_filename)
         return read_geonames(fp)
 
 
-def _iter_geonames_items(df, columns):
-    """ Iterate over (name, [column_values_as_utf8]) tuples """
-    df = _split_names_into_rows(df)
-    for idx, row in df.iterrows():
-        yield row['name'], _ensure_utf8([row[c] for c in columns])
+def iter_geonames(filename, chunksize=100000, **filters):
+    """
+    Parse geonames file in chunks; yield pandas.DataFrame objects with
+    at most ``chunksize`` rows which pass ``filters``
+    (see :func:`filter_geonames`). Chunks without matching rows
+    are skipped. Only the current chunk is kept in memory.
+    """
+    import pandas as pd
+    reader = pd.read_csv(filename, chunksize=chunksize,
+                         **_GEONAMES_PANDAS_PARAMS)
+    for chunk in reader:
+        chunk = filter_geonames(chunk, **filters)
+        if len(chunk):
+            yield chunk
+
+
+def iter_geonames_zipped(zip_filename, geonames_filename=None,
+                         chunksize=100000, **filters):
+    """
+    Parse zipped geonames file in chunks, without extracting it;
+    see :func:`iter_geonames`.
+    """
+    geonames_filename = _get_geonames_filename(zip_filename, geonames_filename)
+    with zipfile.ZipFile(zip_filename, 'r') as zf:
+        with zf.open(geonames_filename) as fp:
+            for chunk in iter_geonames(fp, chunksize, **filters):
+                yield chunk
 
 
-def _joined_names_column(df):
+def filter_geonames(df, feature_classes=None, feature_codes=None,
+                    countries=None, min_population=None):
     """
-    Join data from all name columns into a single column.
+    Return rows of GeoNames ``df`` with a feature class from
+    ``feature_classes``, a feature code from ``feature_codes``,
+    a country code from ``countries`` and population of at least
+    ``min_population``. Filters which are None are not applied.
     """
-    return df.apply(
-        lambda row: ','.join(set([
-            six.text_type(n)
-            for n in [row['main_name'], row['asciiname'], row['alternatenames']]
-            if n and n is not np.nan
-        ])),
-        axis=1
+    mask = None
+    conditions = [
+        ('feature_class', feature_classes),
+        ('feature_code', feature_codes),
+        ('country_code', countries),
+    ]
+    for column, values in conditions:
+        if values is not None:
+            mask = _and(mask, df[column].isin(list(values)))
+    if min_population is not None:
+        mask = _and(mask, df['population'] >= min_population)
+    return df if mask is None else df[mask]
+
+
+def _and(mask, condition):
+    return condition if mask is None else mask & condition
+
+
+def _get_geonames_filename(zip_filename, geonames_filename):
+    if geonames_filename is None:
+        root, filename = os.path.split(zip_filename)
+        geonames_filename = filename.replace('.zip', '.txt')
+    return geonames_filename
+
+
+def _iter_chunks(df):
+    """ Iterate over DataFrame chunks; ``df`` is a DataFrame or an iterator """
+    import pandas as pd
+    if isinstance(df, pd.DataFrame):
+        return iter([df])
+    return df
+
+
+def _iter_geonames_items(df, columns, normalizer=None):
+    """
+    Iterate over unique (name, [column_values_as_utf8]) tuples; ``df``
+    is a DataFrame or an iterator of DataFrames.
+    """
+    import pandas as pd
+    if isinstance(df, pd.DataFrame):
+        return _iter_chunk_items(df, columns, normalizer)
+    return _iter_unique(
+        item for chunk in df
+        for item in _iter_chunk_items(chunk, columns, normalizer)
     )
 
 
-def _split_names_into_rows(df):
+def _iter_unique(items):
+    seen = set()
+    for item in items:
+        if item not in seen:
+            seen.add(item)
+            yield item
+
+
+def _iter_chunk_items(df, columns, normalizer=None):
     """
-    Create a separate row for each alternate name (with other data duplicated).
-    Delete 'main_name', 'asciiname' and 'alternatenames' columns and add
-    a single 'name' column instead.
+    Iterate over unique (name, [column_values_as_utf8]) tuples of a single
+    DataFrame.
     """
     import pandas as pd
 
-    names = _joined_names_column(df).str.split(',')
-    name_lenghts = names.map(len)
-    idx = np.repeat(name_lenghts.index, name_lenghts.values)
+    rows, names = _split_names(df, normalizer)
+    items = pd.DataFrame({'name': names})
+    encoded_values = []
+    for idx, column in enumerate(columns):
+        codes, encoded = _encode_utf8(df[column])
+        items[idx] = codes[rows]
+        encoded_values.append(encoded)
+    items = items.drop_duplicates()
+    return zip(items['name'].to_numpy(dtype=object), zip(*[
+        encoded[items[idx].values] for idx, encoded in enumerate(encoded_values)
+    ]))
 
-    names_split = np.concatenate(names.values)
-    names_s = pd.Series(names_split, index=idx)
-    names_s.name = 'name'
 
-    df = df.join(names_s, )
-    del df['main_name']
-    del df['asciiname']
-    del df['alternatenames']
+def _unique_names(df, normalizer=None):
+    rows, names = _split_names(df, normalizer)
+    return set(names)
 
-    cols = df.columns.tolist()
-    cols = cols[0:1] + cols[-1:] + cols[1:-1]
-    df = df[cols]
-    return df.reset_index()
 
+def _split_names(df, normalizer=None):
+    """
+    Return ``(rows, names)`` arrays with all names (main, ascii and
+    alternate) of all rows of ``df``, one name per item; ``rows``
+    contains row positions. Names are split by commas, empty names
+    are skipped, duplicate names of a row are removed. If ``normalizer``
+    is not None, names are normalized (before removing duplicates).
+    """
+    import pandas as pd
+
+    names = pd.concat([
+        df[column].reset_index(drop=True).dropna().astype(six.text_type)
+        for column in ['main_name', 'asciiname', 'alternatenames']
+    ])
+    names = names.str.split(',').explode()
+    names = names[names != '']
+    if normalizer is not None:
+        names = names.map(normalizer.normalize_key)
+    items = pd.DataFrame({'row': names.index, 'name': names.values})
+    items = items.drop_duplicates()
+    return items['row'].values, items['name'].to_numpy(dtype=object)
+
+
+def _encode_utf8(series):
+    """
+    Return ``(codes, encoded)`` tuple where ``codes`` is an array
+    of indices of ``series`` values in ``encoded`` array of unique values
+    encoded to utf8 bytes. Missing values are encoded as ``b'nan'``.
+    """
+    import numpy as np
+    import pandas as pd
 
-def _ensure_utf8(lst):
-    return [v.encode('utf8') if not isinstance(v, float) else str(v)
-            for v in lst]
+    values = series.astype(object).where(series.notnull(), 'nan')
+    codes, uniques = pd.factorize(values)
+    encoded = np.empty(len(uniques), dtype=object)
+    encoded[:] = [six.text_type(value).encode('utf8') for value in uniques]
+    return codes, encoded
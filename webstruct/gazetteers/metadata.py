@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Gazetteer files can have a metadata "sidecar" file next to them
+(``<filename>.meta.json``) with information which is expensive to compute
+from a trie itself: maximum number of tokens in a key, number of keys
+and a build configuration. Gazetteer global features read it at
+construction time, so they don't need to walk all trie keys.
+
+Metadata also records size and SHA1 hash of the gazetteer file;
+metadata of a changed file is outdated and ignored.
+"""
+from __future__ import absolute_import
+import os
+import io
+import json
+import hashlib
+
+from webstruct.utils import replacing_file
+
+METADATA_SUFFIX = '.meta.json'
+
+
+def get_metadata_filename(filename):
+    """ Return a name of the metadata file for gazetteer ``filename`` """
+    return filename + METADATA_SUFFIX
+
+
+def gazetteer_metadata(keys, **build_config):
+    """
+    Compute metadata for a gazetteer with ``keys``::
+
+        >>> meta = gazetteer_metadata(['New York', 'York', 'York'], source='test')
+        >>> meta['max_length'], meta['n_keys'], meta['build_config']
+        (2, 2, {'source': 'test'})
+
+    ``n_keys`` is a number of distinct keys (a record trie yields a key
+    for each of its records).
+    """
+    max_length, seen = 0, set()
+    for key in keys:
+        if key in seen:
+            continue
+        seen.add(key)
+        max_length = max(max_length, len(key.split()))
+    return {
+        'max_length': max_length,
+        'n_keys': len(seen),
+        'build_config': build_config,
+    }
+
+
+def write_gazetteer_metadata(filename, keys, **build_config):
+    """
+    Compute metadata for gazetteer file ``filename`` with ``keys``
+    and save it next to the file. Return metadata dict.
+    """
+    meta = gazetteer_metadata(keys, **build_config)
+    meta['file_size'] = os.path.getsize(filename)
+    meta['file_sha1'] = file_sha1(filename)
+    with replacing_file(get_metadata_filename(filename)) as tmp_filename:
+        with io.open(tmp_filename, 'w', encoding='utf8') as f:
+            f.write(json.dumps(meta, sort_keys=True, ensure_ascii=False))
+    return meta
+
+
+def read_gazetteer_metadata(filename):
+    """
+    Return metadata dict for gazetteer file ``filename``, or None
+    if there is no metadata file or it is outdated (gazetteer file size
+    or hash is different from the recorded one).
+    """
+    meta_filename = get_metadata_filename(filename)
+    if not os.path.exists(meta_filename):
+        return None
+    with io.open(meta_filename, 'r', encoding='utf8') as f:
+        meta = json.loads(f.read())
+    if meta.get('file_size') != os.path.getsize(filename):
+        return None
+    if meta.get('file_sha1') != file_sha1(filename):
+        return None
+    return meta
+
+
+def file_sha1(filename, chunk_size=2**20):
+    """ Return a hex SHA1 hash of file ``filename`` contents """
+    sha1 = hashlib.sha1()
+    with io.open(filename, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def save_gazetteer(data, filename, **build_config):
+    """
+    Save ``data`` (a ``dawg`` or ``marisa_trie`` object) to ``filename``
+    and write its metadata file. ``build_config`` keyword arguments
+    (they should be JSON-serializable) are stored in metadata as-is.
+    Return metadata dict.
+
+    Files are replaced atomically (see :func:`webstruct.utils.replacing_file`),
+    so a gazetteer can be rebuilt while processes which memory-mapped
+    the old file are still running.
+    """
+    with replacing_file(filename) as tmp_filename:
+        data.save(tmp_filename)
+    return write_gazetteer_metadata(filename, data.iterkeys(), **build_config)
@@ -0,0 +1,134 @@
+from __future__ import print_function
+import os
+import sys
+import random
+import shutil
+import zipfile
+import tempfile
+
+from webstruct.gazetteers.geonames import (
+    to_marisa,
+    read_geonames_zipped,
+    iter_geonames_zipped,
+    filter_geonames,
+    _GEONAMES_COLUMNS,
+)
+from webstruct._benchmark import measure, format_bytes
+
+
+# cities1000 has ~140k rows; allCountries has ~12M rows
+SIZES = [10000, 140000, 1200000, 12000000]
+
+# to_marisa is also benchmarked on a DataFrame which is created in memory
+# before the measurement; it is skipped for larger sizes
+MAX_DATAFRAME_ROWS = 1200000
+
+CHUNK_ROWS = 500000
+
+
+def random_geonames(n_rows, seed=0):
+    """
+    Create a ``pandas.DataFrame`` which looks like GeoNames data:
+    most rows have a few alternate names, codes are repeated.
+    """
+    import pandas as pd
+
+    rng = random.Random(seed)
+    syllables = ['ber', 'lin', 'york', 'new', 'san', 'ta', 'mo', 'ni', 'ka',
+                 'ville', 'burg', 'ton', 'dorf', 'grad', 'sk', 'o', 'a']
+
+    def name():
+        words = rng.choice([1, 1, 1, 2, 2, 3])
+        return ' '.join(
+            ''.join(rng.choice(syllables) for _ in range(rng.randint(1, 3)))
+            .capitalize() for _ in range(words)
+        )
+
+    main_names = [name() for _ in range(n_rows)]
+    return pd.DataFrame({
+        'main_name': main_names,
+        'asciiname': main_names,
+        'alternatenames': [
+            ','.join(name() for _ in range(rng.choice([0, 0, 1, 2, 5, 10])))
+            or None for _ in range(n_rows)
+        ],
+        'country_code': [rng.choice(['US', 'DE', 'RU', 'FR']) for _ in range(n_rows)],
+        'feature_class': [rng.choice(['P', 'A']) for _ in range(n_rows)],
+        # ADM1 rows are rare, as in allCountries
+        'feature_code': [rng.choice(['PPL'] * 50 + ['PPLA'] * 49 + ['ADM1'])
+                         for _ in range(n_rows)],
+        'admin1_code': [rng.choice(['NY', '16', None]) for _ in range(n_rows)],
+        'admin2_code': [rng.choice(['061', None]) for _ in range(n_rows)],
+    })
+
+
+def iter_random_geonames(n_rows, chunksize=CHUNK_ROWS):
+    """
+    Yield DataFrames from :func:`random_geonames` with ``n_rows``
+    rows in total, ``chunksize`` rows at most in each.
+    """
+    for seed, start in enumerate(range(0, n_rows, chunksize)):
+        yield random_geonames(min(chunksize, n_rows - start), seed=seed)
+
+
+def write_geonames_zip(chunks, path):
+    """
+    Save an iterable of DataFrame ``chunks`` to a zip file
+    in GeoNames dump format; only one chunk is kept in memory.
+    """
+    name = os.path.basename(path).replace('.zip', '.txt')
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        with zf.open(name, 'w', force_zip64=True) as fp:
+            for df in chunks:
+                df = df.copy()
+                for column in _GEONAMES_COLUMNS:
+                    if column not in df:
+                        df[column] = (0 if column in {'geonameid', 'population'}
+                                      else None)
+                txt = df[_GEONAMES_COLUMNS].to_csv(sep='\t', header=False,
+                                                   index=False)
+                fp.write(txt.encode('utf8'))
+
+
+def build_adm1_full(path):
+    df = read_geonames_zipped(path)
+    return to_marisa(filter_geonames(df, feature_codes=['ADM1']))
+
+
+def build_adm1_streaming(path):
+    return to_marisa(iter_geonames_zipped(path, feature_codes=['ADM1']))
+
+
+def main(sizes):
+    for n_rows in sizes:
+        if n_rows > MAX_DATAFRAME_ROWS:
+            continue
+        df = random_geonames(n_rows)
+        elapsed, peak = measure(to_marisa, df)
+        print("to_marisa, %d rows: %0.1fs, peak memory +%s" % (
+            n_rows, elapsed, format_bytes(peak)))
+        del df
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for n_rows in sizes:
+            path = os.path.join(tmp_dir, 'geonames.zip')
+            write_geonames_zip(iter_random_geonames(n_rows), path)
+            print("%d rows: %s zipped" % (
+                n_rows, format_bytes(os.path.getsize(path))))
+            for name, func in [('full', build_adm1_full),
+                               ('streaming', build_adm1_streaming)]:
+                try:
+                    elapsed, peak = measure(func, path)
+                except RuntimeError as e:
+                    print("ADM1 from %d rows, %s read: failed (%s)" % (
+                        n_rows, name, e))
+                    continue
+                print("ADM1 from %d rows, %s read: %0.1fs, peak memory +%s" % (
+                    n_rows, name, elapsed, format_bytes(peak)))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or SIZES)
@@ -10,11 +10,13 @@ them from regular text/tokens.
 
 from __future__ import absolute_import, print_function
 import re
-import copy
+import multiprocessing
+from copy import deepcopy
 from itertools import groupby
-from collections import namedtuple
-from six.moves import zip
+from collections import namedtuple, deque
+from six.moves import zip, collections_abc
 
+from lxml import etree
 from lxml.etree import iterwalk
 
 from webstruct.sequence_encoding import IobEncoder
@@ -22,6 +24,8 @@ from webstruct.text_tokenizers import tokenize, TextToken
 from webstruct.utils import (
     replace_html_tags,
     kill_html_tags,
+    effective_n_jobs,
+    uses_fork,
 )
 
 
@@ -51,6 +55,7 @@ class HtmlToken(_HtmlToken):
 
     * :attr:`token` is the current token (as text);
     * :attr:`parent` is token's parent HTML element (as lxml's Element);
+    * :attr:`parent_tag` is a tag name of :attr:`parent`;
     * :attr:`root` is an ElementTree this token belongs to.
 
     """
@@ -64,6 +69,10 @@ class HtmlToken(_HtmlToken):
             return self.elem
         return self.elem.getparent()
 
+    @property
+    def parent_tag(self):
+        return self.parent.tag
+
     @property
     def root(self):
         return self.elem.getroottree()
@@ -76,6 +85,119 @@ class HtmlToken(_HtmlToken):
         )
 
 
+class DetachedHtmlToken(object):
+    """
+    HTML token info which doesn't keep a reference to the HTML tree,
+    so the tree can be garbage collected while tokens are still in use
+    (e.g. for training). Use :func:`detach_html_tokens` to create
+    detached tokens from :class:`HtmlToken` instances.
+
+    It provides the same :attr:`index`, :attr:`tokens`, :attr:`is_tail`,
+    :attr:`position`, :attr:`length`, :attr:`token` and :attr:`parent_tag`
+    attributes as :class:`HtmlToken`, plus :attr:`ancestor_tags` -
+    a frozenset with tag names of :attr:`HtmlToken.elem` and all its
+    ancestors. Tree elements themselves are not available, so detached
+    tokens can't be used to build annotated trees or to group entities.
+    """
+    __slots__ = ['index', 'tokens', 'is_tail', 'position', 'length',
+                 'parent_tag', 'ancestor_tags']
+
+    def __init__(self, index, tokens, is_tail, position, length,
+                 parent_tag, ancestor_tags):
+        self.index = index
+        self.tokens = tokens
+        self.is_tail = is_tail
+        self.position = position
+        self.length = length
+        self.parent_tag = parent_tag
+        self.ancestor_tags = ancestor_tags
+
+    @property
+    def token(self):
+        return self.tokens[self.index]
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return ("DetachedHtmlToken("
+                "token=%r, parent_tag=%r, index=%s, position=%d, length=%d"
+                ")") % (
+            self.token, self.parent_tag, self.index, self.position, self.length
+        )
+
+
+def detach_html_tokens(html_tokens):
+    """
+    Convert a list of :class:`HtmlToken` instances to a list of
+    :class:`DetachedHtmlToken` instances::
+
+        >>> from webstruct import HtmlLoader, HtmlTokenizer
+        >>> tree = HtmlLoader().loadbytes(b"<p>hello, <a><b>John</b> Doe</a></p>")
+        >>> html_tokens, tags = HtmlTokenizer().tokenize_single(tree)
+        >>> detached = detach_html_tokens(html_tokens)
+        >>> detached[1]
+        DetachedHtmlToken(token='John', parent_tag='b', index=0, position=0, length=4)
+        >>> sorted(detached[1].ancestor_tags)
+        ['a', 'b', 'body', 'html', 'p']
+        >>> detached[2].parent_tag, sorted(detached[2].ancestor_tags)
+        ('a', ['a', 'b', 'body', 'html', 'p'])
+
+    Tokens from the same text block share ``tokens`` lists, and tokens
+    with the same set of ancestor tags share ``ancestor_tags`` frozensets.
+    :class:`DetachedHtmlToken` instances are returned unchanged.
+    """
+    detached = []
+    ancestor_tag_sets = None
+    for html_token in html_tokens:
+        if isinstance(html_token, DetachedHtmlToken):
+            detached.append(html_token)
+            continue
+
+        if ancestor_tag_sets is None:
+            ancestor_tag_sets = get_ancestor_tag_sets(html_token.root.getroot())
+        detached.append(DetachedHtmlToken(html_token.index,
+                                          html_token.tokens,
+                                          html_token.is_tail,
+                                          html_token.position,
+                                          html_token.length,
+                                          html_token.parent_tag,
+                                          ancestor_tag_sets[html_token.elem]))
+    return detached
+
+
+def get_ancestor_tag_sets(root):
+    """
+    Return a ``{elem: ancestor_tags}`` dict for all elements in ``root``
+    subtree, where ``ancestor_tags`` is a frozenset with tag names of
+    ``elem`` and all its ancestors. It is computed in a single pass
+    over the tree; equal frozensets are shared.
+
+        >>> root = etree.fromstring('<div><i>foo</i><strong><p>head 1</p></strong></div>')
+        >>> ancestor_tag_sets = get_ancestor_tag_sets(root)
+        >>> sorted(ancestor_tag_sets[root.find('.//p')])
+        ['div', 'p', 'strong']
+        >>> sorted(ancestor_tag_sets[root.find('i')])
+        ['div', 'i']
+    """
+    unique_tag_sets = {}
+    ancestor_tag_sets = {}
+    root_ancestors = frozenset(e.tag for e in root.iterancestors())
+    stack = [(root, root_ancestors)]
+    while stack:
+        elem, ancestor_tags = stack.pop()
+        tags = ancestor_tags | {elem.tag}
+        tags = unique_tag_sets.setdefault(tags, tags)
+        ancestor_tag_sets[elem] = tags
+        stack.extend((child, tags) for child in elem
+                     if isinstance(child.tag, str))
+    return ancestor_tag_sets
+
+
 class HtmlTokenizer(object):
     """
     Class for converting HTML trees (returned by one of the
@@ -132,7 +254,7 @@ class HtmlTokenizer(object):
         tag_pattern = self.sequence_encoder.token_processor.tag_re.pattern
         self._tag_re = re.compile(r"(^|\s)%s(\s|$)" % tag_pattern.strip())
 
-    def tokenize_single(self, tree):
+    def tokenize_single(self, tree, copy=True):
         """
         Return two lists:
 
@@ -141,6 +263,13 @@ class HtmlTokenizer(object):
 
         For unannotated HTML all tags will be "O" - they may be ignored.
 
+        By default the tree is copied before tokenization, so the tree
+        passed by caller is never changed and tokens refer to the copy.
+        Pass ``copy=False`` if you own the tree (e.g. it is parsed only
+        to be tokenized) to save time and memory: tokens then refer
+        to ``tree`` itself, and ``kill_html_tags`` and ``replace_html_tags``
+        options are applied to ``tree`` inplace.
+
         Example:
 
             >>> from webstruct import GateLoader, HtmlTokenizer
@@ -166,22 +295,138 @@ class HtmlTokenizer(object):
             ([], [])
 
         """
-        tree = copy.deepcopy(tree)
-        self.sequence_encoder.reset()
+        if copy:
+            tree = deepcopy(tree)
         self._prepare_tree(tree)
-        res = list(zip(*self._process_tree(tree)))
-        if not res:
-            return [], []
-        return list(res[0]), list(res[1])
+        return self._tokenize_prepared(tree)
 
-    def tokenize(self, trees):
+    def tokenize(self, trees, copy=True, n_jobs=1, detach=False):
+        """
+        Tokenize several trees; return ``(X, y)`` tuple with a list
+        of :class:`HtmlToken` lists and a list of tag lists.
+        See :meth:`tokenize_single` for the meaning of ``copy``.
+
+        Pass ``detach=True`` to get :class:`DetachedHtmlToken` instances
+        instead of :class:`HtmlToken`; they don't keep trees alive,
+        so trees can be freed right after tokenization. It makes sense
+        for training data: e.g. ``tokenize(load_trees(...), detach=True)``
+        never holds all parsed trees in memory.
+
+        Pass ``n_jobs`` to tokenize documents in parallel using
+        a pool of worker processes (-1 means "use all CPUs").
+        The result is the same as with ``n_jobs=1``. Workers prepare
+        trees themselves; with the "fork" start method of
+        :mod:`multiprocessing` they read trees of the current process
+        directly (and change only their own copy-on-write copies),
+        otherwise trees are sent to them serialized.
+        With ``detach=True`` workers return detached tokens; otherwise
+        tokens are bound to trees in the current process, which requires
+        copying (if ``copy`` is True) and preparing each tree here as well.
+        """
+        n_jobs = effective_n_jobs(n_jobs)
+        if n_jobs != 1:
+            return self._tokenize_parallel(trees, copy, n_jobs, detach)
         X, y = [], []
-        for tree in trees:
-            html_tokens, tags = self.tokenize_single(tree)
+        for html_tokens, tags in self.iter_tokenize(trees, copy, detach):
             X.append(html_tokens)
             y.append(tags)
         return X, y
 
+    def iter_tokenize(self, trees, copy=True, detach=False):
+        """
+        Generator version of :meth:`tokenize`: yield ``(html_tokens, tags)``
+        tuples one document at a time. ``trees`` can be an iterator,
+        e.g. a result of :func:`webstruct.loaders.load_trees`; when
+        the result is consumed lazily only a single document needs to be
+        in memory at a time.
+        """
+        for tree in trees:
+            html_tokens, tags = self.tokenize_single(tree, copy=copy)
+            if detach:
+                html_tokens = detach_html_tokens(html_tokens)
+            yield html_tokens, tags
+
+    def _tokenize_prepared(self, tree):
+        self.sequence_encoder.reset()
+        if self._is_annotated(tree):
+            tokenize_text = self._tokenize_and_split
+        else:
+            tokenize_text = self._tokenize_unannotated
+        res = list(zip(*self._process_tree(tree, tokenize_text)))
+        if not res:
+            return [], []
+        return list(res[0]), list(res[1])
+
+    def _tokenize_parallel(self, trees, copy, n_jobs, detach):
+        # Workers prepare and tokenize trees. With the "fork" start
+        # method tasks are tree indices and workers read shared trees
+        # (a forked worker prepares its own copy-on-write copy, so trees
+        # of the current process are not changed); otherwise tasks are
+        # trees serialized to XML bytes. Tasks are created lazily by
+        # the pool while results are received.
+        #
+        # Workers return detached tokens if ``detach`` is True; otherwise
+        # they return element indices instead of elements, and tokens
+        # are bound to a copy of the tree in the current process.
+        if uses_fork():
+            trees = list(trees)
+            shared_trees, func = trees, _tokenize_shared
+        else:
+            shared_trees, func = None, _tokenize_serialized
+        if isinstance(trees, collections_abc.Sized):
+            chunksize = max(1, min(16, len(trees) // (n_jobs * 4)))
+        else:
+            chunksize = 4
+
+        # trees waiting for results, in order
+        pending = deque()
+
+        def iter_tasks():
+            for index, tree in enumerate(trees):
+                pending.append(tree)
+                yield index if shared_trees is not None else _serialize_tree(tree)
+
+        pool = multiprocessing.Pool(n_jobs, _init_tokenize_worker,
+                                    (self, detach, shared_trees))
+        try:
+            X, y = [], []
+            for result in pool.imap(func, iter_tasks(), chunksize):
+                tree = pending.popleft()
+                if detach and result is not None:
+                    html_tokens, tags = result
+                else:
+                    if copy:
+                        tree = deepcopy(tree)
+                    self._prepare_tree(tree)
+                    html_tokens, tags = self._bind_tokens(tree, result)
+                    if detach:
+                        html_tokens = detach_html_tokens(html_tokens)
+                X.append(html_tokens)
+                y.append(tags)
+        finally:
+            pool.terminate()
+            pool.join()
+        return X, y
+
+    def _bind_tokens(self, tree, result):
+        elems = list(tree.iter())
+        if result is None or result[0] != len(elems):
+            # tree can't be reproduced from its serialized form
+            return self._tokenize_prepared(tree)
+
+        n_elems, blocks, tags = result
+        html_tokens = []
+        for elem_index, is_tail, char_tokens, spans in blocks:
+            elem = elems[elem_index]
+            for index, (position, length) in enumerate(spans):
+                html_tokens.append(HtmlToken(index,
+                                             char_tokens,
+                                             elem,
+                                             is_tail,
+                                             position,
+                                             length))
+        return html_tokens, tags
+
     def detokenize_single(self, html_tokens, tags):
         """
         Build annotated ``lxml.etree.ElementTree`` from
@@ -266,36 +511,56 @@ class HtmlTokenizer(object):
         if self.replace_html_tags:
             replace_html_tags(tree, self.replace_html_tags)
 
-    def _process_tree(self, tree):
-        if not isinstance(tree.tag, str) or tree.tag in self.ignore_html_tags:
-            return
+    def _is_annotated(self, tree):
+        """
+        Return True if there may be annotation tokens in the tree.
+        It is a cheap check which allows to skip sequence encoding
+        for unannotated HTML (e.g. at prediction time).
+        """
+        tag_re = self.sequence_encoder.token_processor.tag_re
+        for elem in tree.iter():
+            if elem.text and tag_re.search(elem.text):
+                return True
+            if elem.tail and tag_re.search(elem.tail):
+                return True
+        return False
+
+    def _process_tree(self, tree, tokenize_text):
+        # Tree is traversed using an explicit stack instead of recursion:
+        # the cost of emitting a token doesn't depend on element depth,
+        # and deeply nested trees can't hit the recursion limit.
+        # Each stack item is (elem, is_tail).
+        stack = [(tree, False)]
+        while stack:
+            elem, is_tail = stack.pop()
+            if is_tail:
+                for res in self._process_text(elem, True, tokenize_text):
+                    yield res
+                continue
 
-        head_tokens, head_tags = self._tokenize_and_split(tree.text)
-        char_tokens = [t.chars for t in head_tokens]
-        for index, (token, tag) in enumerate(zip(head_tokens, head_tags)):
-            yield HtmlToken(index,
-                            char_tokens,
-                            tree,
-                            False,
-                            token.position,
-                            token.length), tag
+            if not isinstance(elem.tag, str) or elem.tag in self.ignore_html_tags:
+                continue
 
-        for child in tree:  # where is my precious "yield from"?
-            for html_token, tag in self._process_tree(child):
-                yield html_token, tag
+            for res in self._process_text(elem, False, tokenize_text):
+                yield res
 
-        tail_tokens, tail_tags = self._tokenize_and_split(tree.tail)
-        char_tokens = [t.chars for t in tail_tokens]
-        for index, (token, tag) in enumerate(zip(tail_tokens, tail_tags)):
+            stack.append((elem, True))
+            stack.extend((child, False) for child in reversed(elem))
+
+    def _process_text(self, elem, is_tail, tokenize_text):
+        text = elem.tail if is_tail else elem.text
+        tokens, tags = tokenize_text(text)
+        char_tokens = [t.chars for t in tokens]
+        for index, (token, tag) in enumerate(zip(tokens, tags)):
             yield HtmlToken(index,
                             char_tokens,
-                            tree,
-                            True,
+                            elem,
+                            is_tail,
                             token.position,
                             token.length), tag
 
     def cleanup_tree(self, tree):
-        cleaned = copy.deepcopy(tree)
+        cleaned = deepcopy(tree)
         for _, elem in iterwalk(cleaned):
             self._cleanup_elem(elem)
 
@@ -320,6 +585,10 @@ class HtmlTokenizer(object):
         chains = [l for l in chains]
         return self.sequence_encoder.split(chains)
 
+    def _tokenize_unannotated(self, text):
+        tokens = list(self.text_tokenize_func(text or ''))
+        return tokens, ['O'] * len(tokens)
+
     def _limit_tags(self, input_tokens):
         if self.tagset is None:
             return input_tokens
@@ -341,3 +610,74 @@ class HtmlTokenizer(object):
         if state['text_tokenize_func'] == 'DEFAULT':
             state['text_tokenize_func'] = tokenize
         self.__dict__.update(state)
+
+
+_worker_tokenizer = None
+_worker_detach = False
+_worker_trees = None
+
+
+def _init_tokenize_worker(html_tokenizer, detach=False, trees=None):
+    global _worker_tokenizer, _worker_detach, _worker_trees
+    _worker_tokenizer = html_tokenizer
+    _worker_detach = detach
+    _worker_trees = trees
+
+
+def _serialize_tree(tree):
+    return etree.tostring(tree, encoding='utf8', with_tail=False), tree.tail
+
+
+def _tokenize_shared(index):
+    """
+    Tokenize ``index``-th tree shared with the main process
+    in a worker process; see :func:`_tokenize_tree`. The tree is
+    prepared in place: worker memory is a copy-on-write copy of
+    the main process memory, and each tree is tokenized once.
+    """
+    return _tokenize_tree(_worker_trees[index])
+
+
+def _tokenize_serialized(data):
+    """
+    Tokenize a tree serialized by :func:`_serialize_tree` in a worker
+    process; see :func:`_tokenize_tree`. Return None if the data
+    can't be parsed.
+    """
+    xml, tail = data
+    parser = etree.XMLParser(huge_tree=True, resolve_entities=False)
+    try:
+        tree = etree.fromstring(xml, parser)
+    except etree.XMLSyntaxError:
+        return None
+    tree.tail = tail
+
+    for elem in tree.iter():
+        # xmlns attributes of HTML documents become namespaces in XML
+        if isinstance(elem.tag, str) and elem.tag.startswith('{'):
+            elem.tag = etree.QName(elem).localname
+    return _tokenize_tree(tree)
+
+
+def _tokenize_tree(tree):
+    """
+    Prepare and tokenize a tree in a worker process.
+    Return ``(detached_tokens, tags)`` tuple if tokens are detached;
+    otherwise return ``(n_elems, blocks, tags)`` tuple, where ``blocks``
+    is a list of ``(elem_index, is_tail, char_tokens, spans)`` tuples.
+    """
+    _worker_tokenizer._prepare_tree(tree)
+    html_tokens, tags = _worker_tokenizer._tokenize_prepared(tree)
+    if _worker_detach:
+        return detach_html_tokens(html_tokens), tags
+
+    elem_indices = {elem: i for i, elem in enumerate(tree.iter())}
+    blocks = []
+    for html_token in html_tokens:
+        if html_token.index == 0:
+            blocks.append((elem_indices[html_token.elem],
+                           html_token.is_tail,
+                           html_token.tokens,
+                           []))
+        blocks[-1][3].append((html_token.position, html_token.length))
+    return len(elem_indices), blocks, tags
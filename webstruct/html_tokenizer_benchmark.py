@@ -1,34 +1,72 @@
-import os.path
-import glob
+from __future__ import print_function
 import timeit
 import functools
 
-import webstruct.webannotator
+from lxml import etree
+
 import webstruct.html_tokenizer
+from webstruct._benchmark import (
+    load_corpus_trees,
+    iter_corpus_trees,
+    measure,
+    format_bytes,
+)
+
 
-def load_trees(tokenizer, trees):
+def load_trees(tokenizer, trees, copy=True):
     for tree in trees:
-        tokenizer.tokenize_single(tree)
+        tokenizer.tokenize_single(tree, copy=copy)
 
-def main():
-    path = os.path.join(os.path.dirname(__file__) ,
-                        ".." ,
-                        "webstruct_data",
-                        "corpus/business_pages/wa/*.html")
 
-    paths = sorted(glob.glob(path))
+def tokenize_corpus(tokenizer, detach):
+    return tokenizer.tokenize(iter_corpus_trees(), copy=False, detach=detach)
 
-    with open(paths[0], 'rb') as sample_reader:
-        colors = webstruct.webannotator.EntityColors.from_htmlbytes(sample_reader.read())
-        entities = [typ for typ in colors]
 
-    loader = webstruct.WebAnnotatorLoader(known_entities=entities)
+def nested_tree(depth, text="Lorem ipsum dolor sit amet"):
+    """ Create a page with ``depth`` nested ``<div>`` elements """
+    root = etree.Element('html')
+    elem = etree.SubElement(root, 'body')
+    for level in range(depth):
+        elem = etree.SubElement(elem, 'div')
+        elem.text = text
+        elem.tail = text
+    return root
 
-    trees = [loader.load(p) for p in paths]
+
+def main():
+    trees = load_corpus_trees()
     tokenizer = webstruct.html_tokenizer.HtmlTokenizer()
     print(timeit.timeit(functools.partial(load_trees, tokenizer, trees),
                         setup='gc.enable()',
                         number=3))
 
+    for copy in [True, False]:
+        elapsed, peak = measure(load_trees, tokenizer, trees, copy)
+        print("tokenize_single(copy=%s): %0.2fs, peak memory +%s" % (
+            copy, elapsed, format_bytes(peak)))
+
+    for detach in [False, True]:
+        elapsed, peak = measure(tokenize_corpus, tokenizer, detach)
+        print("load + tokenize(detach=%s): %0.2fs, peak memory +%s" % (
+            detach, elapsed, format_bytes(peak)))
+
+    for n_jobs in [1, 2, 4]:
+        elapsed = timeit.timeit(
+            functools.partial(tokenizer.tokenize, trees, n_jobs=n_jobs),
+            number=1)
+        print("tokenize(n_jobs=%d): %0.1f pages/sec" % (
+            n_jobs, len(trees) / elapsed))
+
+    for depth in [10, 100, 1000]:
+        tree = nested_tree(depth)
+        n_tokens = len(tokenizer.tokenize_single(tree)[0])
+        number = max(1, 10000 // depth)
+        elapsed = timeit.timeit(
+            functools.partial(tokenizer.tokenize_single, tree, copy=False),
+            number=number)
+        print("depth %4d: %0.2fus per token" % (
+            depth, elapsed / number / n_tokens * 1e6))
+
+
 if __name__ == "__main__":
     main()
@@ -63,7 +63,7 @@ class NER(object):
         Return a list of ``(html_token, iob2_tag)`` tuples.
         """
         tree = self.loader.loadbytes(bytes_data)
-        html_tokens, _ = self.html_tokenizer.tokenize_single(tree)
+        html_tokens, _ = self.html_tokenizer.tokenize_single(tree, copy=False)
         tags = self.model.predict([html_tokens])[0]
         return html_tokens, tags
 
@@ -7,7 +7,7 @@ import tempfile
 
 import webstruct
 from webstruct.features import EXAMPLE_TOKEN_FEATURES
-from webstruct.crfsuite import create_crfsuite_pipeline
+from webstruct.crfsuite import create_crfsuite_pipeline, iter_crfsuite_data
 from webstruct.metrics import bio_classification_report
 from webstruct.model import NER
 from webstruct.utils import train_test_split_noshuffle
@@ -59,6 +59,19 @@ class CRFsuiteTest(unittest.TestCase):
         del model
         self.assertFalse(os.path.isfile(filename))
 
+    def test_iter_crfsuite_data(self):
+        html_tokenizer = webstruct.HtmlTokenizer(tagset=self.TAGSET)
+        X_train, X_test, y_train, y_test = self._get_train_test(8, 2)
+        model = self.get_pipeline()
+        model.fit(X_train, y_train)
+
+        model2 = self.get_pipeline(verbose=False)
+        X_iter, y_iter = iter_crfsuite_data(iter(get_trees(8)),
+                                            html_tokenizer, model2.fe)
+        model2.crf.fit(X_iter, y_iter)
+        self.assertEqual(list(map(list, model.predict(X_test))),
+                         list(map(list, model2.predict(X_test))))
+
     def test_devdata(self):
         X_train, X_dev, y_train, y_dev = self._get_train_test(8, 4)
         model = self.get_pipeline()
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import pickle
+import unittest
+from itertools import chain
+from collections import Counter
+
+from webstruct import HtmlTokenizer, HtmlFeatureExtractor
+from webstruct.html_tokenizer import detach_html_tokens
+from webstruct.features import (
+    EXAMPLE_TOKEN_FEATURES,
+    LongestMatchGlobalFeature,
+    MultiGazetteerGlobalFeature,
+    Pattern,
+)
+from webstruct.features.utils import (
+    get_feature_scope,
+    get_batch_func,
+    apply_features,
+    block_feature,
+    text_feature,
+    batch_implementation,
+    BLOCK_SCOPE,
+)
+from webstruct.feature_extraction import _CombinedFeatures
+from webstruct.utils import TextNormalizer
+from .utils import get_trees
+
+
+class CountingNormalizer(TextNormalizer):
+    calls = 0
+
+    def __call__(self, token):
+        self.calls += 1
+        return super(CountingNormalizer, self).__call__(token)
+
+
+class HtmlFeatureExtractorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.X, self.y = HtmlTokenizer().tokenize(get_trees(5))
+
+    def get_expected(self, token_features=EXAMPLE_TOKEN_FEATURES):
+        func = _CombinedFeatures(*token_features)
+        return [[func(tok) for tok in html_tokens] for html_tokens in self.X]
+
+    def test_text_cache(self):
+        fe = HtmlFeatureExtractor(EXAMPLE_TOKEN_FEATURES)
+        expected = self.get_expected()
+        self.assertEqual(fe.transform(self.X), expected)
+        self.assertTrue(len(fe._text_cache[1]) > 0)
+
+        # warm cache
+        self.assertEqual(fe.transform(self.X), expected)
+
+        # small cache
+        fe = HtmlFeatureExtractor(EXAMPLE_TOKEN_FEATURES, text_cache_size=10)
+        self.assertEqual(fe.transform(self.X), expected)
+        self.assertEqual(len(fe._text_cache[1]), 10)
+
+        # no cache
+        fe = HtmlFeatureExtractor(EXAMPLE_TOKEN_FEATURES, text_cache_size=0)
+        self.assertEqual(fe.transform(self.X), expected)
+        self.assertIsNone(fe._text_cache)
+
+    def test_cached_dicts_are_not_shared(self):
+        fe = HtmlFeatureExtractor(EXAMPLE_TOKEN_FEATURES)
+        X = fe.transform(self.X + self.X)
+        X[0][0]['foo'] = 'bar'
+        self.assertNotIn('foo', X[len(self.X)][0])
+        self.assertNotIn('foo', fe.transform(self.X)[0][0])
+
+    def test_text_cache_invalidation(self):
+        fe = HtmlFeatureExtractor(EXAMPLE_TOKEN_FEATURES)
+        fe.transform(self.X)
+        token_features = EXAMPLE_TOKEN_FEATURES[:8]
+        fe.set_params(token_features=token_features)
+        self.assertEqual(fe.transform(self.X), self.get_expected(token_features))
+
+    def test_pickle(self):
+        fe = HtmlFeatureExtractor(EXAMPLE_TOKEN_FEATURES)
+        expected = fe.transform(self.X)
+        fe2 = pickle.loads(pickle.dumps(fe))
+        self.assertIsNone(fe2._text_cache)
+        self.assertEqual(fe2.transform(self.X), expected)
+
+    def test_unpickle_old_version(self):
+        fe = HtmlFeatureExtractor(EXAMPLE_TOKEN_FEATURES)
+        expected = fe.transform(self.X)
+        state = fe.__getstate__()
+        for name in ['text_cache_size', 'sparse', 'hashing', 'n_jobs',
+                     '_text_cache', '_hasher', '_fused_global_features']:
+            del state[name]
+        fe2 = HtmlFeatureExtractor.__new__(HtmlFeatureExtractor)
+        fe2.__setstate__(state)
+        self.assertEqual(fe2.transform(self.X), expected)
+        self.assertEqual(fe2.get_params()['n_jobs'], 1)
+
+    def test_sparse(self):
+        def is_short(html_token):
+            return {'short': len(html_token.token) < 3, 'none': None}
+        token_features = EXAMPLE_TOKEN_FEATURES + [text_feature(is_short)]
+        dense = self.get_expected(token_features)
+        expected = [
+            [{k: v for k, v in fd.items() if v is not None and v is not False}
+             for fd in doc]
+            for doc in dense
+        ]
+        for text_cache_size in [0, 1000]:
+            fe = HtmlFeatureExtractor(token_features, sparse=True,
+                                      text_cache_size=text_cache_size)
+            self.assertEqual(fe.transform(self.X), expected)
+
+        # built-in features emit False values unless sparse is True
+        self.assertTrue(any(v is False for fd in dense[0] for v in fd.values()))
+
+    def test_sparse_false_removes_feature(self):
+        def first(html_token):
+            return {'flag': True}
+
+        def second(html_token):
+            return {'flag': False}
+
+        fe = HtmlFeatureExtractor([first, second], sparse=True)
+        self.assertEqual(fe.transform(self.X)[0][0], {})
+
+    def test_declared_order(self):
+        def text_flag(html_token):
+            return {'flag': len(html_token.token) > 3, 'text': True}
+
+        def block_flag(html_token):
+            return {'flag': len(html_token.tokens) > 5, 'text': False}
+
+        def token_flag(html_token):
+            return {'flag': html_token.index % 2 == 0}
+
+        text_feature(text_flag)
+        block_feature(block_flag)
+        orders = [
+            [text_flag, block_flag, token_flag],
+            [token_flag, block_flag, text_flag],
+            [block_flag, text_flag, token_flag, block_flag, text_flag],
+        ]
+        for funcs in orders:
+            for sparse in [False, True]:
+                expected = [apply_features(funcs, html_tokens, sparse=sparse)
+                            for html_tokens in self.X]
+                for text_cache_size in [0, 1000]:
+                    fe = HtmlFeatureExtractor(funcs, sparse=sparse,
+                                              text_cache_size=text_cache_size)
+                    self.assertEqual(fe.transform(self.X), expected)
+                    self.assertEqual(fe.transform(self.X), expected)
+
+    def test_min_df(self):
+        dense = self.get_expected()
+        df = Counter()
+        for doc in dense:
+            df.update(set(chain.from_iterable(fd.items() for fd in doc)))
+
+        fe = HtmlFeatureExtractor(EXAMPLE_TOKEN_FEATURES, min_df=3)
+        expected = [[{k: v for k, v in fd.items() if df[k, v] >= 3} for fd in doc]
+                    for doc in dense]
+        self.assertEqual(fe.fit_transform(self.X), expected)
+        self.assertEqual(list(fe.iter_fit_transform(self.X)), expected)
+
+        fe.set_params(min_df={'lower': 3, 'token': 1})
+        expected = [
+            [{k: v for k, v in fd.items() if k != 'lower' or df[k, v] >= 3}
+             for fd in doc]
+            for doc in dense
+        ]
+        self.assertEqual(fe.fit_transform(self.X), expected)
+        self.assertEqual(list(fe.iter_fit_transform(self.X)), expected)
+
+        fe.set_params(hashing=32)
+        self.assertRaises(ValueError, fe.fit_transform, self.X)
+
+    def test_block_features(self):
+        funcs = [f for f in EXAMPLE_TOKEN_FEATURES
+                 if get_feature_scope(f) == BLOCK_SCOPE]
+        self.assertEqual(len(funcs), 4)
+
+        calls = []
+        def block_size(html_token):
+            calls.append(html_token)
+            return {'block_size': len(html_token.tokens)}
+        block_feature(block_size)
+
+        fe = HtmlFeatureExtractor([block_size] + EXAMPLE_TOKEN_FEATURES)
+        expected = self.get_expected([block_size] + EXAMPLE_TOKEN_FEATURES)
+        del calls[:]
+        self.assertEqual(fe.transform(self.X), expected)
+        n_blocks = sum(len({(tok.elem, tok.is_tail) for tok in html_tokens})
+                       for html_tokens in self.X)
+        self.assertEqual(len(calls), n_blocks)
+
+        # blocks are found by elements, not by shared ``tokens`` lists
+        X = [[tok._replace(tokens=list(tok.tokens)) for tok in html_tokens]
+             for html_tokens in self.X]
+        del calls[:]
+        self.assertEqual(fe.transform(X), expected)
+        self.assertEqual(len(calls), n_blocks)
+
+    def test_block_features_detached(self):
+        fe = HtmlFeatureExtractor(EXAMPLE_TOKEN_FEATURES)
+        X = [detach_html_tokens(html_tokens) for html_tokens in self.X]
+        self.assertEqual(fe.transform(X), self.get_expected())
+
+        # tokens which don't share ``tokens`` lists are separate blocks,
+        # but features are the same
+        X = [[pickle.loads(pickle.dumps(tok)) for tok in html_tokens]
+             for html_tokens in X]
+        self.assertEqual(fe.transform(X), self.get_expected())
+
+    def test_batch_implementations(self):
+        import webstruct.features as features
+        from webstruct.features import (
+            token_features, data_features, block_features
+        )
+        funcs = [getattr(module, name)
+                 for module in [token_features, data_features, block_features]
+                 for name in module.__all__]
+        funcs += [
+            features.InsideTag('a'),
+            features.PrefixFeatures(lenghts=(1, 5)),
+            features.SuffixFeatures(lower=False),
+        ]
+        funcs = [f for f in funcs
+                 if not isinstance(f, type) and get_batch_func(f)]
+        self.assertTrue(len(funcs) >= 20)
+
+        for html_tokens in self.X:
+            detached = detach_html_tokens(html_tokens)
+            for func in funcs:
+                expected = [func(tok) for tok in html_tokens]
+                for tokens in [html_tokens, detached]:
+                    self.assertEqual(apply_features([func], tokens), expected)
+
+    def test_batch_implementation_used(self):
+        calls = []
+        def token_upper(html_token):
+            raise AssertionError("batch implementation should be used")
+
+        @batch_implementation(token_upper)
+        def token_upper_batch(html_tokens):
+            calls.append(len(html_tokens))
+            return [{'upper': tok.token.upper()} for tok in html_tokens]
+
+        fe = HtmlFeatureExtractor([token_upper], text_cache_size=0)
+        X = fe.transform(self.X)
+        self.assertEqual(calls, [len(html_tokens) for html_tokens in self.X])
+        self.assertEqual(X[0][0], {'upper': self.X[0][0].token.upper()})
+
+    def test_multi_gazetteer(self):
+        tokens = [tok.token for html_tokens in self.X for tok in html_tokens]
+        lexicons = [
+            ({" ".join(tokens[i:i+2]) for i in range(0, len(tokens), 7)}, 'G1'),
+            (set(tokens[::5]), 'G2'),
+            (set(tokens[::5]), 'G3'),
+        ]
+        gazetteers = [LongestMatchGlobalFeature(*args) for args in lexicons]
+        fe = HtmlFeatureExtractor(EXAMPLE_TOKEN_FEATURES, gazetteers)
+        expected = fe.transform(self.X)
+        self.assertTrue(any('B-G1' in featdict
+                            for doc in expected for featdict in doc))
+
+        for features in [gazetteers, lexicons]:
+            fe.set_params(global_features=[MultiGazetteerGlobalFeature(features)])
+            self.assertEqual(fe.transform(self.X), expected)
+
+        feature = pickle.loads(pickle.dumps(MultiGazetteerGlobalFeature(gazetteers)))
+        fe.set_params(global_features=[feature])
+        self.assertEqual(fe.transform(self.X), expected)
+
+    def test_n_jobs(self):
+        tokens = [tok.token for html_tokens in self.X for tok in html_tokens]
+        global_features = [
+            MultiGazetteerGlobalFeature([(set(tokens[::5]), 'G')]),
+            Pattern((-1, 'lower'), (+1, 'lower')),
+        ]
+        X = [detach_html_tokens(html_tokens) for html_tokens in self.X]
+        for params in [{}, {'min_df': 2}, {'min_df': {'lower': 2}},
+                       {'hashing': 32}, {'min_df': 2, 'hashing': 32}]:
+            fe = HtmlFeatureExtractor(EXAMPLE_TOKEN_FEATURES, global_features,
+                                      **params)
+            expected_transform = fe.transform(X)
+            expected_fit_transform = fe.fit_transform(X)
+            fe.set_params(n_jobs=2)
+            self.assertEqual(fe.transform(self.X), expected_transform)
+            self.assertEqual(fe.fit_transform(self.X), expected_fit_transform)
+
+    def test_normalized_gazetteers(self):
+        tokens = [tok.token for html_tokens in self.X for tok in html_tokens]
+        lexicon = {token.upper() for token in tokens[::5]}
+        normalizer = CountingNormalizer(casefold=True)
+        gazetteers = [
+            LongestMatchGlobalFeature(lexicon, 'G1', normalization=normalizer),
+            LongestMatchGlobalFeature(lexicon, 'G2', normalization={'casefold': True}),
+            LongestMatchGlobalFeature(lexicon, 'G3'),
+        ]
+        fe = HtmlFeatureExtractor([], gazetteers)
+        normalizer.calls = 0
+        X = fe.transform(self.X)
+        # tokens are normalized once for both normalized gazetteers
+        self.assertEqual(normalizer.calls, len(tokens))
+        for doc, html_tokens in zip(X, self.X):
+            for featdict, tok in zip(doc, html_tokens):
+                self.assertEqual('G1' in featdict, 'G2' in featdict)
+                if 'G3' in featdict:
+                    self.assertIn('G1', featdict)
+        self.assertTrue(any('G1' in featdict and 'G3' not in featdict
+                            for doc in X for featdict in doc))
+
+        fe.set_params(global_features=[MultiGazetteerGlobalFeature(gazetteers)])
+        self.assertEqual(fe.transform(self.X), X)
+
+    def test_multi_gazetteer_custom(self):
+        class LowercaseGlobalFeature(LongestMatchGlobalFeature):
+            def __call__(self, doc):
+                pass
+
+        gazetteers = [LowercaseGlobalFeature({'foo'}, 'FOO')]
+        self.assertRaises(ValueError, MultiGazetteerGlobalFeature, gazetteers)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import pickle
+import unittest
+
+import numpy as np
+import pytest
+
+from webstruct import HtmlTokenizer, HtmlFeatureExtractor
+from webstruct.features import EXAMPLE_TOKEN_FEATURES
+from webstruct.feature_hashing import (
+    FeatureHasher,
+    HashedFeatures,
+    prune_hashed,
+)
+from webstruct.wapiti import WapitiFeatureEncoder
+from .utils import get_trees
+
+
+class FeatureHashingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.X, self.y = HtmlTokenizer().tokenize(get_trees(5))
+
+    def test_hashing(self):
+        X_dicts = HtmlFeatureExtractor(EXAMPLE_TOKEN_FEATURES).transform(self.X)
+        for bits, dtype in [(32, np.uint32), (64, np.uint64)]:
+            fe = HtmlFeatureExtractor(EXAMPLE_TOKEN_FEATURES, hashing=bits)
+            X = fe.transform(self.X)
+            self.assertEqual(X, FeatureHasher(bits).transform(X_dicts))
+            for doc, html_tokens, feature_dicts in zip(X, self.X, X_dicts):
+                self.assertIsInstance(doc, HashedFeatures)
+                self.assertEqual(doc.indices.dtype, dtype)
+                self.assertEqual(len(doc), len(html_tokens))
+                # one feature id per non-zero feature
+                self.assertEqual(list(np.diff(doc.indptr)),
+                                 [_n_nonzero(fd) for fd in feature_dicts])
+
+            # token dicts for CRFsuite
+            token_dicts = list(X[0])
+            self.assertEqual(len(token_dicts), len(self.X[0]))
+            self.assertEqual(len(token_dicts[0]), _n_nonzero(X_dicts[0][0]))
+
+    def test_to_crfsuite(self):
+        pycrfsuite = pytest.importorskip("pycrfsuite")
+
+        def weighted(html_token):
+            return {'weight': 0.5} if len(html_token.token) > 3 else {}
+
+        fe = HtmlFeatureExtractor(EXAMPLE_TOKEN_FEATURES + [weighted], hashing=32)
+        for doc in fe.transform(self.X):
+            self.assertEqual(doc.to_crfsuite().items(),
+                             pycrfsuite.ItemSequence(list(doc)).items())
+
+    def test_min_df(self):
+        fe = HtmlFeatureExtractor(EXAMPLE_TOKEN_FEATURES, min_df=2)
+        X_dicts = fe.fit_transform(self.X)
+        fe.set_params(hashing=64)
+        X = fe.fit_transform(self.X)
+        self.assertEqual(X, FeatureHasher(64).transform(X_dicts))
+        self.assertEqual(list(fe.iter_fit_transform(self.X)), X)
+
+    def test_prune_hashed(self):
+        X = HtmlFeatureExtractor(EXAMPLE_TOKEN_FEATURES, hashing=32).transform(self.X)
+        ids = set(X[0].indices.tolist())
+        keep = set(list(ids)[::2]) | {2**32 + 1}
+        for doc, pruned in zip(X, prune_hashed(X, keep)):
+            self.assertEqual(len(pruned), len(doc))
+            for i in range(len(doc)):
+                token_ids = doc.indices[doc.indptr[i]:doc.indptr[i+1]]
+                pruned_ids = pruned.indices[pruned.indptr[i]:pruned.indptr[i+1]]
+                self.assertEqual(pruned_ids.tolist(),
+                                 [j for j in token_ids.tolist() if j in keep])
+        self.assertEqual(prune_hashed(X[:1], set())[0].indices.tolist(), [])
+
+    def test_pickle(self):
+        fe = HtmlFeatureExtractor(EXAMPLE_TOKEN_FEATURES, hashing=32)
+        X = fe.transform(self.X)
+        self.assertEqual(pickle.loads(pickle.dumps(X)), X)
+        fe2 = pickle.loads(pickle.dumps(fe))
+        self.assertEqual(fe2.transform(self.X), X)
+
+    def test_wapiti(self):
+        fe = HtmlFeatureExtractor(EXAMPLE_TOKEN_FEATURES, hashing=32)
+        X = fe.transform(self.X)
+        self.assertRaises(ValueError, WapitiFeatureEncoder().fit, X)
+
+
+def test_crfsuite():
+    pytest.importorskip("sklearn_crfsuite")
+    from pycrfsuite import ItemSequence
+    from sklearn_crfsuite import CRF
+    from webstruct.crfsuite import CRFsuitePipeline
+
+    X, y = HtmlTokenizer().tokenize(get_trees(10))
+    fe = HtmlFeatureExtractor(EXAMPLE_TOKEN_FEATURES, hashing=32)
+    model = CRFsuitePipeline(fe, CRF(max_iterations=30, c1=1, c2=0.01))
+    X_crfsuite = model.named_steps['crfsuite'].transform(fe.transform(X[:2]))
+    assert all(isinstance(xseq, ItemSequence) for xseq in X_crfsuite)
+    model.fit(X[:8], y[:8], X_dev=X[8:], y_dev=y[8:])
+    assert model.score(X[8:], y[8:]) > 0.3
+
+
+def _n_nonzero(featdict):
+    return sum(1 for value in featdict.values() if value is not False)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import pickle
+import unittest
+
+import pytest
+
+from webstruct import HtmlTokenizer, HtmlFeatureExtractor
+from webstruct.features import EXAMPLE_TOKEN_FEATURES
+from webstruct.feature_matrix import FeatureMatrix
+from webstruct.wapiti import WapitiFeatureEncoder
+from .utils import get_trees
+
+
+class FeatureMatrixTest(unittest.TestCase):
+
+    def setUp(self):
+        X, y = HtmlTokenizer().tokenize(get_trees(5))
+        fe = HtmlFeatureExtractor(EXAMPLE_TOKEN_FEATURES)
+        self.X_dicts = fe.transform(X)
+        self.X = FeatureMatrix.from_dicts(fe.iter_transform(X))
+
+    def test_views(self):
+        self.assertEqual(len(self.X), len(self.X_dicts))
+        self.assertEqual(self.X.n_tokens, sum(map(len, self.X_dicts)))
+        self.assertEqual([[dict(featdict) for featdict in doc] for doc in self.X],
+                         self.X_dicts)
+        doc, doc_dicts = self.X[-1], self.X_dicts[-1]
+        self.assertEqual(len(doc), len(doc_dicts))
+        self.assertEqual(doc[-1]['token'], doc_dicts[-1]['token'])
+        self.assertEqual(len(doc[0]), len(doc_dicts[0]))
+        self.assertNotIn('foo', doc[0])
+        self.assertRaises(IndexError, lambda: self.X[len(self.X)])
+
+    def test_interning(self):
+        self.assertEqual(len(self.X.pairs), len(set(self.X.pairs)))
+        self.assertEqual(len(self.X.pair_ids),
+                         sum(len(fd) for doc in self.X_dicts for fd in doc))
+
+    def test_pickle(self):
+        X = pickle.loads(pickle.dumps(self.X))
+        self.assertEqual([[dict(featdict) for featdict in doc] for doc in X],
+                         self.X_dicts)
+
+    def test_crfsuite(self):
+        pycrfsuite = pytest.importorskip("pycrfsuite")
+        sequences = self.X.to_crfsuite()
+        self.assertEqual(len(sequences), len(self.X_dicts))
+        for seq, feature_dicts in zip(sequences, self.X_dicts):
+            self.assertEqual(seq.items(),
+                             pycrfsuite.ItemSequence(feature_dicts).items())
+
+    def test_wapiti(self):
+        we = WapitiFeatureEncoder().fit(self.X)
+        self.assertEqual(we.feature_names_,
+                         WapitiFeatureEncoder().fit(self.X_dicts).feature_names_)
+        self.assertEqual(we.transform(self.X), we.transform(self.X_dicts))
+
+
+def test_value_types():
+    X_dicts = [[{'x': 1}, {'x': 1.0}, {'x': True}]]
+    X = FeatureMatrix.from_dicts(X_dicts)
+    assert len(X.pairs) == 3
+    values = [featdict['x'] for featdict in X[0]]
+    assert values == [1, 1.0, True]
+    assert [type(value) for value in values] == [int, float, bool]
+    we = WapitiFeatureEncoder().fit(X_dicts)
+    assert we.transform(X) == we.transform(X_dicts)
+
+
+def test_crf_training():
+    pytest.importorskip("sklearn_crfsuite")
+    from sklearn_crfsuite import CRF
+
+    X, y = HtmlTokenizer().tokenize(get_trees(10))
+    fe = HtmlFeatureExtractor(EXAMPLE_TOKEN_FEATURES)
+    crf = CRF(max_iterations=30, c1=1, c2=0.01)
+    crf.fit(FeatureMatrix.from_dicts(fe.iter_transform(X[:8])).to_crfsuite(), y[:8])
+    X_test = FeatureMatrix.from_dicts(fe.iter_transform(X[8:]))
+    assert crf.score(X_test.to_crfsuite(), y[8:]) > 0.3
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import io
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+import pytest
+
+from webstruct import HtmlTokenizer, HtmlFeatureExtractor
+from webstruct.features import (
+    LongestMatchGlobalFeature,
+    MultiGazetteerGlobalFeature,
+)
+from webstruct.loaders import HtmlLoader
+from webstruct.utils import TextNormalizer
+from webstruct.gazetteers.metadata import (
+    save_gazetteer,
+    read_gazetteer_metadata,
+    get_metadata_filename,
+)
+from .utils import get_trees
+
+
+class MarisaGazetteerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.marisa_trie = pytest.importorskip("marisa_trie")
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_dir, 'gazetteer.marisa')
+        self.X, _ = HtmlTokenizer().tokenize(get_trees(3))
+        tokens = [tok.token for html_tokens in self.X for tok in html_tokens]
+        self.keys = {" ".join(tokens[i:i+3]) for i in range(0, len(tokens), 11)}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def save_gazetteer(self, **build_config):
+        from webstruct.gazetteers.geonames import GAZETTEER_FORMAT
+        data = self.marisa_trie.RecordTrie(GAZETTEER_FORMAT, [
+            (key, (b'US', b'P', b'PPL', b'NY', b'061')) for key in self.keys
+        ])
+        return save_gazetteer(data, self.filename, **build_config)
+
+    def get_expected(self):
+        fe = HtmlFeatureExtractor([], [LongestMatchGlobalFeature(self.keys, 'G')])
+        return fe.transform(self.X)
+
+    def test_metadata(self):
+        meta = self.save_gazetteer(min_population=1000)
+        self.assertEqual(read_gazetteer_metadata(self.filename), meta)
+        self.assertEqual(meta['max_length'], 3)
+        self.assertEqual(meta['n_keys'], len(self.keys))
+        self.assertEqual(meta['build_config'], {'min_population': 1000})
+
+        # outdated metadata is ignored
+        with open(self.filename, 'ab') as f:
+            f.write(b'\0')
+        self.assertIsNone(read_gazetteer_metadata(self.filename))
+
+        # a changed file of the same size is detected by its hash
+        meta = self.save_gazetteer()
+        with open(self.filename, 'r+b') as f:
+            data = f.read()
+            f.seek(0)
+            f.write(data[::-1])
+        self.assertIsNone(read_gazetteer_metadata(self.filename))
+
+        os.unlink(get_metadata_filename(self.filename))
+        self.assertIsNone(read_gazetteer_metadata(self.filename))
+
+    def test_metadata_duplicate_keys(self):
+        from webstruct.gazetteers.geonames import GAZETTEER_FORMAT
+        data = self.marisa_trie.RecordTrie(GAZETTEER_FORMAT, [
+            (key, (b'US', b'P', b'PPL', admin1, b'061'))
+            for key in self.keys for admin1 in [b'NY', b'NJ']
+        ])
+        self.assertEqual(len(data), 2 * len(self.keys))
+        meta = save_gazetteer(data, self.filename)
+        self.assertEqual(meta['n_keys'], len(self.keys))
+
+    def test_lazy_loading(self):
+        from webstruct.gazetteers.features import MarisaGeonamesGlobalFeature
+        self.save_gazetteer()
+        feature = MarisaGeonamesGlobalFeature(self.filename, 'G')
+        self.assertEqual(feature.metadata['max_length'], 3)
+        self.assertIsNone(feature._data)
+
+        fe = HtmlFeatureExtractor([], [feature])
+        self.assertEqual(fe.transform(self.X), self.get_expected())
+        self.assertIsNotNone(feature._data)
+        self.assertEqual(feature.lm.max_length, 3)
+
+    def test_multi_gazetteer_lazy_loading(self):
+        from webstruct.gazetteers.features import MarisaGeonamesGlobalFeature
+        self.save_gazetteer()
+        gazetteer = MarisaGeonamesGlobalFeature(self.filename, 'G')
+        feature = MultiGazetteerGlobalFeature([gazetteer])
+        self.assertIsNone(gazetteer._data)
+
+        feature = pickle.loads(pickle.dumps(feature))
+        self.assertIsNone(feature.gazetteers[0]._data)
+
+        fe = HtmlFeatureExtractor([], [feature])
+        self.assertEqual(fe.transform(self.X), self.get_expected())
+        self.assertIsNotNone(feature.gazetteers[0]._data)
+
+        fe2 = pickle.loads(pickle.dumps(fe))
+        self.assertIsNone(fe2.global_features[0].gazetteers[0]._data)
+        self.assertEqual(fe2.transform(self.X), self.get_expected())
+
+    def test_rebuild_while_mmapped(self):
+        from webstruct.gazetteers.features import MarisaGeonamesGlobalFeature
+        from webstruct.gazetteers.bloom import write_bloom_filter
+        self.save_gazetteer()
+        write_bloom_filter(self.filename, self.keys)
+        feature = MarisaGeonamesGlobalFeature(self.filename, 'G', mmap=True)
+        fe = HtmlFeatureExtractor([], [feature])
+        expected = self.get_expected()
+        self.assertEqual(fe.transform(self.X), expected)
+
+        # files are replaced, not rewritten inplace
+        old_keys = self.keys
+        inode = os.stat(self.filename).st_ino
+        self.keys = set(list(old_keys)[::2])
+        meta = self.save_gazetteer()
+        write_bloom_filter(self.filename, self.keys)
+        self.assertNotEqual(os.stat(self.filename).st_ino, inode)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), [
+            'gazetteer.marisa', 'gazetteer.marisa.bloom',
+            'gazetteer.marisa.meta.json',
+        ])
+
+        # the old trie is still readable by the running feature
+        self.assertEqual(fe.transform(self.X), expected)
+
+        feature = MarisaGeonamesGlobalFeature(self.filename, 'G', mmap=True)
+        self.assertEqual(feature.metadata, meta)
+        fe = HtmlFeatureExtractor([], [feature])
+        self.assertEqual(fe.transform(self.X), self.get_expected())
+        self.assertNotEqual(self.get_expected(), expected)
+
+    def test_no_metadata(self):
+        from webstruct.gazetteers.features import MarisaGeonamesGlobalFeature
+        self.save_gazetteer()
+        os.unlink(get_metadata_filename(self.filename))
+        feature = MarisaGeonamesGlobalFeature(self.filename, 'G')
+        self.assertIsNone(feature.metadata)
+        fe = HtmlFeatureExtractor([], [feature])
+        self.assertEqual(fe.transform(self.X), self.get_expected())
+
+    def test_pickle(self):
+        from webstruct.gazetteers.features import MarisaGeonamesGlobalFeature
+        self.save_gazetteer()
+        expected = self.get_expected()
+        for mmap in [True, False]:
+            feature = MarisaGeonamesGlobalFeature(self.filename, 'G', mmap=mmap)
+            fe = HtmlFeatureExtractor([], [feature])
+            self.assertEqual(fe.transform(self.X), expected)
+
+            data = pickle.dumps(fe)
+            self.assertTrue(len(data) < 1000)
+            fe2 = pickle.loads(data)
+            self.assertIsNone(fe2.global_features[0]._data)
+            self.assertEqual(fe2.transform(self.X), expected)
+
+    def test_unpickle_old_version(self):
+        from webstruct.gazetteers.features import MarisaGeonamesGlobalFeature
+        from webstruct.utils import LongestMatch
+        self.save_gazetteer()
+        data = MarisaGeonamesGlobalFeature(self.filename, 'G').data
+
+        # state of features pickled before lazy loading and normalization
+        lm = LongestMatch.__new__(LongestMatch)
+        lm.__setstate__({'known': data, 'max_length': 3})
+        feature = MarisaGeonamesGlobalFeature.__new__(MarisaGeonamesGlobalFeature)
+        feature.__setstate__({'filename': self.filename, 'data': data, 'lm': lm,
+                              'b_featname': 'B-G', 'i_featname': 'I-G',
+                              'featname': 'G'})
+        fe = HtmlFeatureExtractor([], [feature])
+        self.assertEqual(fe.transform(self.X), self.get_expected())
+        fe2 = pickle.loads(pickle.dumps(fe))
+        self.assertEqual(fe2.transform(self.X), self.get_expected())
+
+        lm = LongestMatch.__new__(LongestMatch)
+        lm.__setstate__({'known': self.keys, 'max_length': 3})
+        feature = LongestMatchGlobalFeature.__new__(LongestMatchGlobalFeature)
+        feature.__setstate__({'lm': lm, 'b_featname': 'B-G',
+                              'i_featname': 'I-G', 'featname': 'G'})
+        fe = HtmlFeatureExtractor([], [feature])
+        self.assertEqual(fe.transform(self.X), self.get_expected())
+
+    def test_bloom_filter(self):
+        from webstruct.gazetteers.features import MarisaGeonamesGlobalFeature
+        from webstruct.gazetteers.bloom import write_bloom_filter, read_bloom_filter
+        self.save_gazetteer()
+        bf = write_bloom_filter(self.filename, self.keys)
+        for key in self.keys:
+            tokens = key.split(' ')
+            self.assertIn(tokens[0], bf)
+            self.assertIn(tokens[0] + ' ' + tokens[1], bf)
+
+        feature = MarisaGeonamesGlobalFeature(self.filename, 'G')
+        fe = HtmlFeatureExtractor([], [feature])
+        self.assertEqual(fe.transform(self.X), self.get_expected())
+        self.assertEqual(feature.lm.prefilter.bits, bf.bits)
+
+        # outdated filter is ignored
+        with open(self.filename, 'ab') as f:
+            f.write(b'\0')
+        self.assertIsNone(read_bloom_filter(self.filename))
+
+        # a changed file of the same size is detected by its hash
+        self.save_gazetteer()
+        write_bloom_filter(self.filename, self.keys)
+        with open(self.filename, 'r+b') as f:
+            data = f.read()
+            f.seek(0)
+            f.write(data[::-1])
+        self.assertIsNone(read_bloom_filter(self.filename))
+
+
+GEONAMES_SAMPLE = u"""\
+5128581\tNew York City\tNew York City\tNYC,New York,Nueva York\t40.71427\t-74.00597\tP\tPPLA2\tUS\t\tNY\t061\t\t\t8175133\t10\t57\tAmerica/New_York\t2016-06-08
+5128638\tNew York\tNew York\tNY,New York,Nueva York\t43.00035\t-75.4999\tA\tADM1\tUS\t\tNY\t\t\t\t19274244\t\t307\tAmerica/New_York\t2016-01-27
+2950159\tBerlin\tBerlin\tBerlin,Berlín,,Берлин\t52.52437\t13.41053\tP\tPPLC\tDE\t\t16\t00\t11000\t11000000\t3426354\t\t74\tEurope/Berlin\t2016-05-21
+1\tNowhere\t\t\t0\t0\tP\tPPL\tXX\t\t\t\t\t\t0\t\t0\tUTC\t2016-01-01
+"""
+
+
+def _read_sample():
+    from webstruct.gazetteers.geonames import read_geonames
+    return read_geonames(io.BytesIO(GEONAMES_SAMPLE.encode('utf8')))
+
+
+def test_to_marisa():
+    pytest.importorskip("marisa_trie")
+    from webstruct.gazetteers.geonames import to_marisa
+    trie = to_marisa(_read_sample())
+    assert set(trie.keys()) == {
+        u'New York City', u'NYC', u'New York', u'Nueva York', u'NY',
+        u'Berlin', u'Berlín', u'Берлин', u'Nowhere'
+    }
+    assert sorted(trie[u'New York']) == [
+        (b'US', b'A', b'ADM1\x00', b'NY', b'nan'),
+        (b'US', b'P', b'PPLA2', b'NY', b'061'),
+    ]
+    assert trie[u'Berlin'] == [(b'DE', b'P', b'PPLC\x00', b'16', b'00\x00')]
+
+
+def test_unique_names():
+    from webstruct.gazetteers.geonames import _unique_names
+    df = _read_sample()
+    assert _unique_names(df[df.feature_code == 'ADM1']) == {
+        u'New York', u'NY', u'Nueva York'
+    }
+
+
+def _write_sample_zip(tmp_dir):
+    path = os.path.join(tmp_dir, 'sample.zip')
+    with zipfile.ZipFile(path, 'w') as zf:
+        zf.writestr('sample.txt', GEONAMES_SAMPLE.encode('utf8'))
+    return path
+
+
+def test_iter_geonames_zipped(tmpdir):
+    from webstruct.gazetteers.geonames import iter_geonames_zipped
+    path = _write_sample_zip(str(tmpdir))
+    chunks = list(iter_geonames_zipped(path, chunksize=1))
+    assert [len(chunk) for chunk in chunks] == [1, 1, 1, 1]
+
+    chunks = list(iter_geonames_zipped(path, chunksize=3, feature_classes='P',
+                                       min_population=1000))
+    assert [list(chunk.geonameid) for chunk in chunks] == [[5128581, 2950159]]
+
+    chunks = iter_geonames_zipped(path, chunksize=2, countries=['US'],
+                                  feature_codes=['ADM1', 'ADM2'])
+    assert [list(chunk.geonameid) for chunk in chunks] == [[5128638]]
+
+
+def test_to_marisa_chunks(tmpdir):
+    pytest.importorskip("marisa_trie")
+    from webstruct.gazetteers.geonames import (
+        iter_geonames_zipped, read_geonames_zipped, filter_geonames, to_marisa
+    )
+    path = _write_sample_zip(str(tmpdir))
+    for filters in [{}, {'countries': ['US']}]:
+        df = filter_geonames(read_geonames_zipped(path), **filters)
+        expected = sorted(to_marisa(df).items())
+        chunks = iter_geonames_zipped(path, chunksize=1, **filters)
+        assert sorted(to_marisa(chunks).items()) == expected
+
+
+def test_build_gazetteers(tmpdir):
+    pytest.importorskip("marisa_trie")
+    from webstruct.gazetteers.build import GazetteerTarget, build_gazetteers
+    from webstruct.gazetteers.features import MarisaGeonamesGlobalFeature
+    data_dir = str(tmpdir)
+    _write_sample_zip(data_dir)
+
+    def get_targets(normalization=None):
+        return [
+            GazetteerTarget('all.marisa', 'sample.zip', format='marisa'),
+            GazetteerTarget('adm1.marisa', 'sample.zip', format='marisa',
+                            normalization=normalization,
+                            feature_codes=['ADM1']),
+        ]
+
+    for n_jobs in [1, 2]:
+        targets = get_targets()
+        built = build_gazetteers(targets, data_dir, n_jobs=n_jobs, force=True)
+        assert built == targets
+        assert set(os.listdir(data_dir)) == {
+            'sample.zip', 'all.marisa', 'all.marisa.meta.json',
+            'adm1.marisa', 'adm1.marisa.meta.json',
+        }
+        feature = MarisaGeonamesGlobalFeature(os.path.join(data_dir, 'adm1.marisa'), 'ADM1')
+        assert feature.metadata['max_length'] == 2
+        assert set(feature.data.keys()) == {u'New York', u'NY', u'Nueva York'}
+
+    # outputs are up to date
+    assert build_gazetteers(get_targets(), data_dir) == []
+
+    # options are changed
+    targets = get_targets(normalization={'casefold': True})
+    assert build_gazetteers(targets, data_dir) == targets[1:]
+    feature = MarisaGeonamesGlobalFeature(os.path.join(data_dir, 'adm1.marisa'), 'ADM1')
+    assert set(feature.data.keys()) == {u'new york', u'ny', u'nueva york'}
+    # normalization is read from metadata
+    assert feature.normalizer == TextNormalizer(casefold=True)
+    tree = HtmlLoader().loadbytes(b"<p>NEW York</p>")
+    html_tokens, tags = HtmlTokenizer().tokenize_single(tree)
+    fe = HtmlFeatureExtractor([], [feature])
+    assert [sorted(featdict) for featdict in fe.transform_single(html_tokens)] == [
+        ['ADM1', 'B-ADM1'], ['ADM1', 'I-ADM1']]
+
+    # source is changed
+    os.utime(os.path.join(data_dir, 'sample.zip'), (0, 0))
+    assert len(build_gazetteers(targets, data_dir)) == 2
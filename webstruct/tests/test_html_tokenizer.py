@@ -1,12 +1,23 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
+import gc
+import pickle
+import weakref
 from copy import deepcopy
+from lxml import etree
 from lxml.html import tostring
 
-from webstruct.html_tokenizer import HtmlTokenizer
+from webstruct import html_tokenizer
+from webstruct.html_tokenizer import (
+    HtmlTokenizer,
+    DetachedHtmlToken,
+    detach_html_tokens,
+)
+from webstruct.feature_extraction import HtmlFeatureExtractor
+from webstruct.features import EXAMPLE_TOKEN_FEATURES
 from webstruct.loaders import GateLoader, HtmlLoader
 from webstruct.utils import html_document_fromstring
-from .utils import HtmlTest
+from .utils import HtmlTest, get_trees
 
 
 GATE_HTML = b"""
@@ -56,6 +67,108 @@ class HtmlTokenizerTest(HtmlTest):
         # original tree is not changed
         self.assertHtmlTreeEqual(src_tree, orig_src_tree)
 
+    def test_tokenize_single_nocopy(self):
+        src_tree = self._load()
+        tokenizer = HtmlTokenizer(replace_html_tags={'b': 'strong'})
+        html_tokens, tags = tokenizer.tokenize_single(src_tree, copy=False)
+        self.assertIs(html_tokens[0].root.getroot(), src_tree)
+        self.assertIn(b'<strong>', tostring(src_tree))
+        self.assertNotIn(b'<b>', tostring(src_tree))
+
+        html_tokens2, tags2 = tokenizer.tokenize_single(self._load())
+        self.assertListEqual([t.token for t in html_tokens],
+                             [t.token for t in html_tokens2])
+        self.assertListEqual(tags, tags2)
+
+    def test_tokenize_unannotated(self):
+        tokenizer = HtmlTokenizer()
+        tree = HtmlLoader().loadbytes(UNANNOTATED_HTML)
+        self.assertFalse(tokenizer._is_annotated(tree))
+        self.assertTrue(tokenizer._is_annotated(self._load()))
+
+        html_tokens, tags = tokenizer.tokenize_single(tree)
+        self.assertListEqual(
+            [t.token for t in html_tokens],
+            [u'Scrapinghub', u'Inc', u'has', u'an', u'office', u'in', u'Montevideo'],
+        )
+        self.assertListEqual(tags, ['O'] * 7)
+        self.assertListEqual([(t.position, t.length) for t in html_tokens[:3]],
+                             [(0, 11), (0, 3), (4, 3)])
+
+    def test_tokenize_deeply_nested(self):
+        root = elem = etree.Element('html')
+        for i in range(5000):
+            elem = etree.SubElement(elem, 'div')
+            elem.text = 'head%d' % i
+            elem.tail = 'tail%d' % i
+
+        html_tokens, tags = HtmlTokenizer().tokenize_single(root)
+        tokens = [t.token for t in html_tokens]
+        self.assertEqual(len(tokens), 10000)
+        self.assertListEqual(tokens[:2], ['head0', 'head1'])
+        self.assertListEqual(tokens[-2:], ['tail1', 'tail0'])
+
+    def test_tokenize_parallel(self):
+        trees = get_trees(6) + [self._load()]
+        tokenizer = HtmlTokenizer(replace_html_tags={'b': 'strong'})
+        X, y = tokenizer.tokenize(trees)
+        X_detached = [detach_html_tokens(html_tokens) for html_tokens in X]
+        fe = HtmlFeatureExtractor(EXAMPLE_TOKEN_FEATURES)
+        uses_fork = html_tokenizer.uses_fork
+        # trees are shared with workers or serialized
+        for shared in [uses_fork(), False]:
+            html_tokenizer.uses_fork = lambda: shared
+            try:
+                X_par, y_par = tokenizer.tokenize(iter(trees), n_jobs=2)
+                X_par_detached, y_par_detached = tokenizer.tokenize(
+                    iter(trees), n_jobs=2, detach=True)
+            finally:
+                html_tokenizer.uses_fork = uses_fork
+
+            self.assertListEqual(y, y_par)
+            self.assertEqual(len(X), len(X_par))
+            for html_tokens, html_tokens_par in zip(X, X_par):
+                self.assertListEqual(
+                    [(t.token, t.index, t.is_tail, t.position, t.length, t.elem.tag)
+                     for t in html_tokens],
+                    [(t.token, t.index, t.is_tail, t.position, t.length, t.elem.tag)
+                     for t in html_tokens_par],
+                )
+
+            self.assertListEqual(y, y_par_detached)
+            self.assertIsInstance(X_par_detached[0][0], DetachedHtmlToken)
+            for html_tokens, html_tokens_par in zip(X_detached, X_par_detached):
+                self.assertListEqual(
+                    [(t.token, t.index, t.is_tail, t.position, t.length,
+                      t.parent_tag, t.ancestor_tags) for t in html_tokens],
+                    [(t.token, t.index, t.is_tail, t.position, t.length,
+                      t.parent_tag, t.ancestor_tags) for t in html_tokens_par],
+                )
+            self.assertEqual(fe.transform(X_par_detached), fe.transform(X))
+
+    def test_tokenize_detached(self):
+        trees = get_trees(3)
+        tokenizer = HtmlTokenizer()
+        X, y = tokenizer.tokenize(trees)
+        X_detached, y_detached = tokenizer.tokenize(trees, detach=True)
+        self.assertListEqual(y, y_detached)
+        self.assertIsInstance(X_detached[0][0], DetachedHtmlToken)
+
+        fe = HtmlFeatureExtractor(EXAMPLE_TOKEN_FEATURES)
+        self.assertEqual(fe.transform(X), fe.transform(X_detached))
+
+        X_unpickled = pickle.loads(pickle.dumps(X_detached))
+        self.assertEqual(fe.transform(X), fe.transform(X_unpickled))
+
+    def test_detached_tokens_release_tree(self):
+        tree = self._load()
+        tree_ref = weakref.ref(tree)
+        X, y = HtmlTokenizer().tokenize([tree], copy=False, detach=True)
+        del tree
+        gc.collect()
+        self.assertIsNone(tree_ref())
+        self.assertEqual(X[0][0].token, 'Scrapinghub')
+
     def assertTokenizationWorks(self, tree):
         html_tokens, tags = HtmlTokenizer().tokenize_single(tree)
 
@@ -2,7 +2,9 @@
 from __future__ import absolute_import
 import unittest
 from webstruct import GateLoader, HtmlTokenizer, HtmlFeatureExtractor
-from webstruct.features import token_lower, token_identity, looks_like_year, Pattern
+from webstruct.features import (
+    token_lower, token_identity, looks_like_year, Pattern, PatternSet
+)
 
 
 class PatternTest(unittest.TestCase):
@@ -45,3 +47,48 @@ class PatternTest(unittest.TestCase):
             [feat['lower/token[+1]'] for feat in X],
             ['hello/John', 'john/Doe', 'doe/Mary', 'mary/said', 'said/OUT']
         )
+
+    def test_pattern_set(self):
+        patterns = [
+            Pattern((-1, 'lower')),
+            Pattern((-2, 'lower'), (-1, 'lower')),
+            Pattern((+1, 'token'), out_value='OUT', separator='|'),
+            Pattern((-1, 'looks_like_year'), (0, 'missing'), (+2, 'lower')),
+        ]
+        token_features = [token_lower, token_identity, looks_like_year]
+        featextractor = HtmlFeatureExtractor(token_features)
+        X = featextractor.transform_single(self.html_tokens)
+        expected = [dict(feat) for feat in X]
+        doc = list(zip(self.html_tokens, expected))
+        for pattern in patterns:
+            pattern(doc)
+
+        doc = list(zip(self.html_tokens, X))
+        PatternSet(*patterns)(doc)
+        self.assertListEqual(X, expected)
+        self.assertEqual(X[0]['looks_like_year[-1]/missing/lower[+2]'],
+                         '?/_NA_/doe')
+        self.assertNotIn('lower[-1]', X[0])
+
+    def test_fused_patterns(self):
+        token_features = [token_lower, token_identity]
+        global_features = [
+            Pattern((-1, 'lower')),
+            Pattern((+1, 'lower')),
+            Pattern((0, 'lower[-1]'), (0, 'lower[+1]')),
+        ]
+        featextractor = HtmlFeatureExtractor(token_features, global_features)
+        X = featextractor.transform_single(self.html_tokens)
+        self.assertListEqual(
+            [feat.get('lower[-1]/lower[+1]') for feat in X],
+            ['_NA_/john', 'hello/doe', 'john/mary', 'doe/said', 'mary/_NA_'],
+        )
+
+        # patterns are fused once, until global features are changed
+        fused = featextractor._get_global_features()
+        featextractor.transform_single(self.html_tokens)
+        self.assertIs(featextractor._get_global_features(), fused)
+        featextractor.set_params(global_features=global_features[:2])
+        self.assertEqual(len(featextractor._get_global_features()), 1)
+        self.assertNotIn('lower[-1]/lower[+1]',
+                         featextractor.transform_single(self.html_tokens)[1])
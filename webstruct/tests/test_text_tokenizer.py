@@ -1,7 +1,14 @@
+import os
+import glob
 import unittest
 import pytest
 
 from webstruct.text_tokenizers import TextToken, WordTokenizer
+from webstruct.utils import html_document_fromstring
+
+CORPUS_PATH = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..', '..', 'webstruct_data', 'corpus')
+)
 
 class TestTokenizerTest(unittest.TestCase):
     def do_tokenize(self, text, result):
@@ -46,3 +53,55 @@ class TestTokenizerTest(unittest.TestCase):
                  TextToken(chars='/', position=6, length=1),
                  TextToken(chars='1800', position=8, length=4)]
                 )
+
+
+def _segment_words_nonquote_reference(tokenizer, text):
+    # character-by-character implementation which was used before
+    # rules were combined into a single regex
+    i = 0
+    token_start = 0
+    while 1:
+        if i >= len(text):
+            yield TextToken(chars=text[token_start:],
+                            position=token_start,
+                            length=len(text) - token_start)
+            break
+        shift = 1
+        partial_text = text[i:]
+        for regex, token in tokenizer.rules:
+            match = regex.match(partial_text)
+            if match:
+                yield TextToken(chars=text[token_start:i],
+                                position=token_start,
+                                length=i - token_start)
+                shift = match.end() - match.start()
+                token_start = i + shift
+                yield TextToken(chars=match.group() if token is None else token,
+                                position=i + match.start(),
+                                length=shift)
+                break
+        i += shift
+
+
+class ReferenceWordTokenizer(WordTokenizer):
+    def _segment_words_nonquote(self, text):
+        return _segment_words_nonquote_reference(self, text)
+
+
+def _corpus_texts():
+    pattern = os.path.join(CORPUS_PATH, '*', '*', '*.html')
+    texts = set()
+    for path in glob.glob(pattern):
+        with open(path, 'rb') as f:
+            tree = html_document_fromstring(f.read())
+        texts.update(tree.itertext())
+    return texts
+
+
+def test_segment_words_matches_reference_on_corpus():
+    tokenizer = WordTokenizer()
+    reference = ReferenceWordTokenizer()
+    texts = _corpus_texts()
+    assert texts
+    for text in texts:
+        assert tokenizer.segment_words(text) == reference.segment_words(text)
@@ -1,8 +1,153 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
-from webstruct.utils import human_sorted
+import os
+import random
+
+import pytest
+
+from webstruct import HtmlTokenizer
+from webstruct.utils import (
+    human_sorted,
+    LongestMatch,
+    MultiLongestMatch,
+    TextNormalizer,
+    replacing_file,
+)
+from .utils import get_trees
 
 
 def test_human_sorted():
     assert human_sorted(['5', '10', '7', '100']) == ['5', '7', '10', '100']
     assert human_sorted(['foo1', 'foo10', 'foo2']) == ['foo1', 'foo2', 'foo10']
+
+
+class ReferenceLongestMatch(LongestMatch):
+    """ LongestMatch which tries all lengths at each position """
+    def _find_matches(self, tokens):
+        res = []
+        for i in range(len(tokens)):
+            max_length = min(self.max_length, len(tokens) - i)
+            for length in range(max_length, 0, -1):
+                lookup = " ".join(tokens[i:i+length])
+                if lookup in self.known:
+                    res.append((i, length+i, lookup))
+                    break
+        return res
+
+
+def _get_lexicon_and_documents():
+    html_tokens_lists, _ = HtmlTokenizer().tokenize(get_trees(10))
+    documents = [[tok.token for tok in html_tokens]
+                 for html_tokens in html_tokens_lists]
+    rng = random.Random(0)
+    lexicon = set()
+    for tokens in documents:
+        for _ in range(20):
+            length = rng.randint(1, 5)
+            start = rng.randint(0, max(len(tokens) - length, 0))
+            lexicon.add(" ".join(tokens[start:start+length]))
+    return lexicon, documents
+
+
+def _check_longest_match(known, lexicon, documents):
+    lm = LongestMatch(known)
+    reference = ReferenceLongestMatch(lexicon)
+    assert lm.max_length == reference.max_length
+    n_matches = 0
+    for tokens in documents:
+        ranges = lm.find_ranges(tokens)
+        assert ranges == reference.find_ranges(tokens)
+        n_matches += len(ranges)
+    assert n_matches > 0
+
+
+def test_longest_match_set():
+    lexicon, documents = _get_lexicon_and_documents()
+    _check_longest_match(lexicon, lexicon, documents)
+    _check_longest_match(dict.fromkeys(lexicon, 1), lexicon, documents)
+
+
+def test_longest_match_marisa():
+    marisa_trie = pytest.importorskip("marisa_trie")
+    lexicon, documents = _get_lexicon_and_documents()
+    _check_longest_match(marisa_trie.Trie(lexicon), lexicon, documents)
+    records = marisa_trie.RecordTrie("1s", [(k, (b'x',)) for k in lexicon])
+    _check_longest_match(records, lexicon, documents)
+
+
+def test_longest_match_prefilter():
+    marisa_trie = pytest.importorskip("marisa_trie")
+    from webstruct.gazetteers.bloom import BloomFilter, prefix_filter_items
+    lexicon, documents = _get_lexicon_and_documents()
+    items = set(prefix_filter_items(lexicon))
+    reference = ReferenceLongestMatch(lexicon)
+    for prefilter in [items,
+                      BloomFilter.from_items(items),
+                      BloomFilter.from_items(items, error_rate=0.5)]:
+        lm = LongestMatch(marisa_trie.Trie(lexicon), prefilter=prefilter)
+        for tokens in documents:
+            assert lm.find_ranges(tokens) == reference.find_ranges(tokens)
+
+
+def test_longest_match_dawg():
+    dawg = pytest.importorskip("dawg")
+    lexicon, documents = _get_lexicon_and_documents()
+    _check_longest_match(dawg.CompletionDAWG(lexicon), lexicon, documents)
+
+
+def test_multi_longest_match():
+    marisa_trie = pytest.importorskip("marisa_trie")
+    lexicon, documents = _get_lexicon_and_documents()
+    keys = sorted(lexicon)
+    lexicons = [set(keys[::2]), set(keys[::3]), marisa_trie.Trie(keys[1::2]),
+                set(), {keys[0]: 1}]
+    mlm = MultiLongestMatch(lexicons)
+    lms = [LongestMatch(known) if known else None for known in lexicons]
+    for tokens in documents:
+        ranges = mlm.find_ranges(tokens)
+        assert len(ranges) == len(lexicons)
+        for lm, lm_ranges in zip(lms, ranges):
+            expected = lm.find_ranges(tokens) if lm else []
+            assert lm_ranges == expected
+
+
+def test_text_normalizer():
+    normalize = TextNormalizer(casefold=True, strip_diacritics=True,
+                               collapse_punctuation=True)
+    assert normalize(u'Straße') == u'strasse'
+    assert normalize(u'Ångström') == u'angstrom'
+    assert normalize(u'St.-Pierre') == u'stpierre'
+    assert normalize(u'...') == u'...'
+    assert normalize.normalize_key(u'Bogotá, D.C.') == u'bogota dc'
+    assert TextNormalizer(strip_diacritics=True)(u'Ångström') == u'Angstrom'
+
+    assert TextNormalizer.from_spec(normalize.spec) == normalize
+    assert TextNormalizer.from_spec({'casefold': False}) is None
+    assert TextNormalizer.from_spec(None) is None
+    assert normalize != TextNormalizer(casefold=True)
+
+
+def test_replacing_file(tmpdir):
+    filename = str(tmpdir.join('data.bin'))
+    with open(filename, 'wb') as f:
+        f.write(b'old')
+    reader = open(filename, 'rb')
+
+    with replacing_file(filename) as tmp_filename:
+        with open(tmp_filename, 'wb') as f:
+            f.write(b'new')
+        with open(filename, 'rb') as f:
+            assert f.read() == b'old'
+    with open(filename, 'rb') as f:
+        assert f.read() == b'new'
+    assert reader.read() == b'old'
+    reader.close()
+
+    with pytest.raises(ValueError):
+        with replacing_file(filename) as tmp_filename:
+            with open(tmp_filename, 'wb') as f:
+                f.write(b'broken')
+            raise ValueError()
+    with open(filename, 'rb') as f:
+        assert f.read() == b'new'
+    assert os.listdir(str(tmpdir)) == ['data.bin']
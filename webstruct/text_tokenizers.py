@@ -142,6 +142,8 @@ class WordTokenizer(object):
 
     open_quotes = re.compile(r'(^|[\s(\[{<])"')
 
+    _rules_re_cache = {}
+
     def _segment_words(self, text):
         # this one cannot be placed in the loop of internal function because it requires
         # position check (beginning of the string) or previous char value
@@ -160,36 +162,34 @@ class WordTokenizer(object):
                             position=token.position + start,
                             length=token.length)
 
-
     def _segment_words_nonquote(self, text):
-        i = 0
+        rules_re, rule_tokens = self._get_rules_re()
         token_start = 0
-        while 1:
-            if i >= len(text):
-                yield TextToken(chars=text[token_start:],
-                                position=token_start,
-                                length=len(text) - token_start)
-                break
-            shift = 1
-            partial_text = text[i:]
-            for regex, token in self.rules:
-                match = regex.match(partial_text)
-                if match:
-                    yield TextToken(chars=text[token_start:i],
-                                    position=token_start,
-                                    length=i - token_start)
-                    shift = match.end() - match.start()
-                    token_start = i + shift
-                    if token is None:
-                        yield TextToken(chars=match.group(),
-                                        position=i + match.start(),
-                                        length=shift)
-                    else:
-                        yield TextToken(chars=token,
-                                        position=i + match.start(),
-                                        length=shift)
-                    break
-            i += shift
+        for match in rules_re.finditer(text):
+            start, end = match.span()
+            yield TextToken(chars=text[token_start:start],
+                            position=token_start,
+                            length=start - token_start)
+            token = rule_tokens[match.lastindex]
+            yield TextToken(chars=match.group() if token is None else token,
+                            position=start,
+                            length=end - start)
+            token_start = end
+
+        yield TextToken(chars=text[token_start:],
+                        position=token_start,
+                        length=len(text) - token_start)
+
+    def _get_rules_re(self):
+        # All rules are combined into a single regex, so that text is
+        # scanned once instead of trying each rule at each position.
+        # The result is cached per ``rules`` list to support subclasses
+        # which override it.
+        cached = self._rules_re_cache.get(id(self.rules))
+        if cached is None or cached[0] is not self.rules:
+            cached = (self.rules,) + _combine_rules(self.rules)
+            self._rules_re_cache[id(self.rules)] = cached
+        return cached[1:]
 
     def segment_words(self, text):
         return [t for t in self._segment_words(text) if t.chars]
@@ -198,6 +198,28 @@ class WordTokenizer(object):
         return [t.chars for t in self.segment_words(text)]
 
 
+def _combine_rules(rules):
+    """
+    Combine ``(regex, token)`` rules into a single regex with a capturing
+    group per rule. Alternatives are tried in order at each position,
+    so the first matching rule wins, as if rules were tried one by one.
+    Return the regex and a ``{group_index: token}`` mapping.
+
+    >>> rules_re, tokens = _combine_rules([(re.compile('a+'), None),
+    ...                                    (re.compile('(b)c'), 'X')])
+    >>> [(m.group(), tokens[m.lastindex]) for m in rules_re.finditer('aa bc')]
+    [('aa', None), ('bc', 'X')]
+    """
+    patterns = []
+    tokens = {}
+    group_index = 1
+    for regex, token in rules:
+        patterns.append('(%s)' % regex.pattern)
+        tokens[group_index] = token
+        group_index += regex.groups + 1
+    return re.compile('|'.join(patterns), re.UNICODE), tokens
+
+
 class DefaultTokenizer(WordTokenizer):
     def segment_words(self, text):
         tokens = super(DefaultTokenizer, self).segment_words(text)
@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, print_function
+import os
 import re
 import subprocess
+import unicodedata
+import tempfile
+import contextlib
+import multiprocessing
 from functools import partial
 from itertools import chain
+from collections import OrderedDict
 from six.moves import range
 
 import tldextract
@@ -22,6 +28,51 @@ def merge_dicts(*dicts):
     return res
 
 
+class LRUCache(object):
+    """
+    A dict-like cache which keeps at most ``maxsize`` most recently used
+    items::
+
+        >>> cache = LRUCache(2)
+        >>> cache['foo'] = 1
+        >>> cache['bar'] = 2
+        >>> cache.get('foo')
+        1
+        >>> cache['baz'] = 3
+        >>> cache.get('bar') is None
+        True
+        >>> sorted(cache.keys())
+        ['baz', 'foo']
+
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            return default
+        self._data[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+    def keys(self):
+        return self._data.keys()
+
+    def clear(self):
+        self._data.clear()
+
+
 def get_combined_keys(dicts):
     """
     >>> sorted(get_combined_keys([{'foo': 'egg'}, {'bar': 'spam'}]))
@@ -117,6 +168,70 @@ def kill_html_tags(doc, tagnames, keep_child=True):
                 elem.drop_tree()
 
 
+def effective_n_jobs(n_jobs):
+    """
+    Return a number of worker processes to use for ``n_jobs`` argument:
+    None means 1, negative values mean "number of CPUs + 1 + n_jobs",
+    so -1 means "use all CPUs".
+
+    >>> effective_n_jobs(None)
+    1
+    >>> effective_n_jobs(4)
+    4
+    >>> effective_n_jobs(-1) == multiprocessing.cpu_count()
+    True
+    """
+    if n_jobs is None:
+        return 1
+    if n_jobs == 0:
+        raise ValueError("n_jobs == 0 has no meaning")
+    if n_jobs < 0:
+        return max(multiprocessing.cpu_count() + 1 + n_jobs, 1)
+    return n_jobs
+
+
+def uses_fork():
+    """
+    Return True if new :mod:`multiprocessing` processes are started
+    using "fork", i.e. if worker processes share data of the current
+    process without pickling it.
+    """
+    get_start_method = getattr(multiprocessing, 'get_start_method', None)
+    if get_start_method is None:  # Python 2
+        return os.name == 'posix'
+    return get_start_method() == 'fork'
+
+
+@contextlib.contextmanager
+def replacing_file(filename):
+    """
+    Context manager for writing a file which may be in use: it yields
+    a name of a temporary file in the same directory, and moves the
+    temporary file to ``filename`` when the block is finished (the file
+    is removed if an exception is raised). On POSIX systems the old
+    file is replaced atomically, so processes which have the old file
+    open or memory-mapped keep reading its original contents.
+    """
+    dirname, basename = os.path.split(os.path.abspath(filename))
+    fd, tmp_filename = tempfile.mkstemp(prefix=basename + '.', suffix='.tmp',
+                                        dir=dirname)
+    os.close(fd)
+    try:
+        yield tmp_filename
+        # mkstemp creates files readable only by the owner
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_filename, 0o666 & ~umask)
+        _replace(tmp_filename, filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.unlink(tmp_filename)
+        raise
+
+
+_replace = getattr(os, 'replace', os.rename)  # os.replace is Python 3.3+
+
+
 def html_document_fromstring(data, encoding=None):
     """ Load HTML document from string using lxml.html.HTMLParser """
     parser = lxml.html.HTMLParser(encoding=encoding)
@@ -156,15 +271,52 @@ class BestMatch(object):
     """
     Class for finding best non-overlapping matches in a sequence of tokens.
     Override :meth:`get_sorted_ranges` method to define which results are best.
+
+    ``known`` is a collection of space-separated token sequences. If it
+    provides a ``prefixes`` method (``dawg`` and ``marisa_trie`` tries do)
+    it is queried once for each token position; other collections (sets,
+    dicts, ...) are converted to a token-level trie, so later changes
+    of ``known`` are not taken into account. In both cases lookups stop
+    at the first token which can't continue any known sequence.
+    Tokens shouldn't contain spaces.
+
+    Finding ``max_length`` (maximum number of tokens in a known sequence)
+    requires iterating over all keys of ``known``; pass it explicitly
+    if it is known in advance.
+
+    ``prefilter`` is an optional container (e.g.
+    a :class:`~webstruct.gazetteers.bloom.BloomFilter`) with first tokens
+    and first token bigrams of all known sequences; it is used to skip
+    ``prefixes`` queries for positions which can't start any sequence.
+    It may have false positives, but not false negatives.
     """
-    def __init__(self, known):
+    def __init__(self, known, max_length=None, prefilter=None):
 
         self.known = known
+        self.prefilter = prefilter
         if hasattr(known, 'iterkeys'):
             keys_iter = known.iterkeys()
         else:
             keys_iter = known
-        self.max_length = max(len(key.split()) for key in keys_iter)
+
+        if hasattr(known, 'prefixes'):
+            self._token_trie = None
+            if max_length is None:
+                max_length = max(len(key.split()) for key in keys_iter)
+            self.max_length = max_length
+        else:
+            self._token_trie, self.max_length = _build_token_trie(keys_iter)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if '_token_trie' not in state:
+            # pickled by an older version: no token trie and prefilter
+            self.prefilter = None
+            if hasattr(self.known, 'prefixes'):
+                self._token_trie = None
+            else:
+                self._token_trie, self.max_length = _build_token_trie(
+                    self.known)
 
     def find_ranges(self, tokens):
         ranges = self._find_matches(tokens)
@@ -175,29 +327,132 @@ class BestMatch(object):
         raise NotImplementedError()
 
     def _find_matches(self, tokens):
-        # find all matching ranges
+        # find the longest matching range for each start position
+        if self._token_trie is not None:
+            return self._find_matches_token_trie(tokens)
+        return self._find_matches_prefixes(tokens)
+
+    def _find_matches_token_trie(self, tokens):
         res = []
-        i = 0
-        while i < len(tokens):
-            max_length = min(self.max_length, max(len(tokens)-i, 0))
-            for length in range(max_length, 0, -1):
-                lookup = " ".join(tokens[i:i+length])
-                if lookup in self.known:
-                    res.append((i, length+i, lookup))
+        trie = self._token_trie
+        for i in range(len(tokens)):
+            node = trie
+            match = None
+            for j in range(i, len(tokens)):
+                node = node.get(tokens[j])
+                if node is None:
                     break
-            i += 1
+                if _TRIE_KEY in node:
+                    match = (i, j+1, node[_TRIE_KEY])
+            if match is not None:
+                res.append(match)
         return res
 
+    def _find_matches_prefixes(self, tokens):
+        return _find_prefix_matches(self.known, self.max_length,
+                                    _JoinedTokens(tokens), self.prefilter)
+
     def _remove_overlapping(self, ranges, tokens):
         # remove overlapping sequences, keeping the best
-        res = []
-        filled_indices = set()
-        for begin, end, lookup in self.get_sorted_ranges(ranges, tokens):
-            indices = set(range(begin, end))
-            if not indices & filled_indices:
-                res.append((begin, end, lookup))
-                filled_indices |= indices
-        return res
+        return _remove_overlapping(self.get_sorted_ranges(ranges, tokens))
+
+
+class _JoinedTokens(object):
+    """
+    Tokens joined with spaces: ``offsets[i]`` is a start of i-th token
+    in ``text`` (+1 for the last one), ``token_ends`` maps end offsets
+    of tokens to token indices.
+    """
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.text = " ".join(tokens)
+        offsets = [0]
+        for token in tokens:
+            offsets.append(offsets[-1] + len(token) + 1)
+        self.offsets = offsets
+        self.token_ends = {offset - 1: idx for idx, offset in enumerate(offsets)}
+
+
+def _find_prefix_matches(known, max_length, joined, prefilter=None):
+    """
+    Find the longest match for each token position using
+    ``known.prefixes`` method. Positions which are rejected by
+    ``prefilter`` are skipped; if a bigram starting at a position
+    is rejected, only single-token matches are looked up.
+    """
+    res = []
+    text, offsets, token_ends = joined.text, joined.offsets, joined.token_ends
+    tokens = joined.tokens
+    n_tokens = len(tokens)
+    prefixes = known.prefixes
+    for i in range(n_tokens):
+        length = min(n_tokens - i, max_length)
+        if prefilter is not None:
+            if tokens[i] not in prefilter:
+                continue
+            if length > 1 and tokens[i] + ' ' + tokens[i+1] not in prefilter:
+                length = 1
+        start = offsets[i]
+        stop = offsets[i + length] - 1
+        best = None
+        for key in prefixes(text[start:stop]):
+            if (start + len(key)) in token_ends:
+                if best is None or len(key) > len(best):
+                    best = key
+        if best is not None:
+            res.append((i, token_ends[start + len(best)], best))
+    return res
+
+
+def _remove_overlapping(sorted_ranges):
+    res = []
+    filled_indices = set()
+    for begin, end, lookup in sorted_ranges:
+        indices = set(range(begin, end))
+        if not indices & filled_indices:
+            res.append((begin, end, lookup))
+            filled_indices |= indices
+    return res
+
+
+_TRIE_KEY = None  # token trie nodes store matched text under this key
+
+
+def _build_token_trie(keys):
+    """
+    Build a trie of nested dicts from space-separated token sequences;
+    return ``(trie, max_length)`` tuple::
+
+        >>> trie, max_length = _build_token_trie(['New York', 'New'])
+        >>> trie['New'][None], trie['New']['York'][None], max_length
+        ('New', 'New York', 2)
+    """
+    trie = {}
+    max_length = 0
+    for key in keys:
+        max_length = max(max_length, len(key.split()))
+        node = trie
+        for token in key.split(' '):
+            node = node.setdefault(token, {})
+        node[_TRIE_KEY] = key
+    return trie, max_length
+
+
+def _build_token_trie_multi(lexicons):
+    """
+    Build a trie of nested dicts from ``(index, keys)`` pairs; nodes
+    store bitmasks of indices of lexicons with sequences ending there.
+    """
+    trie = {}
+    for idx, keys in lexicons:
+        if hasattr(keys, 'iterkeys'):
+            keys = keys.iterkeys()
+        for key in keys:
+            node = trie
+            for token in key.split(' '):
+                node = node.setdefault(token, {})
+            node[_TRIE_KEY] = node.get(_TRIE_KEY, 0) | (1 << idx)
+    return trie
 
 
 class LongestMatch(BestMatch):
@@ -230,6 +485,192 @@ class LongestMatch(BestMatch):
         return sorted(ranges, key=lambda k: k[1]-k[0], reverse=True)
 
 
+class MultiLongestMatch(object):
+    """
+    Class for finding longest non-overlapping matches in a sequence
+    of tokens for several lexicons at once. :meth:`find_ranges`
+    returns a list of ranges for each lexicon; they are the same as
+    results of :class:`LongestMatch` for this lexicon::
+
+        >>> mlm = MultiLongestMatch([{'New York', 'York'}, {'New', 'York city'}])
+        >>> ranges = mlm.find_ranges(["New", "York", "city"])
+        >>> ranges[0]
+        [(0, 2, 'New York')]
+        >>> ranges[1]
+        [(0, 1, 'New'), (1, 3, 'York city')]
+
+    Lexicons without a ``prefixes`` method (sets, dicts, ...) are merged
+    into a single token-level trie where each node stores a bitmask
+    of lexicons which have a sequence ending at this node, so all of them
+    are matched in a single walk. Tries with a ``prefixes`` method
+    (``dawg``, ``marisa_trie``) are queried separately, but document text
+    is prepared only once for all of them.
+
+    Lexicons can also be :class:`LongestMatch` instances; in this case
+    their ``known``, ``max_length`` and ``prefilter`` attributes are used.
+    """
+    def __init__(self, lexicons):
+        self.lexicons = list(lexicons)
+        self._prefix_lexicons = []
+        trie_lexicons = []
+        for idx, known in enumerate(self.lexicons):
+            if isinstance(known, LongestMatch):
+                lm, known = known, known.known
+            else:
+                lm = None
+            if hasattr(known, 'prefixes'):
+                lm = lm or LongestMatch(known)
+                self._prefix_lexicons.append((idx, known, lm.max_length,
+                                              lm.prefilter))
+            else:
+                trie_lexicons.append((idx, known))
+        self._token_trie = _build_token_trie_multi(trie_lexicons)
+        self._mask_indices = {}
+
+    def find_ranges(self, tokens):
+        matches = [[] for _ in self.lexicons]
+        self._find_token_trie_matches(tokens, matches)
+        if self._prefix_lexicons:
+            joined = _JoinedTokens(tokens)
+            for idx, known, max_length, prefilter in self._prefix_lexicons:
+                matches[idx] = _find_prefix_matches(known, max_length, joined,
+                                                    prefilter)
+
+        return [
+            sorted(_remove_overlapping(
+                sorted(ranges, key=lambda k: k[1]-k[0], reverse=True)
+            ))
+            for ranges in matches
+        ]
+
+    def _find_token_trie_matches(self, tokens, matches):
+        trie = self._token_trie
+        for i in range(len(tokens)):
+            node = trie
+            ends = {}  # lexicon index -> end of the longest match
+            for j in range(i, len(tokens)):
+                node = node.get(tokens[j])
+                if node is None:
+                    break
+                if _TRIE_KEY in node:
+                    for idx in self._get_mask_indices(node[_TRIE_KEY]):
+                        ends[idx] = j+1
+            for idx, end in ends.items():
+                matches[idx].append((i, end, " ".join(tokens[i:end])))
+
+    def _get_mask_indices(self, mask):
+        if mask not in self._mask_indices:
+            self._mask_indices[mask] = [idx for idx in range(len(self.lexicons))
+                                        if mask & (1 << idx)]
+        return self._mask_indices[mask]
+
+    def __getstate__(self):
+        dct = self.__dict__.copy()
+        dct['_mask_indices'] = {}
+        return dct
+
+
+class TextNormalizer(object):
+    """
+    Callable which normalizes token strings for gazetteer matching::
+
+        >>> normalize = TextNormalizer(casefold=True, strip_diacritics=True,
+        ...                            collapse_punctuation=True)
+        >>> print(normalize(u'Zürich'))
+        zurich
+        >>> print(normalize(u'D.C.'))
+        dc
+        >>> print(normalize.normalize_key(u'São-Paulo  state'))
+        saopaulo  state
+
+    Options:
+
+    * ``casefold`` - apply Unicode case folding (lowercasing on Python 2);
+    * ``strip_diacritics`` - remove combining marks after NFKD
+      decomposition;
+    * ``collapse_punctuation`` - remove punctuation characters from tokens;
+      tokens which consist only of punctuation are kept as-is, so that
+      normalization never produces empty tokens.
+
+    Normalizers with the same options compare equal; :attr:`spec`
+    is a JSON-serializable dict with options which is stored in
+    gazetteer metadata (see :meth:`from_spec`).
+    """
+    _OPTIONS = ('casefold', 'strip_diacritics', 'collapse_punctuation')
+    _MAX_CACHE_SIZE = 100000
+
+    def __init__(self, casefold=False, strip_diacritics=False,
+                 collapse_punctuation=False):
+        self.casefold = casefold
+        self.strip_diacritics = strip_diacritics
+        self.collapse_punctuation = collapse_punctuation
+        self._cache = {}
+
+    @property
+    def spec(self):
+        return {name: bool(getattr(self, name)) for name in self._OPTIONS}
+
+    @classmethod
+    def from_spec(cls, spec):
+        """
+        Create a normalizer from a ``spec`` dict (or return None
+        if ``spec`` is None or doesn't enable any option).
+        """
+        if not spec or not any(spec.values()):
+            return None
+        return cls(**spec)
+
+    def __call__(self, token):
+        try:
+            return self._cache[token]
+        except KeyError:
+            if len(self._cache) >= self._MAX_CACHE_SIZE:
+                self._cache.clear()
+            value = self._cache[token] = self._normalize(token)
+            return value
+
+    def _normalize(self, token):
+        text = token
+        if self.casefold:
+            text = text.casefold() if hasattr(text, 'casefold') else text.lower()
+        if self.strip_diacritics:
+            text = unicodedata.normalize('NFKD', text)
+            text = u''.join(ch for ch in text if not unicodedata.combining(ch))
+            text = unicodedata.normalize('NFC', text)
+        if self.collapse_punctuation:
+            stripped = u''.join(ch for ch in text
+                                if not unicodedata.category(ch).startswith('P'))
+            if stripped:
+                text = stripped
+        return text
+
+    def normalize_key(self, key):
+        """ Normalize each space-separated token of a lexicon ``key`` """
+        return u' '.join(self(token) for token in key.split(u' '))
+
+    def _key(self):
+        return tuple(bool(getattr(self, name)) for name in self._OPTIONS)
+
+    def __eq__(self, other):
+        return isinstance(other, TextNormalizer) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __getstate__(self):
+        dct = self.__dict__.copy()
+        dct['_cache'] = {}
+        return dct
+
+    def __repr__(self):
+        options = ", ".join("%s=True" % name for name in self._OPTIONS
+                            if getattr(self, name))
+        return "TextNormalizer(%s)" % options
+
+
 def substrings(txt, min_length, max_length, pad=''):
     """
     >>> substrings("abc", 1, 100)
@@ -20,6 +20,8 @@ from webstruct import HtmlFeatureExtractor
 from webstruct.base import BaseSequenceClassifier
 from webstruct.utils import get_combined_keys, run_command
 from webstruct._fileresource import FileResource
+from webstruct.feature_hashing import HashedFeatures
+from webstruct.feature_matrix import FeatureMatrix
 from webstruct.sequence_encoding import IobEncoder
 
 
@@ -347,7 +349,8 @@ class WapitiFeatureEncoder(BaseEstimator, TransformerMixin):
         """
         X should be a list of lists of dicts with features.
         It can be obtained, for example, using
-        :class:`~.HtmlFeatureExtractor`.
+        :class:`~.HtmlFeatureExtractor`. X can also be
+        a :class:`~.FeatureMatrix`.
         """
         return self.partial_fit(X)
 
@@ -355,7 +358,12 @@ class WapitiFeatureEncoder(BaseEstimator, TransformerMixin):
         keys = set(self.feature_names_ or set())
         move_to_front = set(self.move_to_front)
 
+        if isinstance(X, FeatureMatrix):
+            X = [[dict.fromkeys(X.names)]]
         for feature_dicts in X:
+            if isinstance(feature_dicts, HashedFeatures):
+                raise ValueError("Wapiti templates refer to feature names; "
+                                 "hashed features can't be used with Wapiti")
             keys = (keys | get_combined_keys(feature_dicts)) - move_to_front
 
         self.feature_names_ = self.move_to_front + tuple(keys)
@@ -374,8 +382,15 @@ class WapitiFeatureEncoder(BaseEstimator, TransformerMixin):
         return lines
 
     def transform(self, X):
+        if isinstance(X, FeatureMatrix):
+            return [self._transform_matrix_document(X, idx)
+                    for idx in range(len(X))]
         return [self.transform_single(feature_dicts) for feature_dicts in X]
 
+    def _transform_matrix_document(self, X, idx):
+        table = X.to_columns(idx, self.feature_names_, _tostr, _tostr(None))
+        return [' '.join(row) for row in table.tolist()]
+
     def prepare_template(self, template):
         r"""
         Prepare Wapiti template by replacing feature names with feature